@@ -0,0 +1,206 @@
+#! /usr/bin/env python
+
+# Standard Imports
+import errno
+import fnmatch
+import hashlib
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+import threading
+from threading import Lock
+
+# kitir Imports
+from kitir import *
+
+# logging
+log = logging.getLogger('kitir.utils.copy')
+
+# the most bytes asked from the kernel in one copy_file_range/sendfile call
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+# skip_unchanged modes of sync_copy: mtime compares size and mtime, hash compares size and content
+COPY_SKIP_MODES = ('mtime', 'hash')
+# errors that mean the kernel can not copy between these files, the copy falls back to the next method
+_COPY_FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF}
+
+
+class CopyReport(object):
+    """what a sync_copy did, safe to update from many threads"""
+
+    def __init__(self):
+        self.files_copied = 0
+        self.bytes_copied = 0
+        self.files_skipped = 0
+        self.bytes_skipped = 0
+        self.errors = []  # (path, exception)
+        self._lock = Lock()
+
+    def add_copied(self, size):
+        with self._lock:
+            self.files_copied += 1
+            self.bytes_copied += size
+
+    def add_skipped(self, size):
+        with self._lock:
+            self.files_skipped += 1
+            self.bytes_skipped += size
+
+    def add_error(self, path, exc):
+        with self._lock:
+            self.errors.append((path, exc))
+
+    def summary(self):
+        return {
+            'files_copied': self.files_copied,
+            'bytes_copied': self.bytes_copied,
+            'files_skipped': self.files_skipped,
+            'bytes_skipped': self.bytes_skipped,
+            'errors': len(self.errors),
+        }
+
+    def __repr__(self):
+        return '<CopyReport {}>'.format(' '.join('{}={}'.format(k, v) for k, v in self.summary().items()))
+
+
+def _kernel_copy(copy_func, src_fd, dst_fd, size):
+    """copy with copy_file_range or sendfile, returns False when the kernel can not copy between these files"""
+    offset = 0
+    while offset < size:
+        try:
+            sent = copy_func(src_fd, dst_fd, min(COPY_CHUNK_SIZE, size - offset), offset)
+        except OSError as exc:
+            if exc.errno in _COPY_FALLBACK_ERRNOS and offset == 0:
+                return False
+            raise
+        if sent == 0:
+            break  # the file shrank while copying
+        offset += sent
+    return True
+
+
+def _copy_file_range(src_fd, dst_fd, count, offset):
+    return os.copy_file_range(src_fd, dst_fd, count, offset)
+
+
+def _sendfile(src_fd, dst_fd, count, offset):
+    return os.sendfile(dst_fd, src_fd, offset, count)
+
+
+def copy_file(src, dst):
+    """
+    copy a file with its mode and times (like shutil.copy2), the data is copied by the kernel when possible:
+    copy_file_range (which can share blocks or copy server side, on file systems that support it),
+    then sendfile, then a read/write loop.
+    the copy is written next to dst and renamed over it, so a dst that is a hardlink (e.g. of a ContentStore
+    object) is replaced, not changed in place
+    :param src: source file
+    :param dst: destination file (not a directory)
+    :raise shutil.SameFileError: src and dst are the same file (the same path, or hardlinks)
+    :return: bytes copied
+    """
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        raise shutil.SameFileError('{!r} and {!r} are the same file'.format(src, dst))
+    tmp_dst = '{}.tmp{}.{}'.format(dst, os.getpid(), threading.get_ident())
+    try:
+        with open(src, 'rb') as fsrc, open(tmp_dst, 'wb') as fdst:
+            size = os.fstat(fsrc.fileno()).st_size
+            copied = False
+            if size:
+                for name, copy_func in (('copy_file_range', _copy_file_range), ('sendfile', _sendfile)):
+                    if hasattr(os, name):
+                        copied = _kernel_copy(copy_func, fsrc.fileno(), fdst.fileno(), size)
+                        if copied:
+                            break
+            if not copied:
+                shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+        shutil.copystat(src, tmp_dst)
+        os.replace(tmp_dst, dst)
+    finally:
+        if os.path.exists(tmp_dst):
+            os.unlink(tmp_dst)
+    return size
+
+
+def _file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def _is_unchanged(src, src_stat, dst, skip_unchanged):
+    try:
+        dst_stat = os.stat(dst)
+    except OSError:
+        return False
+    if dst_stat.st_size != src_stat.st_size:
+        return False
+    if skip_unchanged == 'hash':
+        return _file_digest(src) == _file_digest(dst)
+    # copy_file keeps the mtime, so an unchanged file has the same one (within the precision of the file system)
+    return abs(dst_stat.st_mtime - src_stat.st_mtime) < 1e-3
+
+
+def sync_copy(src, dst, workers=None, skip_unchanged='mtime', ignore_patterns=(), raise_on_fail=True):
+    """
+    copy a directory tree (or a file) into dst like rsync: dst mirrors src, files are copied by many threads
+    with copy_file, and with skip_unchanged files that are the same in dst are not copied again.
+    files in dst that are not in src are left alone.
+    :param src: file or dir tree
+    :param dst: destination (the copy of src, not its parent)
+    :param workers: copy threads (default: 4 * cpu count, copies mostly wait on I/O)
+    :param skip_unchanged: None to copy everything, or one of COPY_SKIP_MODES
+    :param ignore_patterns: sequence of glob-style patterns of names to ignore (like shutil.ignore_patterns)
+    :param raise_on_fail: raise the first exception once all the copies are done
+    :return: CopyReport
+    """
+    assert not skip_unchanged or skip_unchanged in COPY_SKIP_MODES
+    log.debug('sync_copy: src={} dst={} skip_unchanged={}'.format(src, dst, skip_unchanged))
+    report = CopyReport()
+    ignore_rx = re.compile('|'.join(fnmatch.translate(p) for p in ignore_patterns)) if ignore_patterns else None
+
+    def _copy(src_path, src_stat, dst_path):
+        try:
+            if skip_unchanged and _is_unchanged(src_path, src_stat, dst_path, skip_unchanged):
+                report.add_skipped(src_stat.st_size)
+            else:
+                report.add_copied(copy_file(src_path, dst_path))
+        except shutil.SameFileError:
+            report.add_skipped(src_stat.st_size)  # dst is src (a hardlink), nothing to copy
+        except OSError as exc:
+            log.error('sync_copy failed copying file: src={} dst={} exc={}'.format(src_path, dst_path, exc))
+            report.add_error(src_path, exc)
+
+    if not os.path.isdir(src):
+        os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+        _copy(src, os.stat(src), dst)
+    else:
+        with ThreadPoolExecutor(max_workers=workers or 4 * (os.cpu_count() or 1)) as pool:
+            pending_dirs = [(src, dst)]
+            while pending_dirs:
+                src_dir, dst_dir = pending_dirs.pop()
+                try:
+                    os.makedirs(dst_dir, exist_ok=True)
+                    entries = list(os.scandir(src_dir))
+                except OSError as exc:
+                    log.error('sync_copy failed copying dir: src={} dst={} exc={}'.format(src_dir, dst_dir, exc))
+                    report.add_error(src_dir, exc)
+                    continue
+                for entry in entries:
+                    if ignore_rx is not None and ignore_rx.match(entry.name):
+                        continue
+                    dst_path = os.path.join(dst_dir, entry.name)
+                    if entry.is_dir():
+                        pending_dirs.append((entry.path, dst_path))
+                    else:
+                        pool.submit(_copy, entry.path, entry.stat(), dst_path)
+
+    log.info('sync_copy done: src={} dst={} {}'.format(
+        src, dst, ' '.join('{}={}'.format(k, v) for k, v in report.summary().items())))
+    if report.errors and raise_on_fail:
+        raise report.errors[0][1]
+    return report
+
+
+__all__ = ['CopyReport', 'COPY_SKIP_MODES', 'copy_file', 'sync_copy']
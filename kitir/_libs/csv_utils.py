@@ -2,6 +2,7 @@
 
 # Standard Imports
 import csv
+import json
 
 # kitir Imports
 from kitir import *
@@ -68,4 +69,95 @@ def read_ssv_from_string(text, return_headers=False):
     return rows
 
 
-__all__ = ['read_csv_from_string', 'read_tsv_from_string', 'read_ssv_from_string']
+# the formats a RowParser can parse, and the csv dialect of each (jsonl is json lines, one object per line)
+ROW_FORMATS = {
+    'csv': 'excel',
+    'tsv': 'excel-tab',
+    'ssv': 'excel-space',
+    'jsonl': None,
+}
+
+
+class RowParser(object):
+    """
+    Parses lines into rows as they arrive, for parsing the output of a command while it is running
+    (see iexec parse_rows) instead of joining it into a string and splitting it again once it is done.
+    csv formats: the first line is the headers and rows are dicts like DictReader's (or lists with as_dict=False),
+    a quoted field that spans lines is kept until its closing quote arrives. jsonl: every line is a json value.
+    """
+
+    def __init__(self, fmt='csv', as_dict=True, on_row=None):
+        """
+        :param fmt: one of ROW_FORMATS
+        :param as_dict: rows are dicts (by headers) instead of lists, not used for jsonl
+        :param on_row: callable called with every row as soon as it is parsed
+        """
+        if fmt not in ROW_FORMATS:
+            raise ValueError('unknown row format: {} (expected one of {})'.format(fmt, sorted(ROW_FORMATS)))
+        self.fmt = fmt
+        self.dialect = csv.get_dialect(ROW_FORMATS[fmt]) if ROW_FORMATS[fmt] else None
+        self.as_dict = as_dict
+        self.on_row = on_row
+        self.headers = None
+        self.rows = []
+        self._pending = ''
+
+    def feed(self, line):
+        """parse a line (with or without its newline)"""
+        if self.dialect is None:
+            line = line.strip()
+            if line:
+                self._add(json.loads(line))
+            return
+        self._pending += line
+        if self._pending.count(self.dialect.quotechar) % 2:
+            return  # inside a quoted field, wait for the rest of it
+        text, self._pending = self._pending, ''
+        self._parse(text)
+
+    def close(self):
+        """parse whatever is left (a last line with an unterminated quote)"""
+        if self._pending:
+            text, self._pending = self._pending, ''
+            self._parse(text)
+        return self.rows
+
+    def _parse(self, text):
+        for values in csv.reader([text], dialect=self.dialect):
+            if not values:
+                continue  # blank lines are skipped, like DictReader does
+            if self.headers is None:
+                self.headers = values
+                if self.as_dict:
+                    continue
+            if self.as_dict:
+                row = dict(zip(self.headers, values))
+                if len(values) > len(self.headers):
+                    row[None] = values[len(self.headers):]
+                for header in self.headers[len(values):]:
+                    row[header] = None
+                values = row
+            self._add(values)
+
+    def _add(self, row):
+        self.rows.append(row)
+        if self.on_row is not None:
+            self.on_row(row)
+
+
+def read_rows_from_lines(lines, fmt='csv', as_dict=True):
+    """
+    parses an iterable of lines (a file, a command's out list) into rows, without joining them into a string
+    :param lines: iterable of lines
+    :param fmt: one of ROW_FORMATS (csv, tsv, ssv, jsonl)
+    :param as_dict: rows are dicts (by headers) instead of lists
+    :return: rows
+    """
+    parser = RowParser(fmt, as_dict=as_dict)
+    for line in lines:
+        parser.feed(line)
+    return parser.close()
+
+
+__all__ = ['read_csv_from_string', 'read_tsv_from_string', 'read_ssv_from_string', 'read_rows_from_lines',
+           'RowParser', 'ROW_FORMATS']
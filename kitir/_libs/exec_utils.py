@@ -1,22 +1,36 @@
 #! /usr/bin/env python
 
 # Standard Imports
+import io
+import codecs
+import locale
+import shlex
+import shutil
 import select
+import signal
 import subprocess
+import functools
+import hashlib
+import bisect
+import re
 import time
 import tempfile
 import pickle
 import itertools
 import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime
 from collections import OrderedDict
-from threading import Thread
+from threading import Thread, Lock
 from queue import Queue, Empty
 
 # Lib Imports
-from .file_utils import write_file, read_file, get_tmp_dir
+from .csv_utils import RowParser
+from .file_utils import write_file, read_file
 from .log_utils import get_log_func, log_datetime_format
 from .string_utils import get_datestring
+from .writer_utils import get_async_writer
 
 # kitir Imports
 from kitir import *
@@ -28,26 +42,229 @@ log = logging.getLogger('kitir.utils.exec')
 # kwargs for subprocess (used by iexec)
 SUBPROCESS_KWARGS = ['bufsize', 'executable', 'stdin', 'stdout', 'stderr',
                      'preexec_fn', 'close_fds', 'shell', 'cwd', 'env',
-                     'universal_newlines', 'startupinfo', 'creationflags']
+                     'universal_newlines', 'startupinfo', 'creationflags', 'start_new_session']
+
+# seconds to wait between SIGTERM and SIGKILL when a command times out (used by iexec)
+TIMEOUT_KILL_GRACE = 3
+# the resource usage collected for every command on linux (ExecResult.rusage key: struct rusage field)
+RUSAGE_FIELDS = OrderedDict([
+    ('cpu_user', 'ru_utime'),
+    ('cpu_sys', 'ru_stime'),
+    ('max_rss_kb', 'ru_maxrss'),
+    ('blocks_in', 'ru_inblock'),
+    ('blocks_out', 'ru_oublock'),
+    ('ctx_switches_voluntary', 'ru_nvcsw'),
+    ('ctx_switches_involuntary', 'ru_nivcsw'),
+])
+# bytes to read from a pipe at once (used by iexec)
+READ_CHUNK_SIZE = 65536
+# worker processes of the mpiexec pool (None is the cpu count)
+MPIEXEC_POOL_SIZE = None
+_mpiexec_pool = None
+_mpiexec_pool_lock = Lock()
+# when set, iexec starts commands through this spawn server instead of forking this process (see set_spawn_server)
+_default_spawn_server = None
+# when set, iexec writes dump and trace files through this writer in the background (see set_async_writer)
+_default_async_writer = None
+# when set, iexec waits for a free slot of this governor before starting a command (see set_exec_governor)
+_default_exec_governor = None
+# hooks called by iexec on every command (see add_exec_hook)
+_exec_hooks = []
+_exec_counter = itertools.count()
+
+
+def _freeze(value):
+    """make a value hashable (and with a stable repr) for use in a cache key"""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, (str, bytes, int, float, bool, type(None))):
+        return value
+    return repr(value)
+
+
+class ExecCache:
+    """
+    Cache of ExecResults for idempotent commands (status probes, versions), used by iexec(cmd, cache=...).
+    results expire after ttl seconds, the least recently used are evicted above max_size,
+    with disk_dir results are also pickled to disk and shared between processes (until they expire).
+    identical calls made while the command is running wait for its result instead of running it again.
+    only good results are cached (rc 0 and no timeout) unless cache_bad_rc is set.
+    a cached result is returned as is: on_row, alt_out, alt_err and the exec hooks are not called on a hit.
+    """
+
+    def __init__(self, ttl=60, max_size=256, disk_dir=None, cache_bad_rc=False):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.disk_dir = disk_dir
+        self.cache_bad_rc = cache_bad_rc
+        self._entries = OrderedDict()  # key: (expires_at, ExecResult)
+        self._inflight = {}  # key: Future
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(cmd, kwargs):
+        """the cache key: cmd, cwd, env, all the subprocess kwargs and the iexec options that affect the result"""
+        key_kwargs = {arg: kwargs[arg] for arg in SUBPROCESS_KWARGS if arg in kwargs}
+        key_kwargs['cwd'] = os.path.abspath(kwargs.get('cwd') or os.getcwd())
+        key_kwargs['env'] = kwargs.get('env') or dict(os.environ)
+        key_kwargs['text_mode'] = kwargs.get('text_mode', True)
+        parse_rows = kwargs.get('parse_rows')
+        if isinstance(parse_rows, RowParser):
+            parse_rows = (parse_rows.fmt, parse_rows.as_dict)
+        key_kwargs['parse_rows'] = parse_rows
+        return _freeze(cmd), _freeze(key_kwargs)
+
+    def _disk_path(self, key):
+        digest = hashlib.sha256(repr(key).encode('utf-8', errors='replace')).hexdigest()
+        return os.path.join(self.disk_dir, '{}.pickle'.format(digest))
+
+    def _load_from_disk(self, key):
+        path = self._disk_path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                return None
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def _save_to_disk(self, key, result):
+        path = self._disk_path(key)
+        tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        except OSError as exc:
+            log.warning('Exception saving exec cache to disk, ignoring: path={} exc={}'.format(path, exc))
+
+    def _lookup(self, key):
+        """find a fresh result in memory (then on disk), must hold the lock"""
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, result = entry
+            if time.monotonic() < expires_at:
+                self._entries.move_to_end(key)
+                return result
+            del self._entries[key]
+        if self.disk_dir:
+            result = self._load_from_disk(key)
+            if result is not None:
+                self._store(key, result)
+                return result
+        return None
+
+    def _store(self, key, result):
+        """keep a result in memory, evicting the least recently used, must hold the lock"""
+        self._entries[key] = (time.monotonic() + self.ttl, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def get_or_run(self, key, func):
+        """
+        return the cached result for key, or run func to get it (once, for all concurrent callers)
+        :param key: cache key (see make_key)
+        :param func: callable that returns an ExecResult
+        :return: ExecResult Object
+        """
+        with self._lock:
+            result = self._lookup(key)
+            if result is not None:
+                self.hits += 1
+                return result
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                self.misses += 1
+                future = self._inflight[key] = Future()
+        if not owner:
+            return future.result()
+        try:
+            result = func()
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            if self.cache_bad_rc or (result.good_rc and not result.timed_out):
+                with self._lock:
+                    self._store(key, result)
+                if self.disk_dir:
+                    self._save_to_disk(key, result)
+            return result
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def clear(self, disk=False):
+        """forget all the cached results, optionally delete them from disk as well"""
+        with self._lock:
+            self._entries.clear()
+        if disk and self.disk_dir and os.path.isdir(self.disk_dir):
+            for name in os.listdir(self.disk_dir):
+                if name.endswith('.pickle'):
+                    os.unlink(os.path.join(self.disk_dir, name))
+
+
+# the cache used by iexec(cmd, cache=True)
+default_exec_cache = ExecCache()
+
+
+@functools.lru_cache(maxsize=128)
+def _compile_patterns(patterns, regex=False, ignore_case=False):
+    """compile many patterns into one alternation, each in a named group so a match tells which pattern it was"""
+    parts = ['(?P<_p{}>{})'.format(idx, p if regex else re.escape(p)) for idx, p in enumerate(patterns)]
+    return re.compile('|'.join(parts), re.IGNORECASE if ignore_case else 0)
+
+
+def _found_patterns(patterns, text):
+    """the set of (plain string) patterns found in text"""
+    # a substring search per pattern is much faster than one alternation of many strings with re
+    return {p for p in patterns if p in text}
+
+
+def _send_result(conn, func, args, kwargs):
+    """MultiProcess target: run func and send its return value back over the pipe"""
+    try:
+        conn.send(func(*args, **kwargs))
+    finally:
+        conn.close()
 
 
 class MultiProcess:
     # todo: move to own util / document
     counter = itertools.count()
 
-    def __init__(self, name, func, args, kwargs):
+    def __init__(self, name, func, args, kwargs, return_result=False):
         self.name = name
         self.func = func
         self.args = args
         self.kwargs = kwargs
+        self.return_result = return_result
         self.proc = None
+        self._result_conn = None
 
     def wait_read_result(self):
-        self.join()
-        if not self.kwargs.get('pickle_result', False):
+        if not self.return_result:
+            self.join()
             return self.exitcode
-        with open(self.kwargs['pickle_result'], 'rb') as f:
-            return pickle.load(f)
+        # receive before joining, a large result would block the child on a full pipe
+        try:
+            result = self._result_conn.recv()
+        except EOFError:
+            self.join()
+            raise RuntimeError('process exited without a result: name={} exitcode={}'.format(
+                self.name, self.exitcode))
+        finally:
+            self._result_conn.close()
+        self.join()
+        return result
 
     def go(self):
         self.start()
@@ -55,8 +272,16 @@ class MultiProcess:
         return self.exitcode
 
     def start(self):
-        self.proc = multiprocessing.Process(target=self.func, name=self.name, args=self.args, kwargs=self.kwargs)
-        self.proc.start()
+        if self.return_result:
+            self._result_conn, child_conn = multiprocessing.Pipe(duplex=False)
+            self.proc = multiprocessing.Process(target=_send_result, name=self.name,
+                                                args=(child_conn, self.func, self.args, self.kwargs))
+            self.proc.start()
+            # only the child writes, so closing our copy lets recv see EOF if the child dies without sending
+            child_conn.close()
+        else:
+            self.proc = multiprocessing.Process(target=self.func, name=self.name, args=self.args, kwargs=self.kwargs)
+            self.proc.start()
 
     def join(self, timeout=None):
         self.proc.join(timeout)
@@ -81,20 +306,29 @@ class MultiProcess:
 
 class ExecResult:
     """Result of an execution. Has STDOUT and STDERR and RC."""
+    summary_headers = ('rc', 'time', 'out_size', 'err_size', 'cmd')
+
     def __init__(self, out=None, err=None, rc=0, time_taken=None, cmd=None, ordered_out=None, start=None, timeout=0,
-                 subprocess_kwargs=None):
+                 subprocess_kwargs=None, timed_out=False, rusage=None):
         self.out = out or []
         self.err = err or []
         self.rc = rc
         self.__out = ''
         self.__err = ''
+        self.__line_index = {}
         self.time = time_taken
         self.start = start
         self.start_datetime = datetime.fromtimestamp(start).strftime(log_datetime_format)
         self.timeout = timeout
+        self.timed_out = timed_out
         self.cmd = cmd
         self.ordered_out = ordered_out
         self.subprocess_kwargs = subprocess_kwargs or {}
+        self.rusage = rusage or OrderedDict()  # resource usage of the command (see RUSAGE_FIELDS)
+        self.queue_time = 0  # seconds waited for a governor slot before starting
+        self.rows = None  # stdout parsed into rows, with iexec parse_rows (see RowParser)
+        self.headers = None
+        self.exception = None  # the exception that kept the command from running, with iexec_many
 
     def contents(self):
         """Returns all the content of the execution as a string, ordered if possible, else stdout first then stderr"""
@@ -127,6 +361,12 @@ class ExecResult:
         """
         if isinstance(content, str):
             return bool(self.out_contains(content) or self.err_contains(content))
+        content = tuple(content)  # a generator can only be iterated once
+        if not content:
+            return collection_func(())
+        elif all(isinstance(c, str) for c in content):
+            found = _found_patterns(content, self.out_string) | _found_patterns(content, self.err_string)
+            return collection_func(c in found for c in content)
         else:
             return collection_func(self.contains(c, collection_func) for c in content)
 
@@ -136,23 +376,93 @@ class ExecResult:
         if isinstance(content, str):
             return bool(content in collection)
         elif isinstance(content, list):
-            return all(c in collection for c in content)
+            if not content:
+                return True
+            return len(_found_patterns(content, collection)) == len(set(content))
         else:
             raise ValueError('Unsupported type: type={}'.format(type(content)))
 
+    def _get_text(self, source):
+        """the text to search and its line index (offsets where each line starts), source is out, err or all"""
+        if source == 'out':
+            text = self.out_string
+        elif source == 'err':
+            text = self.err_string
+        elif source == 'all':
+            text = self.contents()
+        else:
+            raise ValueError('Unsupported source: source={}'.format(source))
+        if source not in self.__line_index:
+            self.__line_index[source] = [0] + [mo.end() for mo in re.finditer('\n', text)]
+        return text, self.__line_index[source]
+
+    def _iter_matches(self, patterns, regex, source, ignore_case):
+        """yields (line_number, pattern, match) for every match of any pattern, in a single scan"""
+        if isinstance(patterns, str):
+            patterns = [patterns]
+        patterns = tuple(patterns)
+        text, line_index = self._get_text(source)
+        for mo in _compile_patterns(patterns, regex, ignore_case).finditer(text):
+            yield bisect.bisect_right(line_index, mo.start()), patterns[int(mo.lastgroup[2:])], mo
+
+    def findall(self, patterns, regex=False, source='all', ignore_case=False):
+        """
+        Find all the matches of one or many patterns (strings, or regular expressions with regex=True)
+        :param patterns: string or collection of strings
+        :param regex: the patterns are regular expressions
+        :param source: search in out, err or all (the ordered contents)
+        :param ignore_case: case insensitive search
+        :return: list of (line_number, pattern, matched text), line numbers start at 1
+        """
+        return [(line_number, pattern, mo.group()) for line_number, pattern, mo in
+                self._iter_matches(patterns, regex, source, ignore_case)]
+
+    def first_match(self, patterns, regex=False, source='all', ignore_case=False):
+        """
+        Find the first match of any of the patterns, see findall
+        :return: (line_number, pattern, matched text) or None
+        """
+        for line_number, pattern, mo in self._iter_matches(patterns, regex, source, ignore_case):
+            return line_number, pattern, mo.group()
+        return None
+
+    def grep(self, patterns, regex=False, source='all', ignore_case=False):
+        """
+        Find the lines that match any of the patterns, see findall
+        :return: list of (line_number, line) with the newline stripped
+        """
+        text, line_index = self._get_text(source)
+        lines = []
+        for line_number, _, _ in self._iter_matches(patterns, regex, source, ignore_case):
+            if lines and lines[-1][0] == line_number:
+                continue
+            end = line_index[line_number] - 1 if line_number < len(line_index) else len(text)
+            lines.append((line_number, text[line_index[line_number - 1]:end]))
+        return lines
+
     def debug_output(self, dump_kwargs=False):
         """returns a debug output string that is ready for printing or writing"""
         return self.get_dump_data(dump_kwargs)
 
     def get_dump_header(self, as_str=True):
-        """Formats all headers for dumping; cmd, rc, start, time"""
-        headers = ['cmd', 'rc', 'start', 'start_datetime', 'time']
+        """Formats all headers for dumping; cmd, rc, start, time, and resource usage if collected"""
+        headers = ['cmd', 'rc', 'start', 'start_datetime', 'time', 'timed_out']
+        head = OrderedDict((h, getattr(self, h)) for h in headers)
+        head.update(self.rusage)
         if as_str:
-            head = '\n'.join(['{}: {}'.format(h, getattr(self, h)) for h in headers])
-        else:
-            head = OrderedDict((h, getattr(self, h)) for h in headers)
+            head = '\n'.join(['{}: {}'.format(h, v) for h, v in head.items()])
         return head
 
+    def get_summary(self):
+        """Formats a short summary of the execution; rc, time, out_size, err_size, cmd"""
+        return OrderedDict([
+            ('rc', self.rc),
+            ('time', '{:.3f}'.format(self.time or 0)),
+            ('out_size', len(self.out_string)),
+            ('err_size', len(self.err_string)),
+            ('cmd', self.cmd),
+        ])
+
     def get_subprocess_kwargs_dump(self):
         """gets the subprocess kwargs that were passed to the iexec, if any"""
         if self.subprocess_kwargs:
@@ -197,6 +507,18 @@ class ExecResult:
             self.__err = ''.join(self.err)
         return self.__err
 
+    @property
+    def cpu_time(self):
+        """user + sys cpu seconds of the command (and the children it waited for), None if not collected"""
+        if not self.rusage:
+            return None
+        return self.rusage['cpu_user'] + self.rusage['cpu_sys']
+
+    @property
+    def max_rss(self):
+        """peak resident memory (KB) of the command or its largest waited for child, None if not collected"""
+        return self.rusage.get('max_rss_kb')
+
     @property
     def bad_rc(self):
         return self.rc != 0
@@ -214,13 +536,216 @@ class ExecResult:
         return not self.bad
 
     def __repr__(self):
-        return 'ExecResult(cmd={} out={} err={} rc={} start={} time={} timeout={} kwargs={})'.format(
-            self.cmd, self.out, self.err, self.rc, self.start, self.time, self.timeout, self.subprocess_kwargs)
+        return 'ExecResult(cmd={} out={} err={} rc={} start={} time={} timeout={} timed_out={} kwargs={})'.format(
+            self.cmd, self.out, self.err, self.rc, self.start, self.time, self.timeout, self.timed_out,
+            self.subprocess_kwargs)
 
     def __str__(self):
         return str(self.__repr__())
 
 
+class _PipeLines:
+    """splits raw chunks read from a pipe into lines, decoding them first when in text mode"""
+
+    def __init__(self, on_line, text_mode):
+        self.on_line = on_line
+        if text_mode:
+            # same decoding and newline translation that Popen(text=True) would have done
+            decoder = codecs.getincrementaldecoder(locale.getpreferredencoding(False))(errors='replace')
+            self.decoder = io.IncrementalNewlineDecoder(decoder, translate=True)
+            self.newline = '\n'
+        else:
+            self.decoder = None
+            self.newline = b'\n'
+        self.pending = self.newline[:0]
+
+    def feed(self, chunk, final=False):
+        """feed a chunk, calls on_line for every complete line (and for the remainder if final)"""
+        if self.decoder is not None:
+            chunk = self.decoder.decode(chunk, final=final)
+        lines = (self.pending + chunk).split(self.newline)
+        self.pending = lines.pop()
+        for line in lines:
+            self.on_line(line + self.newline)
+        if final and self.pending:
+            self.on_line(self.pending)
+            self.pending = self.pending[:0]
+
+    def close(self):
+        self.feed(b'', final=True)
+
+
+def _kill_process_group(proc, grace=TIMEOUT_KILL_GRACE):
+    """
+    SIGTERM the process group of proc, give it grace seconds to exit, then SIGKILL whatever is left
+    if proc does not lead its own process group (no start_new_session) only proc itself is signalled
+    :return: (rc, rusage dict) see _wait_with_rusage
+    """
+    try:
+        own_group = os.getpgid(proc.pid) == proc.pid
+    except ProcessLookupError:
+        own_group = False
+
+    def _signal(sig):
+        try:
+            if own_group:
+                os.killpg(proc.pid, sig)
+            else:
+                proc.send_signal(sig)
+        except ProcessLookupError:
+            pass
+
+    _signal(signal.SIGTERM)
+    try:
+        return _wait_with_rusage(proc, grace)
+    except subprocess.TimeoutExpired:
+        pass
+    finally:
+        # kill the group even if the leader exited, there may be children left behind holding our pipes
+        _signal(signal.SIGKILL)
+    return _wait_with_rusage(proc)
+
+
+def _wait_with_rusage(proc, timeout=None):
+    """
+    reap proc with os.wait4 to also get its resource usage, returns (rc, rusage dict)
+    the rusage is empty when it can not be collected (not our child, or it was already reaped)
+    Popen.wait is not used until then, it would reap proc without the rusage
+    :param timeout: seconds to wait, raises subprocess.TimeoutExpired if proc is still running
+    """
+    if proc.returncode is not None or not hasattr(os, 'wait4'):
+        return proc.wait(timeout), OrderedDict()
+    end = None if timeout is None else time.monotonic() + timeout
+    delay = 0.0005
+    try:
+        while True:
+            pid, status, rusage = os.wait4(proc.pid, 0 if end is None else os.WNOHANG)
+            if pid:
+                break
+            remaining = end - time.monotonic()
+            if remaining <= 0:
+                raise subprocess.TimeoutExpired(proc.args, timeout)
+            # polling with a growing delay, like Popen.wait with a timeout
+            time.sleep(min(delay, remaining))
+            delay = min(delay * 2, 0.05)
+    except ChildProcessError:
+        return proc.wait(timeout), OrderedDict()
+    if os.WIFSIGNALED(status):
+        proc.returncode = -os.WTERMSIG(status)
+    else:
+        proc.returncode = os.WEXITSTATUS(status)
+    return proc.returncode, OrderedDict((key, getattr(rusage, field)) for key, field in RUSAGE_FIELDS.items())
+
+
+def _drain_pipes(pipes, wait_time=0.1):
+    """read whatever is left in the pipes without blocking on writers that never close them"""
+    while pipes:
+        ready, _, _ = select.select(list(pipes), [], [], wait_time)
+        if not ready:
+            break
+        for fd in ready:
+            chunk = os.read(fd, READ_CHUNK_SIZE)
+            if chunk:
+                pipes[fd].feed(chunk)
+            else:
+                pipes.pop(fd).close()
+    for lines in pipes.values():
+        lines.close()
+
+
+@functools.lru_cache(maxsize=256)
+def _resolve_executable(name, search_path):
+    """resolve a bare program name on the search path once, the full path lets Popen take its posix_spawn path"""
+    if os.sep in name or (os.altsep and os.altsep in name):
+        return name
+    return shutil.which(name, path=search_path) or name
+
+
+def _argv_cmdline(argv):
+    """a printable command line for an argv, used for logs and the ExecResult"""
+    if running_on_windows:
+        return subprocess.list2cmdline(argv)
+    return ' '.join(shlex.quote(arg) for arg in argv)
+
+
+class ExecHook(object):
+    """
+    Base class for iexec hooks (see add_exec_hook), override the events you need.
+    exec_id is unique per command, to match the events of commands that run concurrently.
+    hooks are called in the thread that runs iexec, exceptions they raise are logged and ignored.
+    """
+
+    def on_start(self, exec_id, cmd, start, pid):
+        """the command was started, start is a time.time() timestamp"""
+
+    def on_output_chunk(self, exec_id, cmd, stream, size, elapsed):
+        """the command wrote a line (size characters) to stream (out or err), elapsed seconds since start"""
+
+    def on_exit(self, exec_id, cmd, result):
+        """the command completed, result is its ExecResult (rc, time, timed_out, rusage, ...)"""
+
+
+def add_exec_hook(hook):
+    """
+    Add a hook that iexec calls on every command
+    :param hook: an ExecHook (or any object with on_start, on_output_chunk and on_exit)
+    :return: the hook
+    """
+    if hook not in _exec_hooks:
+        _exec_hooks.append(hook)
+    return hook
+
+
+def remove_exec_hook(hook):
+    """Remove a hook that was added with add_exec_hook"""
+    if hook in _exec_hooks:
+        _exec_hooks.remove(hook)
+
+
+def _call_hooks(hooks, event, *args):
+    for hook in hooks:
+        try:
+            getattr(hook, event)(*args)
+        except Exception as exc:
+            log.error('Exception in exec hook, ignoring: hook={} event={} exc={}'.format(hook, event, exc))
+
+
+def set_spawn_server(spawn_server):
+    """
+    Make iexec start its commands through a spawn server (see kitir.kits.spawn_server), None to stop.
+    A spawn server is any object with popen(args, **subprocess_kwargs) that returns a Popen-like object.
+    :param spawn_server: the spawn server, should already be started
+    :return: the previous spawn server
+    """
+    global _default_spawn_server
+    previous, _default_spawn_server = _default_spawn_server, spawn_server
+    return previous
+
+
+def set_async_writer(async_writer):
+    """
+    Make iexec write its dump_file and trace_file in the background, None to write them directly again.
+    :param async_writer: an AsyncFileWriter, or True for the shared one (see get_async_writer)
+    :return: the previous writer
+    """
+    global _default_async_writer
+    if async_writer is True:
+        async_writer = get_async_writer()
+    previous, _default_async_writer = _default_async_writer, async_writer
+    return previous
+
+
+def set_exec_governor(governor):
+    """
+    Limit the number of commands iexec runs at once (in all threads, and with slots_dir in all processes).
+    :param governor: an ExecGovernor, None for no limit
+    :return: the previous governor
+    """
+    global _default_exec_governor
+    previous, _default_exec_governor = _default_exec_governor, governor
+    return previous
+
+
 def detached_iexec(cmd, **kwargs):
     """
     Multiprocess iexec, perform a command on local machine with a separate process.
@@ -231,30 +756,152 @@ def detached_iexec(cmd, **kwargs):
     :return: MultiProcess Object to query until you get an ExecResult Object
     """
     entity = 'mpiexec.{}'.format(next(MultiProcess.counter))
+    # the ExecResult is sent back over a pipe, wait_read_result returns it
+    return_result = bool(kwargs.pop('pickle_result', False))
 
-    if kwargs.get('pickle_result', False):
-        pickle_file = os.path.join(get_tmp_dir(use_logging=False), entity)
-        kwargs['pickle_result'] = pickle_file
-
-    mp = MultiProcess(entity, iexec, [cmd], kwargs)
+    mp = MultiProcess(entity, iexec, [cmd], kwargs, return_result=return_result)
     mp.start()
     return mp
 
 
+def _get_mpiexec_pool():
+    """the process pool used by mpiexec, started on first use and reused by all calls"""
+    global _mpiexec_pool
+    with _mpiexec_pool_lock:
+        if _mpiexec_pool is None:
+            _mpiexec_pool = ProcessPoolExecutor(max_workers=MPIEXEC_POOL_SIZE or multiprocessing.cpu_count())
+        return _mpiexec_pool
+
+
+def _drop_mpiexec_pool(pool):
+    """forget a broken pool, unless another call has replaced it already"""
+    global _mpiexec_pool
+    with _mpiexec_pool_lock:
+        if _mpiexec_pool is not pool:
+            return
+        _mpiexec_pool = None
+    pool.shutdown(wait=False)
+
+
+def shutdown_mpiexec_pool(wait_for_workers=True):
+    """stop the worker processes of mpiexec, a new pool is started by the next mpiexec"""
+    global _mpiexec_pool
+    with _mpiexec_pool_lock:
+        pool, _mpiexec_pool = _mpiexec_pool, None
+    if pool is not None:
+        pool.shutdown(wait=wait_for_workers)
+
+
+def _mpiexec_worker(cwd, environ, cmd, kwargs):
+    """runs iexec in a pool worker, in the cwd and environment of the caller (the worker has those of its start)"""
+    os.chdir(cwd)
+    if os.environ != environ:
+        os.environ.clear()
+        os.environ.update(environ)
+    return iexec(cmd, **kwargs)
+
+
 def mpiexec(cmd, **kwargs):
     """
     Multiprocess iexec, perform a command on local machine with a separate process.
+    the command runs in a worker of a process pool which is reused between calls (see MPIEXEC_POOL_SIZE),
+    in the current cwd and os.environ of the caller.
+    the ExecResult is sent back over a pipe, so kwargs (alt_out callables too) must be picklable.
+    a command whose worker dies while running it (killed, out of memory) raises BrokenProcessPool, it is not retried
     :param cmd: the command
     :param kwargs: any kwargs
     :return: ExecResult Object
     """
-    entity = 'mpiexec.{}'.format(next(MultiProcess.counter))
-    pickle_file = os.path.join(get_tmp_dir(use_logging=False), entity)
-    kwargs['pickle_result'] = pickle_file
-    mp = MultiProcess(entity, iexec, [cmd], kwargs)
-    mp.go()
-    with open(pickle_file, 'rb') as f:
-        return pickle.load(f)
+    kwargs.pop('pickle_result', None)
+    args = (_mpiexec_worker, os.getcwd(), dict(os.environ), cmd, kwargs)
+    pool = _get_mpiexec_pool()
+    try:
+        future = pool.submit(*args)
+    except BrokenProcessPool as exc:
+        # a worker died earlier, the pool is not usable anymore and the command has not started, use a new one
+        log.warning('mpiexec pool is broken, starting a new pool: cmd={} exc={}'.format(cmd, exc))
+        _drop_mpiexec_pool(pool)
+        pool = _get_mpiexec_pool()
+        future = pool.submit(*args)
+    try:
+        return future.result()
+    except BrokenProcessPool as exc:
+        # the command may have run (partly), running it again is up to the caller
+        log.error('mpiexec worker died running the command: cmd={} exc={}'.format(cmd, exc))
+        _drop_mpiexec_pool(pool)
+        raise
+
+
+def iexec_many(cmds, max_parallel=None, fail_fast=False, **kwargs):
+    """
+    Perform many commands on local machine concurrently, each one with iexec.
+    At most max_parallel commands run at once, the rest are launched as running ones complete.
+    yields each ExecResult as soon as its command completes (completion order, not cmds order)
+    a command that raises (e.g. a missing executable) yields a failed ExecResult (rc 1) with the exception
+    :param cmds: iterable of commands (anything iexec accepts)
+    :param max_parallel: maximum commands running at once (default: cpu count)
+    :param fail_fast: stop launching commands after the first bad rc (already running commands still finish)
+    :param kwargs: any kwargs, passed to every iexec
+    :return: generator of ExecResult Objects
+    """
+    max_parallel = max_parallel or multiprocessing.cpu_count()
+    assert isinstance(max_parallel, int) and max_parallel > 0
+    cmds = iter(cmds)
+    failed = False
+    executor = ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix='iexec_many')
+    running = set()
+    submitted = {}  # future: (cmd, start)
+    try:
+        while True:
+            # top up the running commands, unless we have failed fast
+            while not failed and len(running) < max_parallel:
+                try:
+                    cmd = next(cmds)
+                except StopIteration:
+                    break
+                future = executor.submit(iexec, cmd, **kwargs)
+                submitted[future] = (cmd, time.time())
+                running.add(future)
+            if not running:
+                break
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                cmd, start = submitted.pop(future)
+                try:
+                    result = future.result()
+                except Exception as exc:
+                    log.error('iexec_many command raised: cmd={} exc={}'.format(cmd, exc))
+                    result = ExecResult(err=['{}: {}\n'.format(type(exc).__name__, exc)], rc=1,
+                                        time_taken=time.time() - start, cmd=cmd, start=start)
+                    result.exception = exc
+                if fail_fast and result.bad_rc and not failed:
+                    log.debug('iexec_many failing fast, no more commands will start: cmd={} rc={}'.format(
+                        result.cmd, result.rc))
+                    failed = True
+                yield result
+    finally:
+        for future in running:
+            future.cancel()
+        executor.shutdown(wait=False)
+
+
+def exec_results_summary(results, as_str=True):
+    """
+    Summarize many ExecResults (for example from iexec_many) as a table of; cmd, rc, time, out_size, err_size
+    :param results: iterable of ExecResult Objects
+    :param as_str: return a formatted table string, else a list of OrderedDict rows
+    :return: table string or list of rows
+    """
+    rows = [result.get_summary() for result in results]
+    if not as_str:
+        return rows
+    headers = list(ExecResult.summary_headers)
+    table = [headers] + [[str(row[h]) for h in headers] for row in rows]
+    widths = [max(len(line[i]) for line in table) for i in range(len(headers))]
+    # cmd is the last column, so long commands don't stretch the others
+    lines = ['  '.join(cell.ljust(width) for cell, width in zip(line, widths)).rstrip() for line in table]
+    lines.insert(1, '  '.join('-' * width for width in widths))
+    return '\n'.join(lines)
 
 
 def iexec(cmd, **kwargs):
@@ -262,10 +909,34 @@ def iexec(cmd, **kwargs):
     Perform a command on local machine with subprocess.Popen
     contains many conveniences and logging capabilities
     returns an ExecResult object which also contains many conveniences
+    with timeout (seconds) the command (and its process group) is killed once the time is up,
+    the ExecResult is then flagged timed_out and holds the output captured until then
+    with shell=False the command is executed directly as an argv (a string cmd is split with shlex), no shell is
+    started, on linux the program is resolved on PATH and close_fds defaults to False so Popen can use posix_spawn
+    with async_writer=True (or an AsyncFileWriter) the dump_file and trace_file are written in the background
+    with governor (an ExecGovernor) the command waits for a free slot first, the wait is the result queue_time
+    with parse_rows (csv, tsv, ssv, jsonl or a RowParser) stdout is parsed into result.rows (and result.headers)
+    while the command runs, on_row is called with every row as soon as it is parsed
+    with cache=True (or an ExecCache) an idempotent command is only executed when there is no fresh cached result,
+    a cached result is returned as is, without logging, console output, dump or trace,
+    and without calling on_row, alt_out, alt_err or the exec hooks
     :param cmd: the command
     :param kwargs: any kwargs
     :return: ExecResult Object
     """
+    cache = kwargs.pop('cache', None)
+    if cache:
+        if cache is True:
+            cache = default_exec_cache
+        return cache.get_or_run(ExecCache.make_key(cmd, kwargs), functools.partial(iexec, cmd, **kwargs))
+
+    governor = kwargs.pop('governor', _default_exec_governor)
+    if governor:
+        with governor.slot() as waited:
+            result = iexec(cmd, governor=None, **kwargs)
+        result.queue_time = waited
+        return result
+
     show_log = kwargs.pop('show_log', True)
     to_console = kwargs.pop('to_console', True)
     print_to_console = kwargs.pop('print_to_console', False)
@@ -275,9 +946,12 @@ def iexec(cmd, **kwargs):
     log_as_trace = kwargs.pop('log_as_trace', False)
     log_as_level = kwargs.pop('log_as_level', None)
     pickle_result = kwargs.pop('pickle_result', '')
+    spawn_server = kwargs.pop('spawn_server', _default_spawn_server)
+    async_writer = kwargs.pop('async_writer', _default_async_writer)
     dump_file = kwargs.pop('dump_file', None)
     trace_file = kwargs.pop('trace_file', None)
     timeout = kwargs.pop('timeout', 0)
+    timeout_kill_grace = kwargs.pop('timeout_kill_grace', TIMEOUT_KILL_GRACE)
     dump_file_rotate = kwargs.pop('dump_file_rotate', False)
     alt_out = kwargs.pop('alt_out', None)
     alt_err = kwargs.pop('alt_err', alt_out)
@@ -285,11 +959,25 @@ def iexec(cmd, **kwargs):
     iexec_communicate_input = kwargs.pop('iexec_communicate_input', None)
     dump_kwargs = kwargs.pop('dump_kwargs', False)
     text_mode = kwargs.pop('text_mode', True)
+    parse_rows = kwargs.pop('parse_rows', None)
+    on_row = kwargs.pop('on_row', None)
+    use_shell = kwargs.get('shell', True)
+
+    if use_shell:
+        if not isinstance(cmd, str):
+            cmd = subprocess.list2cmdline(cmd)
+        args = cmd
+    else:
+        if isinstance(cmd, str):
+            args = shlex.split(cmd, posix=running_on_linux)
+        else:
+            args = list(cmd)
+        if running_on_linux and 'executable' not in kwargs:
+            search_path = (kwargs.get('env') or os.environ).get('PATH', os.defpath)
+            args[0] = _resolve_executable(args[0], search_path)
+        cmd = _argv_cmdline(args)
 
-    if not isinstance(cmd, str):
-        cmd = subprocess.list2cmdline(cmd)
-
-    if redirect_output and running_on_windows:
+    if redirect_output and running_on_windows and use_shell:
         if redirect_file_name is None:
             redirect_file = tempfile.NamedTemporaryFile(
                 suffix=".txt",
@@ -301,6 +989,7 @@ def iexec(cmd, **kwargs):
             redirect_file.close()
             redirect_file_name = redirect_file.name
         cmd += ' > {} 2>&1'.format(redirect_file_name)
+        args = cmd
 
     if print_to_console:
         print(cmd)
@@ -316,31 +1005,64 @@ def iexec(cmd, **kwargs):
         else:
             log.info(msg)
 
-    pkwargs = {'shell': True, 'stdout': subprocess.PIPE, 'stderr': subprocess.PIPE, 'text': text_mode}
+    pkwargs = {'stdout': subprocess.PIPE, 'stderr': subprocess.PIPE, 'text': text_mode}
     subprocess_kwargs = {}
     for arg in SUBPROCESS_KWARGS:
         if arg in kwargs and arg not in pkwargs:
             pkwargs[arg] = kwargs[arg]  # kwargs to actually pass to the subprocess
             subprocess_kwargs[arg] = kwargs[arg]  # the kwargs the user supplied
+    pkwargs.setdefault('shell', True)
+
+    if not use_shell and running_on_linux:
+        # our pipes are not inheritable (PEP 446), so not closing fds is safe and allows the posix_spawn path
+        pkwargs.setdefault('close_fds', False)
+
+    if timeout and running_on_linux:
+        # the command leads its own process group, so on timeout we can kill everything it started
+        pkwargs.setdefault('start_new_session', True)
 
     stdout = []
     stderr = []
     ordered_out = []
+    timed_out = False
+    rusage = None
     start_time = time.time()
+    start_monotonic = time.monotonic()
+    deadline = start_monotonic + timeout if timeout else None
+
+    # before starting the command, so a bad format does not leave it running
+    row_parser = parse_rows
+    assert not parse_rows or text_mode, 'parse_rows needs text_mode'
+    if parse_rows and not isinstance(parse_rows, RowParser):
+        row_parser = RowParser(parse_rows, on_row=on_row)
 
-    proc = subprocess.Popen(args=cmd, **pkwargs)
+    if spawn_server is not None:
+        proc = spawn_server.popen(args, **pkwargs)
+    else:
+        proc = subprocess.Popen(args=args, **pkwargs)
+
+    hooks = list(_exec_hooks)
+    exec_id = next(_exec_counter)
+    if hooks:
+        _call_hooks(hooks, 'on_start', exec_id, cmd, start_time, proc.pid)
 
     def _write_to_stdout(line):
+        if hooks:
+            _call_hooks(hooks, 'on_output_chunk', exec_id, cmd, 'out', len(line), time.monotonic() - start_monotonic)
         if to_console:
             sys.stdout.write(line)
         if print_to_console:
             print(line)
         if alt_out is not None and callable(alt_out):
             alt_out(contents=line)
+        if row_parser:
+            row_parser.feed(line)
         stdout.append(line)
         ordered_out.append(line)
 
     def _write_to_stderr(line):
+        if hooks:
+            _call_hooks(hooks, 'on_output_chunk', exec_id, cmd, 'err', len(line), time.monotonic() - start_monotonic)
         if to_console:
             sys.stderr.write(line)
         if print_to_console:
@@ -350,113 +1072,163 @@ def iexec(cmd, **kwargs):
         stderr.append(line)
         ordered_out.append(line)
 
-    if running_on_windows:
-        if iexec_communicate:
-            stdout_buffer, stderr_buffer = proc.communicate(iexec_communicate_input)
-            if redirect_output:
-                stdout_buffer = read_file(redirect_file_name)
-            for stdout_line in stdout_buffer:
-                _write_to_stdout(stdout_line)
-            for stderr_line in stderr_buffer:
-                _write_to_stderr(stderr_line)
-            rc = proc.wait()
-        else:
-            def _enqueue_stream(stream, queue):
-                for line in iter(stream.readline, b''):
-                    queue.put(line)
-                stream.close()
-
-            qo = Queue()
-            to = Thread(target=_enqueue_stream, args=(proc.stdout, qo))
-            to.daemon = True  # thread dies with the program
-            to.start()
-
-            qe = Queue()
-            te = Thread(target=_enqueue_stream, args=(proc.stderr, qe))
-            te.daemon = True  # thread dies with the program
-            te.start()
-
-            while True:
+    try:
+        if running_on_windows:
+            if iexec_communicate:
                 try:
-                    stdout_line = qo.get_nowait()  # or q.get(timeout=.1)
-                except Empty:
-                    pass
-                else:
+                    stdout_buffer, stderr_buffer = proc.communicate(iexec_communicate_input, timeout=timeout or None)
+                except subprocess.TimeoutExpired:
+                    timed_out = True
+                    proc.kill()
+                    stdout_buffer, stderr_buffer = proc.communicate()
+                if redirect_output:
+                    stdout_buffer = read_file(redirect_file_name)
+                for stdout_line in stdout_buffer:
                     _write_to_stdout(stdout_line)
-                    sys.stdout.flush()
-                try:
-                    stderr_line = qe.get_nowait()  # or q.get(timeout=.1)
-                except Empty:
-                    pass
-                else:
+                for stderr_line in stderr_buffer:
                     _write_to_stderr(stderr_line)
-                    sys.stderr.flush()
-
-                rc = proc.poll()
-                if rc is not None:
-                    # finished proc, read all the rest of the lines from the buffer
+                rc = proc.wait()
+            else:
+                def _enqueue_stream(stream, queue):
+                    for line in iter(stream.readline, b''):
+                        queue.put(line)
+                    stream.close()
+
+                qo = Queue()
+                to = Thread(target=_enqueue_stream, args=(proc.stdout, qo))
+                to.daemon = True  # thread dies with the program
+                to.start()
+
+                qe = Queue()
+                te = Thread(target=_enqueue_stream, args=(proc.stderr, qe))
+                te.daemon = True  # thread dies with the program
+                te.start()
+
+                while True:
                     try:
-                        while True:
-                            stdout_line = qo.get_nowait()  # or q.get(timeout=.1)
-                            _write_to_stdout(stdout_line)
-                            sys.stdout.flush()
+                        stdout_line = qo.get_nowait()  # or q.get(timeout=.1)
                     except Empty:
                         pass
+                    else:
+                        _write_to_stdout(stdout_line)
+                        sys.stdout.flush()
                     try:
-                        while True:
-                            stderr_line = qe.get_nowait()  # or q.get(timeout=.1)
-                            _write_to_stderr(stderr_line)
-                            sys.stderr.flush()
+                        stderr_line = qe.get_nowait()  # or q.get(timeout=.1)
                     except Empty:
                         pass
-                    if redirect_output:
-                        stdout_buffer = read_file(redirect_file_name)
-                        for stdout_line in stdout_buffer:
-                            _write_to_stdout(stdout_line)
+                    else:
+                        _write_to_stderr(stderr_line)
+                        sys.stderr.flush()
+
+                    if deadline is not None and time.monotonic() >= deadline and proc.poll() is None:
+                        timed_out = True
+                        proc.kill()
+                        proc.wait()
+
+                    rc = proc.poll()
+                    if rc is not None:
+                        # finished proc, read all the rest of the lines from the buffer
+                        try:
+                            while True:
+                                stdout_line = qo.get_nowait()  # or q.get(timeout=.1)
+                                _write_to_stdout(stdout_line)
+                                sys.stdout.flush()
+                        except Empty:
+                            pass
+                        try:
+                            while True:
+                                stderr_line = qe.get_nowait()  # or q.get(timeout=.1)
+                                _write_to_stderr(stderr_line)
+                                sys.stderr.flush()
+                        except Empty:
+                            pass
+                        if redirect_output:
+                            stdout_buffer = read_file(redirect_file_name)
+                            for stdout_line in stdout_buffer:
+                                _write_to_stdout(stdout_line)
+                        break
+        else:
+            text = bool(pkwargs.get('text') or pkwargs.get('universal_newlines'))
+            pipes = {
+                proc.stdout.fileno(): _PipeLines(_write_to_stdout, text),
+                proc.stderr.fileno(): _PipeLines(_write_to_stderr, text),
+            }
+            # read until both pipes close, select never waits past the deadline so silent commands still time out
+            while pipes:
+                select_timeout = None if deadline is None else max(0, deadline - time.monotonic())
+                ready, _, _ = select.select(list(pipes), [], [], select_timeout)
+                for fd in ready:
+                    chunk = os.read(fd, READ_CHUNK_SIZE)
+                    if chunk:
+                        pipes[fd].feed(chunk)
+                    else:
+                        pipes.pop(fd).close()
+                if deadline is not None and pipes and time.monotonic() >= deadline:
+                    timed_out = True
+                    log.warning('Timeout executing cmd, killing: timeout={} cmd={}'.format(timeout, cmd))
+                    rc, rusage = _kill_process_group(proc, timeout_kill_grace)
+                    _drain_pipes(pipes)
                     break
-    else:
-        reads = [proc.stdout.fileno(), proc.stderr.fileno()]
-        while True:
-            ret = select.select(reads, [], [])
+            proc.stdout.close()
+            proc.stderr.close()
+            if deadline is not None and not timed_out:
+                # the pipes were closed, but the process itself may still be running
+                try:
+                    rc, rusage = _wait_with_rusage(proc, max(0, deadline - time.monotonic()))
+                except subprocess.TimeoutExpired:
+                    timed_out = True
+                    log.warning('Timeout executing cmd, killing: timeout={} cmd={}'.format(timeout, cmd))
+                    rc, rusage = _kill_process_group(proc, timeout_kill_grace)
+            if proc.returncode is None:
+                rc, rusage = _wait_with_rusage(proc)
+    except BaseException:
+        # the output handling failed (a bad row, an alt_out or on_row exception), do not leave the command running
+        log.debug('iexec output handling failed, killing: cmd={}'.format(cmd))
+        if running_on_windows:
+            proc.kill()
+        else:
+            _kill_process_group(proc, 0)
+        for stream in (proc.stdout, proc.stderr):
+            stream.close()
+        proc.wait()
+        raise
 
-            for fd in ret[0]:
-                if fd == proc.stdout.fileno():
-                    stdout_line = proc.stdout.readline()
-                    _write_to_stdout(stdout_line)
-                if fd == proc.stderr.fileno():
-                    stderr_line = proc.stderr.readline()
-                    _write_to_stderr(stderr_line)
+    time_taken = time.monotonic() - start_monotonic
+    result = ExecResult(stdout, stderr, rc, time_taken, cmd, ordered_out, start_time, timeout, subprocess_kwargs,
+                        timed_out, rusage)
+    if row_parser:
+        result.rows = row_parser.close()
+        result.headers = row_parser.headers
 
-            rc = proc.poll()
-            if rc is not None:
-                # finished proc, read all the rest of the lines from the buffer
-                stdout_buffer = proc.stdout.readlines()
-                for stdout_line in stdout_buffer:
-                    _write_to_stdout(stdout_line)
-                stderr_buffer = proc.stderr.readlines()
-                for stderr_line in stderr_buffer:
-                    _write_to_stderr(stderr_line)
-                break
+    if hooks:
+        _call_hooks(hooks, 'on_exit', exec_id, cmd, result)
 
-            if timeout and time.time() - start_time > timeout:
-                raise RuntimeError('Timeout executing cmd on linux')
-
-    time_taken = time.time() - start_time
-    result = ExecResult(stdout, stderr, rc, time_taken, cmd, ordered_out, start_time, timeout, subprocess_kwargs)
+    if async_writer is True:
+        async_writer = get_async_writer()
 
     if dump_file:
-        result.to_dump_file(dump_file, dump_file_rotate, dump_kwargs=dump_kwargs)
+        if async_writer:
+            # the dump is formatted in the writer thread as well
+            async_writer.write(dump_file, functools.partial(result.get_dump_data, dump_kwargs), filemode='w',
+                               rotate=dump_file_rotate)
+        else:
+            result.to_dump_file(dump_file, dump_file_rotate, dump_kwargs=dump_kwargs)
 
     if trace_file:
-        write_file(trace_file, contents=result.append_output(), filemode='a')
+        if async_writer:
+            async_writer.write(trace_file, result.append_output)
+        else:
+            write_file(trace_file, contents=result.append_output(), filemode='a')
 
     if pickle_result:
         with open(pickle_result, 'wb') as f:
-            pickle.dump(result, f, protocol=1)
+            pickle.dump(result, f, protocol=pickle.HIGHEST_PROTOCOL)
 
     return result
 
 
 __all__ = [
-    'iexec', 'mpiexec', 'detached_iexec', 'ExecResult'
+    'iexec', 'mpiexec', 'detached_iexec', 'iexec_many', 'exec_results_summary',
+    'set_spawn_server', 'set_async_writer', 'set_exec_governor', 'shutdown_mpiexec_pool',
+    'ExecCache', 'default_exec_cache', 'ExecHook', 'add_exec_hook', 'remove_exec_hook', 'ExecResult'
 ]
@@ -2,17 +2,21 @@
 
 # Standard Imports
 import re
+import random
 import shutil
 import glob
 import difflib
-import fnmatch
 import tempfile
+import threading
 import zipfile
 import json
 from csv import DictReader, DictWriter
 
 # Lib Imports
 from .byte_utils import check_file_size
+from .find_utils import iter_files
+from .zip_utils import write_zip_members, read_zip_manifest, write_zip_manifest, check_zip_structure, check_zip_crc, \
+    extract_zip_members, ZIP_VALIDATE_LEVELS, ZIP_VALIDATE_SAMPLE
 
 # kitir Imports
 from kitir import *
@@ -21,20 +25,53 @@ from kitir import *
 log = logging.getLogger('kitir.utils.file')
 
 
-def zip_dir(path_to_dir, zip_file, exclude_dirs=None, raise_on_error=True, validate=True):
+def _is_stream(zip_file):
+    """zip functions write to streams as well as paths, zipfile handles unseekable ones (sockets, pipes)"""
+    return hasattr(zip_file, 'write')
+
+
+def _validate_level(validate):
+    return validate if validate in ZIP_VALIDATE_LEVELS else 'full'
+
+
+def zip_dir(path_to_dir, zip_file, exclude_dirs=None, raise_on_error=True, validate=True, **kwargs):
     """
     make zip file with relative paths
     :param path_to_dir: the path to directory
-    :param zip_file: name of zip file to create
+    :param zip_file: name of zip file to create, or a writable stream (a file object, socket.makefile('wb'), ...)
+        which gets the zip file in a single pass, it is not validated and left open
     :param exclude_dirs: dir paths to ignore (exclude)
     :param raise_on_error: Raise an exception if error
-    :param validate: Validate the zip file
+    :param validate: Validate the zip file (True is a full validation, or one of ZIP_VALIDATE_LEVELS)
+    :param kwargs: workers (compress files in parallel threads), compresslevel (0-9),
+        store_extensions (files with these extensions are stored uncompressed, see ZIP_STORE_EXTENSIONS),
+        incremental (keep a manifest next to the zip file, files that did not change since the last incremental
+        zip_dir are copied from the existing zip file as they are, without compressing them again)
     :return: boolean of success
     """
-    log.debug('zip_dir: path={} zip={}'.format(path_to_dir, zip_file))
-    check_makedir(os.path.dirname(zip_file))
-    zip_ref = zipfile.ZipFile(zip_file, "w", zipfile.ZIP_DEFLATED)
+    workers = kwargs.pop('workers', 1)
+    compresslevel = kwargs.pop('compresslevel', None)
+    store_extensions = kwargs.pop('store_extensions', ())
+    incremental = kwargs.pop('incremental', False)
+    log.debug('zip_dir: path={} zip={} incremental={}'.format(path_to_dir, zip_file, incremental))
+    stream = _is_stream(zip_file)
+    assert not (stream and incremental), 'an incremental zip needs a zip file path'
+    if stream:
+        validate = False
+    else:
+        check_makedir(os.path.dirname(zip_file))
+    manifest = read_zip_manifest(zip_file) if incremental else {}
+    previous_zip = None
+    if manifest:
+        try:
+            previous_zip = zipfile.ZipFile(zip_file, "r")
+        except zipfile.BadZipfile as exc:
+            log.warning('cannot reuse the existing zip file, zipping everything: zip={} exc={}'.format(zip_file, exc))
+    # an incremental zip reads from the existing zip file while the new one is written
+    out_file = '{}.tmp{}'.format(zip_file, os.getpid()) if incremental else zip_file
+    zip_ref = zipfile.ZipFile(out_file, "w", zipfile.ZIP_DEFLATED)
     try:
+        members = []
         for dirname, subdirs, files in os.walk(path_to_dir):
             for subdir in [os.path.join(dirname, sdir) for sdir in subdirs]:
                 if exclude_dirs:
@@ -43,41 +80,63 @@ def zip_dir(path_to_dir, zip_file, exclude_dirs=None, raise_on_error=True, valid
             if not files:
                 continue
             relative_dir_name = os.path.relpath(dirname, path_to_dir)
-            zip_ref.write(dirname, relative_dir_name)
+            members.append((dirname, relative_dir_name))
             for filename in files:
                 full_path_to_file = os.path.join(dirname, filename)
                 relative_path_to_file = os.path.relpath(full_path_to_file, path_to_dir)
-                zip_ref.write(full_path_to_file, relative_path_to_file)
+                members.append((full_path_to_file, relative_path_to_file))
+        new_manifest = write_zip_members(zip_ref, members, workers, compresslevel, store_extensions,
+                                         previous_zip=previous_zip, manifest=manifest)
         zip_ref.close()
+        if incremental:
+            if previous_zip is not None:
+                previous_zip.close()
+            os.replace(out_file, zip_file)
+            write_zip_manifest(zip_file, new_manifest)
     except IOError as exc:
         log.error('Exception while zipping directory: zip_file={} directory={} exc={}'.format(
             zip_file, path_to_dir, exc))
+        try:
+            zip_ref.close()
+        except IOError:
+            pass  # the stream is broken
+        if previous_zip is not None:
+            previous_zip.close()
+        if out_file != zip_file:
+            clean_paths(out_file)
         if raise_on_error:
             raise
         return False
     else:
         if validate:
-            if not validate_zip(zip_file, raise_on_fail=raise_on_error):
+            if not validate_zip(zip_file, raise_on_fail=raise_on_error, level=_validate_level(validate)):
                 log.error('invalid zipfile: zip={}'.format(zip_file))
                 return False
         return True
 
 
-def zip_files(files, zip_file, raise_on_error=True, validate=True):
+def zip_files(files, zip_file, raise_on_error=True, validate=True, **kwargs):
     """
     make a zip file from a list of files
     :param files: list of files to put into zip
-    :param zip_file: the zip file to make
+    :param zip_file: the zip file to make, or a writable stream (see zip_dir)
     :param raise_on_error: Raise an exception if error
-    :param validate: Validate the zip file
+    :param validate: Validate the zip file (True is a full validation, or one of ZIP_VALIDATE_LEVELS)
+    :param kwargs: workers, compresslevel, store_extensions (see zip_dir)
     :return: boolean of success
     """
+    workers = kwargs.pop('workers', 1)
+    compresslevel = kwargs.pop('compresslevel', None)
+    store_extensions = kwargs.pop('store_extensions', ())
     log.debug('zip_files: files={} zip={}'.format(files, zip_file))
-    check_makedir(os.path.dirname(zip_file))
+    if _is_stream(zip_file):
+        validate = False
+    else:
+        check_makedir(os.path.dirname(zip_file))
     zip_ref = zipfile.ZipFile(zip_file, "w", zipfile.ZIP_DEFLATED)
     try:
-        for filepath in files:
-            zip_ref.write(filepath, os.path.basename(filepath))
+        members = [(filepath, os.path.basename(filepath)) for filepath in files]
+        write_zip_members(zip_ref, members, workers, compresslevel, store_extensions)
         zip_ref.close()
     except IOError as exc:
         log.error('Exception while zipping files: zip_file={} files={} exc={}'.format(
@@ -87,54 +146,104 @@ def zip_files(files, zip_file, raise_on_error=True, validate=True):
         return False
     else:
         if validate:
-            if not validate_zip(zip_file, raise_on_fail=raise_on_error):
+            if not validate_zip(zip_file, raise_on_fail=raise_on_error, level=_validate_level(validate)):
                 log.error('invalid zipfile: zip={}'.format(zip_file))
                 return False
         return True
 
 
-def unzip_dir(path_to_zip_file, directory_to_unzip_file, raise_on_error=True, validate=True):
+def iter_zip_dir(path_to_dir, chunk_size=65536, **kwargs):
+    """
+    zip a directory into a stream of chunks, the zip file is made while it is consumed, nothing is written to disk
+    e.g. an HTTP upload: requests.post(url, data=utils.iter_zip_dir(path))
+    :param path_to_dir: the path to directory
+    :param chunk_size: the most bytes in a chunk
+    :param kwargs: zip_dir kwargs (exclude_dirs, workers, compresslevel, store_extensions)
+    :return: generator of bytes
+    """
+    read_fd, write_fd = os.pipe()
+    errors = []
+
+    def _zip():
+        try:
+            with os.fdopen(write_fd, 'wb') as stream:
+                zip_dir(path_to_dir, stream, **kwargs)
+        except Exception as exc:
+            errors.append(exc)
+
+    thread = threading.Thread(target=_zip, name='iter_zip_dir')
+    thread.daemon = True
+    thread.start()
+    with os.fdopen(read_fd, 'rb', buffering=0) as pipe:
+        while True:
+            chunk = pipe.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    thread.join()
+    if errors:
+        raise errors[0]
+
+
+def unzip_dir(path_to_zip_file, directory_to_unzip_file, raise_on_error=True, validate=True, **kwargs):
     """
     unzip file to directory
     :param raise_on_error:
     :param path_to_zip_file: name to existing zip file
     :param directory_to_unzip_file: directory to unzip into (and create)
-    :param validate: Validate the zip file
+    :param validate: Validate the zip file (True is a full validation, or one of ZIP_VALIDATE_LEVELS)
+    :param kwargs: workers (extract files in parallel threads), skip_existing (files that exist with the size and
+        CRC of the member are not written again). extraction checks the CRC of what it writes,
+        so validate='structure' is enough with them.
     :return: boolean of success
     """
+    workers = kwargs.pop('workers', 1)
+    skip_existing = kwargs.pop('skip_existing', False)
     log.debug('unzip_dir: zip={} path={}'.format(path_to_zip_file, directory_to_unzip_file))
     if validate:
-        if not validate_zip(path_to_zip_file, raise_on_fail=raise_on_error):
+        if not validate_zip(path_to_zip_file, raise_on_fail=raise_on_error, level=_validate_level(validate)):
             log.error('invalid zipfile, skipping unzip: zip={}'.format(path_to_zip_file))
             return False
     check_makedir(os.path.dirname(directory_to_unzip_file))
-    zip_ref = zipfile.ZipFile(path_to_zip_file, 'r')
     try:
-        zip_ref.extractall(directory_to_unzip_file)
-    except IOError as exc:
+        if workers > 1 or skip_existing:
+            extracted, skipped = extract_zip_members(path_to_zip_file, directory_to_unzip_file, workers, skip_existing)
+            log.debug('unzip_dir: extracted={} skipped={}'.format(extracted, skipped))
+        else:
+            with zipfile.ZipFile(path_to_zip_file, 'r') as zip_ref:
+                zip_ref.extractall(directory_to_unzip_file)
+    except (IOError, zipfile.BadZipfile) as exc:
         log.error('Exception while unzipping into directory: zip_file={} directory={} exc={}'.format(
             path_to_zip_file, directory_to_unzip_file, exc))
         if raise_on_error:
             raise
         return False
     else:
-        zip_ref.close()
         log.info('Successfully unzipped into directory: zip_file={} directory={}'.format(
             path_to_zip_file, directory_to_unzip_file))
         return True
 
 
-def validate_zip(path_to_zip, raise_on_fail=True):
+def validate_zip(path_to_zip, raise_on_fail=True, level='full', workers=None):
     """
     validates a zip file
     :param path_to_zip:
     :param raise_on_fail:
+    :param level: structure (central directory and local headers only), sample (and the CRC of some members),
+        full (the CRC of all members, checked in parallel threads), see ZIP_VALIDATE_LEVELS
+    :param workers: threads for checking the CRC's (default: cpu count)
     :return:
     """
-    log.debug('validate_zip: zip={}'.format(path_to_zip))
-    zip_ref = zipfile.ZipFile(path_to_zip, "r", zipfile.ZIP_DEFLATED)
+    log.debug('validate_zip: zip={} level={}'.format(path_to_zip, level))
+    assert level in ZIP_VALIDATE_LEVELS, 'unknown zip validation level: {}'.format(level)
     try:
-        ret = zip_ref.testzip()
+        with zipfile.ZipFile(path_to_zip, "r") as zip_ref:
+            ret = check_zip_structure(zip_ref)
+            names = zip_ref.namelist()
+        if ret is None and level != 'structure':
+            if level == 'sample' and len(names) > ZIP_VALIDATE_SAMPLE:
+                names = random.sample(names, ZIP_VALIDATE_SAMPLE)
+            ret = check_zip_crc(path_to_zip, names, workers)
     except Exception as exc:
         log.error('Exception validating zip file: zip_file={} exc={}'.format(path_to_zip, exc))
         if raise_on_fail:
@@ -146,8 +255,6 @@ def validate_zip(path_to_zip, raise_on_fail=True):
             if raise_on_fail:
                 raise zipfile.BadZipfile('zip validation failed for zip file {} on {}'.format(path_to_zip, ret))
             return False
-    finally:
-        zip_ref.close()
     return True
 
 
@@ -155,6 +262,7 @@ def smart_copy(src, dst, ignore_patterns=(), ignore_dst_dir_exists=True, build_d
     """
     Copies a path `src` to `dst` including dirs and files.
     if src is file, will build dirtree at destination
+    (to keep a copy of a big tree in sync use sync_copy, which copies in parallel and skips unchanged files)
     :param src: file or dir tree
     :param dst: destination dir
     :param ignore_patterns: sequence of glob-style patterns to ignore
@@ -278,7 +386,7 @@ def find_single_path(glob_pattern, raise_on_fail=True):
     return None
 
 
-def find_files_recursively(directory, pattern):
+def find_files_recursively(directory, pattern, **kwargs):
     """
     finds all files in a directory recursively based on the file filter.
     pattern is a Unix shell style:
@@ -289,17 +397,111 @@ def find_files_recursively(directory, pattern):
     [!seq]  matches any char not in seq
 
     :param directory: directory to search
-    :param pattern: filename pattern
+    :param pattern: filename pattern (or a list of patterns)
+    :param kwargs: exclude (filename patterns), exclude_dirs (dir name patterns, not searched at all),
+        workers (scan in parallel threads), see iter_files for a generator of entries with cached stat
     :return: a list of matched files
     """
-    matches = []
-    for root, dirnames, filenames in os.walk(directory):
-        for filename in fnmatch.filter(filenames, pattern):
-            matches.append(os.path.join(root, filename))
-    return matches
+    return [entry.path for entry in iter_files(directory, pattern, **kwargs)]
 
 
-def file_rotation(file_name, rotate_rx='_rx_'):
+class RotationIndex(object):
+    """
+    Finds the next rotation of a file name (see file_rotation) without stat'ing every rotation that exists.
+    the directory is scanned once per name, then the next rotation index is cached,
+    so finding the next rotation costs a few stats however many rotations there are.
+    rotations written by others are stepped over, the directory is scanned again only when the highest
+    rotation is gone (rotations were deleted).
+    claim() creates the file with O_EXCL, so concurrent writers (threads or processes) never get the same name.
+    the next rotation is the one after the highest existing rotation (gaps are not reused).
+    """
+
+    def __init__(self):
+        self._next = {}  # (dirname, file_base, file_ext, rotate_rx): the next rotation to try (0 is the file name)
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _split(file_name, rotate_rx):
+        """(dirname, file_base, file_ext, rotation) of a file name, which may already be a rotation"""
+        dirname, basename = os.path.split(file_name)
+        mo = re.match(r'(.*?)({})(\d+)(.*)'.format(rotate_rx), basename)
+        if not mo:
+            file_base, file_ext = os.path.splitext(basename)
+            return dirname, file_base, file_ext, 0
+        file_base, _, rotation, file_ext = mo.groups()
+        return dirname, file_base, file_ext, int(rotation)
+
+    @staticmethod
+    def _name(key, rotation):
+        dirname, file_base, file_ext, rotate_rx = key
+        if not rotation:
+            return os.path.join(dirname, '{}{}'.format(file_base, file_ext))
+        return os.path.join(dirname, '{}{}{}{}'.format(file_base, rotate_rx, rotation, file_ext))
+
+    @staticmethod
+    def _scan(key):
+        """the rotation after the highest one in the directory"""
+        dirname, file_base, file_ext, rotate_rx = key
+        rotation_re = re.compile(r'{}(?:{}(\d+))?{}\Z'.format(re.escape(file_base), rotate_rx, re.escape(file_ext)))
+        highest = -1
+        try:
+            with os.scandir(dirname or '.') as entries:
+                for entry in entries:
+                    mo = rotation_re.match(entry.name)
+                    if mo:
+                        highest = max(highest, int(mo.group(1) or 0))
+        except FileNotFoundError:
+            pass
+        return highest + 1
+
+    def _candidate(self, file_name, rotate_rx):
+        dirname, file_base, file_ext, rotation = self._split(file_name, rotate_rx)
+        key = (dirname, file_base, file_ext, rotate_rx)
+        next_rotation = self._next.get(key)
+        if next_rotation is None or (next_rotation and not os.path.exists(self._name(key, next_rotation - 1))):
+            # first time, or the highest rotation was deleted since
+            next_rotation = self._scan(key)
+        return key, max(rotation, next_rotation)
+
+    def next_name(self, file_name, rotate_rx='_rx_'):
+        """the next available rotation of file_name, nothing is created (see file_rotation)"""
+        with self._lock:
+            key, rotation = self._candidate(file_name, rotate_rx)
+            while os.path.exists(self._name(key, rotation)):
+                rotation += 1  # written since the scan (or by another process)
+            self._next[key] = rotation
+            return self._name(key, rotation)
+
+    def claim(self, file_name, rotate_rx='_rx_'):
+        """
+        create the next available rotation of file_name (empty), atomically
+        :return: the file name that was created
+        """
+        with self._lock:
+            key, rotation = self._candidate(file_name, rotate_rx)
+            if key[0]:
+                check_makedir(key[0])
+            while True:
+                name = self._name(key, rotation)
+                try:
+                    os.close(os.open(name, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o666))
+                except FileExistsError:
+                    rotation += 1
+                    continue
+                self._next[key] = rotation + 1
+                return name
+
+    def clear(self):
+        """forget the cached rotations"""
+        with self._lock:
+            self._next.clear()
+
+
+# the rotation index used by file_rotation and write_file
+rotation_index = RotationIndex()
+
+
+def file_rotation(file_name, rotate_rx='_rx_', claim=False):
     """
     Find next available file name using rotation, does not actually move files.
     just finds next available name using delimiter
@@ -315,24 +517,18 @@ def file_rotation(file_name, rotate_rx='_rx_'):
     >> utils.file_rotation('/tmp/file_name.txt')
     '/tmp/file_name_rx_2.txt'  # we write to the next available rotation
 
+    the rotations are cached by name (see RotationIndex), rotations written or deleted by someone else are noticed,
+    the next rotation is the one after the highest existing rotation (gaps are not reused)
+
     :param file_name:
     :param rotate_rx: rotation delimiter
+    :param claim: create the file (empty) so no other writer gets the same name
     :return:
     """
     # todo: abstract rotation pattern, ie; allow filename.txt.1 .. filename.txt.n (simply adding a .number to the end)
-    rotation_pattern = r'(.*?)({})(\d+)(.*)'.format(rotate_rx)
-    rotation_re = re.compile(rotation_pattern)
-    while os.path.exists(file_name):
-        dirname, basename = os.path.split(file_name)
-        mo = rotation_re.match(basename)
-        if not mo:
-            rotation = 1
-            file_base, file_ext = os.path.splitext(basename)
-        else:
-            file_base, _, rotation, file_ext = mo.groups()
-            rotation = int(rotation) + 1
-        file_name = os.path.join(dirname, '{}{}{}{}'.format(file_base, rotate_rx, rotation, file_ext))
-    return file_name
+    if claim:
+        return rotation_index.claim(file_name, rotate_rx)
+    return rotation_index.next_name(file_name, rotate_rx)
 
 
 def write_file(file_name, contents=None, filemode='w', rotate=False, **kwargs):
@@ -346,7 +542,7 @@ def write_file(file_name, contents=None, filemode='w', rotate=False, **kwargs):
     """
     check_makedir(os.path.dirname(file_name))
     if rotate:
-        file_name = file_rotation(file_name, rotate_rx=kwargs.get('rotate_rx', '_rx_'))
+        file_name = file_rotation(file_name, rotate_rx=kwargs.get('rotate_rx', '_rx_'), claim=True)
     with open(file_name, filemode) as f:
         if contents:
             if isinstance(contents, list) and isinstance(contents[0], str):
@@ -678,10 +874,10 @@ def replace_content_in_file(filepath, replacements, raise_on_fail=True, **kwargs
 __all__ = [
     'check_makedir', 'find_single_path', 'find_files_recursively',
     'read_file', 'write_file', 'read_csv', 'write_csv', 'read_json', 'write_json', 'iread_csv',
-    'bulk_rename', 'file_diff', 'file_rotation', 'format_file', 'replace_content_in_file',
+    'bulk_rename', 'file_diff', 'file_rotation', 'RotationIndex', 'format_file', 'replace_content_in_file',
     'get_tmp_dir', 'write_to_tmp_file',
     # simple wrappers of copy/delete
     'smart_copy', 'clean_paths',
     # zip functions
-    'zip_dir', 'unzip_dir', 'zip_files',
+    'zip_dir', 'unzip_dir', 'zip_files', 'iter_zip_dir',
 ]
@@ -0,0 +1,99 @@
+#! /usr/bin/env python
+
+# Standard Imports
+import re
+import fnmatch
+import functools
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# kitir Imports
+from kitir import *
+
+# logging
+log = logging.getLogger('kitir.utils.find')
+
+
+@functools.lru_cache(maxsize=256)
+def compile_patterns(patterns):
+    """
+    one regex matching any of the glob-style patterns (matched against names, case-insensitive where the os is)
+    :param patterns: tuple of patterns
+    :return: compiled regex, None for no patterns
+    """
+    if not patterns:
+        return None
+    return re.compile('|'.join(fnmatch.translate(os.path.normcase(p)) for p in patterns))
+
+
+def _as_patterns(patterns):
+    if not patterns:
+        return ()
+    if isinstance(patterns, str):
+        return (patterns,)
+    return tuple(patterns)
+
+
+def _scan_dir(path, include_rx, exclude_rx, exclude_dirs_rx, follow_links):
+    """scan one directory, returns (matching file entries, sub directory paths to scan)"""
+    files = []
+    dirs = []
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                name = os.path.normcase(entry.name)
+                try:
+                    is_dir = entry.is_dir()
+                except OSError:
+                    continue
+                if is_dir:
+                    # a symlink to a directory is not a file either, like os.walk
+                    if (follow_links or not entry.is_symlink()) and \
+                            (exclude_dirs_rx is None or not exclude_dirs_rx.match(name)):
+                        dirs.append(entry.path)
+                elif include_rx.match(name) and (exclude_rx is None or not exclude_rx.match(name)):
+                    files.append(entry)
+    except OSError as exc:
+        log.trace('cannot scan directory, skipping: path={} exc={}'.format(path, exc))
+    return files, dirs
+
+
+def iter_files(directory, include='*', exclude=(), exclude_dirs=(), workers=1, follow_links=False):
+    """
+    finds files in a directory recursively, in one pass over the tree with os.scandir
+    files are yielded as they are found, as os.DirEntry objects: entry.path, entry.name, and entry.stat() which
+    is cached (and free on windows). excluded directories are not entered at all.
+    with workers > 1 sub trees are scanned in parallel threads (useful on network file systems and cold caches),
+    the files are then yielded in the order their directories were scanned.
+    :param directory: directory to search
+    :param include: Unix shell style pattern or patterns of the file names to find (see find_files_recursively)
+    :param exclude: patterns of the file names to leave out
+    :param exclude_dirs: patterns of directory names to not search in
+    :param workers: scanning threads
+    :param follow_links: enter symlinked directories (loops are not detected, like os.walk followlinks)
+    :return: generator of os.DirEntry
+    """
+    args = (compile_patterns(_as_patterns(include) or ('*',)), compile_patterns(_as_patterns(exclude)),
+            compile_patterns(_as_patterns(exclude_dirs)), follow_links)
+    if workers <= 1:
+        # depth first in directory order, like os.walk
+        pending = [directory]
+        while pending:
+            files, dirs = _scan_dir(pending.pop(), *args)
+            for entry in files:
+                yield entry
+            pending.extend(reversed(dirs))
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        running = {pool.submit(_scan_dir, directory, *args)}
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, dirs = future.result()
+                for path in dirs:
+                    running.add(pool.submit(_scan_dir, path, *args))
+                for entry in files:
+                    yield entry
+
+
+__all__ = ['iter_files']
@@ -0,0 +1,135 @@
+#! /usr/bin/env python
+
+# Standard Imports
+import time
+import itertools
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Lock
+
+# Lib Imports
+from .file_utils import check_makedir
+
+# kitir Imports
+from kitir import *
+
+if running_on_linux:
+    import fcntl
+
+# logging
+log = logging.getLogger('kitir.utils.governor')
+
+
+class ExecGovernor(object):
+    """
+    Limits how many child processes run at once, used by iexec(cmd, governor=...) or set_exec_governor.
+    in-process the limit is a semaphore shared by all threads, with slots_dir the limit is shared by all processes
+    using that dir: there are max_children lock files and a child can only run while holding a lock on one of them.
+    (the locks are flock's, so the kernel frees the slot of a process that dies)
+    records how long callers waited for a slot, see stats()
+    """
+
+    governor_counter = itertools.count()
+    # seconds between attempts to get a file slot, doubled on every miss up to the max
+    poll_period = 0.005
+    max_poll_period = 0.1
+
+    def __init__(self, max_children, slots_dir=None, **kwargs):
+        assert isinstance(max_children, int) and max_children > 0
+        self.max_children = max_children
+        self.slots_dir = slots_dir
+        self.name = kwargs.pop('name', next(self.governor_counter))
+        if slots_dir:
+            assert running_on_linux
+            check_makedir(slots_dir)
+        self._semaphore = BoundedSemaphore(max_children)
+        self._stats_lock = Lock()
+        self._running = 0
+        self._waiting = 0
+        self._acquired = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    @property
+    def identification(self):
+        return '{}({})'.format(self.__class__.__name__, self.name)
+
+    def _slot_path(self, idx):
+        return os.path.join(self.slots_dir, 'slot.{}.lock'.format(idx))
+
+    def _acquire_file_slot(self):
+        """lock one of the slot files, waiting until one is free, returns the open (locked) slot file"""
+        period = self.poll_period
+        while True:
+            for idx in range(self.max_children):
+                f = open(self._slot_path(idx), 'a')
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    f.close()
+                else:
+                    return f
+            time.sleep(period)
+            period = min(period * 2, self.max_poll_period)
+
+    @contextmanager
+    def slot(self):
+        """
+        wait for a free slot and hold it for the duration of the with block
+        :return: the seconds waited for the slot
+        """
+        start = time.monotonic()
+        with self._stats_lock:
+            self._waiting += 1
+        self._semaphore.acquire()
+        slot_file = None
+        try:
+            if self.slots_dir:
+                slot_file = self._acquire_file_slot()
+            waited = time.monotonic() - start
+            with self._stats_lock:
+                self._waiting -= 1
+                self._running += 1
+                self._acquired += 1
+                self._wait_total += waited
+                self._wait_max = max(self._wait_max, waited)
+        except BaseException:
+            with self._stats_lock:
+                self._waiting -= 1
+            self._semaphore.release()
+            raise
+        try:
+            yield waited
+        finally:
+            with self._stats_lock:
+                self._running -= 1
+            if slot_file is not None:
+                slot_file.close()  # closing the file releases the flock
+            self._semaphore.release()
+
+    def stats(self):
+        """
+        the current state and queue-time metrics
+        :return: dict of max_children, running, waiting, acquired, wait_total, wait_max, wait_avg (seconds)
+        """
+        with self._stats_lock:
+            return {
+                'max_children': self.max_children,
+                'running': self._running,
+                'waiting': self._waiting,
+                'acquired': self._acquired,
+                'wait_total': self._wait_total,
+                'wait_max': self._wait_max,
+                'wait_avg': self._wait_total / self._acquired if self._acquired else 0.0,
+            }
+
+    def log_stats(self):
+        log.info('{} stats: {}'.format(
+            self.identification, ' '.join('{}={}'.format(k, v) for k, v in sorted(self.stats().items()))))
+
+
+def get_slots_dir(name='exec_governor'):
+    """a default directory for the slot files of a cross-process ExecGovernor"""
+    return os.path.join(ir_artifact_dir, 'governor', name)
+
+
+__all__ = ['ExecGovernor', 'get_slots_dir']
@@ -0,0 +1,161 @@
+#! /usr/bin/env python
+
+# Standard Imports
+import atexit
+import math
+from collections import defaultdict
+from threading import Lock
+
+# Lib Imports
+from .exec_utils import ExecHook, add_exec_hook, remove_exec_hook
+from .file_utils import write_file
+
+# kitir Imports
+from kitir import *
+
+# logging
+log = logging.getLogger('kitir.utils.metrics')
+
+
+def _percentile(sorted_values, percent):
+    """nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(math.ceil(percent / 100.0 * len(sorted_values))))
+    return sorted_values[rank - 1]
+
+
+class _CommandStats(object):
+    """the metrics of all the commands with the same prefix"""
+
+    def __init__(self):
+        self.count = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.durations = []
+        self.out_bytes = 0
+        self.err_bytes = 0
+        self.cpu_time = 0.0
+
+
+class ExecMetrics(ExecHook):
+    """
+    Aggregates metrics of every iexec, grouped by command prefix (the first words of the command).
+    per prefix: count, failures, timeouts, total/p50/p90/p99/max duration, stdout/stderr bytes and cpu time.
+    usage: metrics = utils.ExecMetrics().install() ... metrics.log_report()
+    with dump_at_exit the report is logged (and written to report_file) when the interpreter exits.
+    """
+
+    percentiles = (50, 90, 99)
+
+    def __init__(self, prefix_words=2):
+        self.prefix_words = prefix_words
+        self._lock = Lock()
+        self._stats = defaultdict(_CommandStats)
+        self._running = {}  # exec_id: prefix
+        self._report_file = None
+
+    def prefix(self, cmd):
+        """the key a command is grouped by: its first prefix_words words, without the path of the executable"""
+        words = cmd.split(None, self.prefix_words)[:self.prefix_words]
+        if words:
+            words[0] = os.path.basename(words[0])
+        return ' '.join(words)
+
+    def install(self, dump_at_exit=False, report_file=None):
+        """
+        start collecting metrics from iexec
+        :param dump_at_exit: log the report when the interpreter exits
+        :param report_file: also write the report to this file at exit
+        :return: self
+        """
+        add_exec_hook(self)
+        if dump_at_exit or report_file:
+            self._report_file = report_file
+            atexit.register(self._dump_at_exit)
+        return self
+
+    def uninstall(self):
+        """stop collecting metrics, what was collected is kept"""
+        remove_exec_hook(self)
+        atexit.unregister(self._dump_at_exit)
+
+    def clear(self):
+        with self._lock:
+            self._stats.clear()
+
+    def on_start(self, exec_id, cmd, start, pid):
+        with self._lock:
+            self._running[exec_id] = self.prefix(cmd)
+
+    def on_output_chunk(self, exec_id, cmd, stream, size, elapsed):
+        with self._lock:
+            stats = self._stats[self._running.get(exec_id) or self.prefix(cmd)]
+            if stream == 'out':
+                stats.out_bytes += size
+            else:
+                stats.err_bytes += size
+
+    def on_exit(self, exec_id, cmd, result):
+        with self._lock:
+            stats = self._stats[self._running.pop(exec_id, None) or self.prefix(cmd)]
+            stats.count += 1
+            if result.rc != 0:
+                stats.failed += 1
+            if result.timed_out:
+                stats.timed_out += 1
+            stats.durations.append(result.time)
+            stats.cpu_time += result.cpu_time or 0.0
+
+    def report(self, as_str=False):
+        """
+        the metrics per command prefix, sorted by total time (the most expensive commands first)
+        :param as_str: return a formatted table instead of a list of dicts
+        :return: list of dicts (prefix, count, failed, timed_out, total, p50, p90, p99, max, out_bytes, err_bytes, cpu)
+        """
+        rows = []
+        with self._lock:
+            for prefix, stats in self._stats.items():
+                if not stats.count:
+                    continue
+                durations = sorted(stats.durations)
+                row = {
+                    'prefix': prefix,
+                    'count': stats.count,
+                    'failed': stats.failed,
+                    'timed_out': stats.timed_out,
+                    'total': sum(durations),
+                    'max': durations[-1],
+                    'out_bytes': stats.out_bytes,
+                    'err_bytes': stats.err_bytes,
+                    'cpu': stats.cpu_time,
+                }
+                for percent in self.percentiles:
+                    row['p{}'.format(percent)] = _percentile(durations, percent)
+                rows.append(row)
+        rows.sort(key=lambda r: r['total'], reverse=True)
+        if not as_str:
+            return rows
+
+        headers = ['prefix', 'count', 'failed', 'timed_out', 'total'] + \
+                  ['p{}'.format(percent) for percent in self.percentiles] + ['max', 'cpu', 'out_bytes', 'err_bytes']
+        table = [headers]
+        for row in rows:
+            table.append([row[h] if not isinstance(row[h], float) else '{:.3f}'.format(row[h]) for h in headers])
+        widths = [max(len(str(line[i])) for line in table) for i in range(len(headers))]
+        return '\n'.join(
+            '  '.join(str(value).ljust(width) for value, width in zip(line, widths)).rstrip() for line in table
+        ) + '\n'
+
+    def log_report(self):
+        log.info('iexec metrics:\n{}'.format(self.report(as_str=True)))
+
+    def _dump_at_exit(self):
+        if not self._stats:
+            return
+        self.log_report()
+        if self._report_file:
+            write_file(self._report_file, contents=self.report(as_str=True), filemode='w')
+
+
+__all__ = ['ExecMetrics']
@@ -0,0 +1,236 @@
+#! /usr/bin/env python
+
+# Standard Imports
+import io
+import locale
+import select
+import shlex
+import subprocess
+import time
+from collections import OrderedDict
+from threading import Thread
+
+# Lib Imports
+from .exec_utils import ExecResult, READ_CHUNK_SIZE, _PipeLines, _argv_cmdline
+from .file_utils import write_file
+from .func_utils import get_func_name
+
+# kitir Imports
+from kitir import *
+
+# logging
+log = logging.getLogger('kitir.utils.pipeline')
+
+
+class _Stage(object):
+    """one stage of a Pipeline, a command (argv) or a python filter (callable)"""
+
+    def __init__(self, target):
+        if callable(target):
+            self.func = target
+            self.argv = None
+            self.name = '<{}>'.format(get_func_name(target, raise_on_fail=False) or 'filter')
+        else:
+            self.func = None
+            self.argv = shlex.split(target) if isinstance(target, str) else list(target)
+            self.name = _argv_cmdline(self.argv)
+        self.proc = None
+        self.thread = None
+        self.rc = None
+        self.exc = None
+        self.start = None
+        self.end = None
+
+    def info(self):
+        return OrderedDict([
+            ('cmd', self.name),
+            ('rc', self.rc),
+            ('time', None if self.end is None else self.end - self.start),
+            ('exc', self.exc),
+        ])
+
+
+class Pipeline(object):
+    """
+    Runs commands connected by OS pipes, like "a | grep x | sort" but without a shell.
+    data flows from one command to the next directly through the kernel, python never copies it,
+    except through filter stages: callables that get an iterator of lines and return (or yield) lines.
+    every stage has its own rc and timing (see ExecResult.stages), stderr of all commands is collected together.
+    usage: utils.Pipeline(['ps', 'aux']).pipe('grep python').filter(my_func).run()
+    """
+
+    def __init__(self, *stages):
+        self.stages = []
+        for stage in stages:
+            self.pipe(stage)
+
+    def pipe(self, stage):
+        """add a stage: a command (argv list or string, split with shlex) or a callable filter"""
+        self.stages.append(_Stage(stage))
+        return self
+
+    def filter(self, func):
+        """add a python filter stage: func(lines) -> iterable of lines"""
+        assert callable(func)
+        return self.pipe(func)
+
+    def __or__(self, stage):
+        return self.pipe(stage)
+
+    @property
+    def cmd(self):
+        return ' | '.join(stage.name for stage in self.stages)
+
+    @staticmethod
+    def _run_filter(stage, in_fd, out_fd):
+        """filter thread: feed the lines from in_fd to the filter, write what it returns to out_fd"""
+        encoding = locale.getpreferredencoding(False)
+        stage.start = time.monotonic()
+        in_file = io.open(in_fd, 'r', encoding=encoding, errors='replace') if in_fd is not None else io.StringIO()
+        out_file = io.open(out_fd, 'w', encoding=encoding, errors='replace')
+        try:
+            for line in stage.func(in_file):
+                out_file.write(line)
+            stage.rc = 0
+        except BrokenPipeError:
+            # the next stage stopped reading (like head), same as SIGPIPE for a command
+            stage.rc = 0
+        except Exception as exc:
+            log.error('pipeline filter exception: stage={} exc={}'.format(stage.name, exc))
+            stage.exc = exc
+            stage.rc = 1
+        finally:
+            stage.end = time.monotonic()
+            for f in (in_file, out_file):
+                try:
+                    f.close()
+                except BrokenPipeError:
+                    pass
+
+    @staticmethod
+    def _wait_command(stage):
+        """waiter thread: record when the command exits"""
+        stage.rc = stage.proc.wait()
+        stage.end = time.monotonic()
+
+    def _start(self, err_w):
+        """start all the stages, returns the read end of the last stage"""
+        prev_fd = None  # None is the first stage, which gets no input
+        for stage in self.stages:
+            stage.rc = stage.exc = stage.end = None
+            if stage.func is None:
+                stage.start = time.monotonic()
+                stage.proc = subprocess.Popen(
+                    stage.argv, stdin=prev_fd if prev_fd is not None else subprocess.DEVNULL,
+                    stdout=subprocess.PIPE, stderr=err_w)
+                if prev_fd is not None:
+                    os.close(prev_fd)  # the command holds it now
+                # take the raw fd, the next stage (or our reader) owns it
+                prev_fd = os.dup(stage.proc.stdout.fileno())
+                stage.proc.stdout.close()
+                stage.thread = Thread(target=self._wait_command, args=(stage,))
+            else:
+                r, w = os.pipe()
+                stage.thread = Thread(target=self._run_filter, args=(stage, prev_fd, w))
+                prev_fd = r
+            stage.thread.daemon = True
+            stage.thread.start()
+        return prev_fd
+
+    def _kill(self):
+        for stage in self.stages:
+            if stage.proc is not None and stage.proc.poll() is None:
+                stage.proc.kill()
+
+    def run(self, **kwargs):
+        """
+        run the pipeline, the output of the last stage is streamed into the result
+        :param kwargs: show_log, to_console, timeout, pipefail (rc is the last failing stage, not the last stage),
+            dump_file, dump_file_rotate, trace_file
+        :return: ExecResult Object, with a stages list (cmd, rc, time, exc for every stage)
+        """
+        show_log = kwargs.pop('show_log', True)
+        to_console = kwargs.pop('to_console', True)
+        timeout = kwargs.pop('timeout', 0)
+        pipefail = kwargs.pop('pipefail', False)
+        dump_file = kwargs.pop('dump_file', None)
+        dump_file_rotate = kwargs.pop('dump_file_rotate', False)
+        trace_file = kwargs.pop('trace_file', None)
+        assert self.stages, 'empty pipeline'
+
+        cmd = self.cmd
+        if show_log:
+            log.info('exec pipeline: {}'.format(cmd))
+
+        stdout = []
+        stderr = []
+        ordered_out = []
+
+        def _on_out(line):
+            if to_console:
+                sys.stdout.write(line)
+            stdout.append(line)
+            ordered_out.append(line)
+
+        def _on_err(line):
+            if to_console:
+                sys.stderr.write(line)
+            stderr.append(line)
+            ordered_out.append(line)
+
+        start_time = time.time()
+        start_monotonic = time.monotonic()
+        deadline = start_monotonic + timeout if timeout else None
+        err_r, err_w = os.pipe()
+        try:
+            out_fd = self._start(err_w)
+        except Exception:
+            # a command could not be started, stop the ones that were
+            self._kill()
+            os.close(err_r)
+            raise
+        finally:
+            os.close(err_w)
+
+        timed_out = False
+        pipes = {out_fd: _PipeLines(_on_out, True), err_r: _PipeLines(_on_err, True)}
+        while pipes:
+            select_timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            ready, _, _ = select.select(list(pipes), [], [], select_timeout)
+            for fd in ready:
+                chunk = os.read(fd, READ_CHUNK_SIZE)
+                if chunk:
+                    pipes[fd].feed(chunk)
+                else:
+                    pipes.pop(fd).close()
+                    os.close(fd)
+            if pipes and deadline is not None and time.monotonic() >= deadline:
+                log.warning('Timeout executing pipeline, killing: timeout={} cmd={}'.format(timeout, cmd))
+                timed_out = True
+                self._kill()
+                for fd, lines in pipes.items():
+                    lines.close()
+                    os.close(fd)
+                break
+
+        for stage in self.stages:
+            stage.thread.join()
+
+        rcs = [stage.rc for stage in self.stages]
+        rc = rcs[-1]
+        if pipefail:
+            rc = next((stage_rc for stage_rc in reversed(rcs) if stage_rc), 0)
+        time_taken = time.monotonic() - start_monotonic
+        result = ExecResult(stdout, stderr, rc, time_taken, cmd, ordered_out, start_time, timeout, None, timed_out)
+        result.stages = [stage.info() for stage in self.stages]
+
+        if dump_file:
+            result.to_dump_file(dump_file, dump_file_rotate)
+
+        if trace_file:
+            write_file(trace_file, contents=result.append_output(), filemode='a')
+
+        return result
+
+
+__all__ = ['Pipeline']
@@ -0,0 +1,76 @@
+#! /usr/bin/env python
+
+# Standard Imports
+import shutil
+import unittest
+
+# kitir Imports
+from kitir import *
+from kitir._libs import copy_utils
+
+# Logging
+log = logging.getLogger('kitir.lib_tests.copy_utils')
+utils.logging_setup(level=0, log_file=ir_log_dir + '/test_lib_copy_utils.log')
+
+
+class TestSyncCopy(unittest.TestCase):
+
+    def _make_tree(self, name):
+        src_dir = os.path.join(utils.get_tmp_dir(), name)
+        utils.clean_paths(src_dir)
+        for idx in range(20):
+            utils.write_file(os.path.join(src_dir, 'd{}'.format(idx % 4), 'e{}'.format(idx % 2), 'f{}.txt'.format(idx)),
+                             contents='{}\n'.format(idx) * 1000)
+        utils.write_file(os.path.join(src_dir, 'skip.pyc'), contents='ignored')
+        return src_dir
+
+    def test_copy_file(self):
+        src = utils.write_to_tmp_file('x' * 100000)
+        dst = src + '.copy'
+        self.assertEqual(100000, copy_utils.copy_file(src, dst))
+        self.assertEqual('x' * 100000, utils.read_file(dst, as_str=True))
+        self.assertEqual(os.stat(src).st_mtime, os.stat(dst).st_mtime)
+
+    def test_copy_file_hardlinks(self):
+        src = utils.write_to_tmp_file('source')
+        link = src + '.link'
+        utils.clean_paths(link)
+        os.link(src, link)
+        self.assertRaises(shutil.SameFileError, copy_utils.copy_file, src, link)
+        self.assertRaises(shutil.SameFileError, copy_utils.copy_file, src, src)
+        self.assertEqual('source', utils.read_file(src, as_str=True))
+        # a hardlinked dst is replaced, the file it was linked to is not changed
+        other = utils.write_to_tmp_file('other')
+        copy_utils.copy_file(other, link)
+        self.assertEqual('other', utils.read_file(link, as_str=True))
+        self.assertEqual('source', utils.read_file(src, as_str=True))
+        self.assertEqual(1, os.stat(src).st_nlink)
+
+    def test_skip_unchanged(self):
+        src_dir = self._make_tree('test_sync_copy')
+        dst_dir = os.path.join(utils.get_tmp_dir(), 'test_sync_copy.dst')
+        utils.clean_paths(dst_dir)
+        report = copy_utils.sync_copy(src_dir, dst_dir, workers=4, ignore_patterns=['*.pyc'])
+        self.assertEqual(20, report.files_copied)
+        self.assertFalse(os.path.exists(os.path.join(dst_dir, 'skip.pyc')))
+        self.assertEqual('7\n' * 1000, utils.read_file(os.path.join(dst_dir, 'd3', 'e1', 'f7.txt'), as_str=True))
+
+        utils.write_file(os.path.join(src_dir, 'd0', 'e0', 'f0.txt'), contents='changed\n')
+        report = copy_utils.sync_copy(src_dir, dst_dir, ignore_patterns=['*.pyc'])
+        self.assertEqual((1, 19), (report.files_copied, report.files_skipped))
+        self.assertEqual(len('changed\n'), report.bytes_copied)
+        self.assertEqual('changed\n', utils.read_file(os.path.join(dst_dir, 'd0', 'e0', 'f0.txt'), as_str=True))
+
+        # with hash only the content matters
+        os.utime(os.path.join(src_dir, 'd1', 'e1', 'f1.txt'), (0, 0))
+        report = copy_utils.sync_copy(src_dir, dst_dir, skip_unchanged='hash', ignore_patterns=['*.pyc'])
+        self.assertEqual((0, 20), (report.files_copied, report.files_skipped))
+        report = copy_utils.sync_copy(src_dir, dst_dir, skip_unchanged=None, ignore_patterns=['*.pyc'])
+        self.assertEqual(20, report.files_copied)
+
+    def test_errors(self):
+        self.assertRaises(OSError, copy_utils.sync_copy, '/nonexistent/file', utils.get_tmp_dir() + '/nothing')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,6 +3,9 @@
 # Standard Imports
 import unittest
 import time
+import gzip
+import threading
+from unittest import mock
 
 # kitir Imports
 from kitir import *
@@ -111,3 +114,400 @@ class Testiexec(unittest.TestCase):
         # test that we have at least some streaming
         unique_timestamps = set([d['timestamp'] for d in out_lines_with_timestamp])
         self.assertLess(1, len(unique_timestamps))
+
+
+class TestiexecMany(unittest.TestCase):
+
+    def test_collect_all(self):
+        cmds = ['echo {}'.format(i) for i in range(10)]
+        results = list(exec_utils.iexec_many(cmds, max_parallel=3, to_console=False, show_log=False))
+        self.assertEqual(10, len(results))
+        self.assertEqual(sorted(cmds), sorted(r.cmd for r in results))
+        self.assertTrue(all(r.good_rc for r in results))
+
+    def test_collect_all_bad_command(self):
+        cmds = [['echo', 'a'], ['/no/such/executable'], ['echo', 'b']]
+        results = list(exec_utils.iexec_many(cmds, max_parallel=1, shell=False, to_console=False, show_log=False))
+        self.assertEqual(3, len(results))
+        bad = [r for r in results if r.bad_rc]
+        self.assertEqual(1, len(bad))
+        self.assertIsInstance(bad[0].exception, FileNotFoundError)
+        self.assertEqual(['/no/such/executable'], bad[0].cmd)
+        self.assertEqual(['a\n', 'b\n'], sorted(r.out_string for r in results if r.good_rc))
+
+    def test_fail_fast(self):
+        cmds = ['exit 3'] + ['echo {}'.format(i) for i in range(10)]
+        results = list(exec_utils.iexec_many(cmds, max_parallel=1, fail_fast=True, to_console=False, show_log=False))
+        self.assertEqual(1, len(results))
+        self.assertEqual(3, results[0].rc)
+
+    def test_summary(self):
+        results = list(exec_utils.iexec_many(['echo hello'], to_console=False, show_log=False))
+        rows = exec_utils.exec_results_summary(results, as_str=False)
+        self.assertEqual(0, rows[0]['rc'])
+        self.assertEqual(len('hello\n'), rows[0]['out_size'])
+        table = exec_utils.exec_results_summary(results)
+        self.assertTrue(table.startswith('rc'))
+        self.assertIn('echo hello', table)
+
+
+@unittest.skipIf(running_on_windows, 'process groups are linux only')
+class TestiexecTimeout(unittest.TestCase):
+
+    def test_silent_command_times_out(self):
+        start = time.monotonic()
+        ret = exec_utils.iexec('echo partial; sleep 30', timeout=1, to_console=False, show_log=False)
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertTrue(ret.timed_out)
+        self.assertTrue(ret.bad_rc)
+        self.assertEqual(['partial\n'], ret.out)
+
+    def test_process_group_killed(self):
+        pid_file = os.path.join(utils.get_tmp_dir(), 'test_process_group_killed.pid')
+        utils.clean_paths(pid_file)
+        cmd = 'sleep 30 & echo $! > {}; wait'.format(pid_file)
+        ret = exec_utils.iexec(cmd, timeout=1, timeout_kill_grace=1, to_console=False, show_log=False)
+        self.assertTrue(ret.timed_out)
+        child_pid = int(utils.read_file(pid_file, as_str=True))
+        time.sleep(0.2)
+        # the orphaned child is either gone or a zombie waiting for init to reap it
+        stat_file = '/proc/{}/stat'.format(child_pid)
+        if os.path.exists(stat_file):
+            self.assertEqual('Z', utils.read_file(stat_file, as_str=True).rsplit(')', 1)[1].split()[0])
+
+    def test_no_timeout(self):
+        ret = exec_utils.iexec('echo done', timeout=10, to_console=False, show_log=False)
+        self.assertFalse(ret.timed_out)
+        self.assertEqual(0, ret.rc)
+        self.assertEqual('done\n', ret.out_string)
+
+
+class TestiexecArgv(unittest.TestCase):
+
+    def test_argv_list_no_shell(self):
+        ret = exec_utils.iexec(['echo', 'a b', '$HOME'], shell=False, to_console=False, show_log=False)
+        self.assertEqual(0, ret.rc)
+        self.assertEqual('a b $HOME\n', ret.out_string)
+        self.assertEqual({'shell': False}, ret.subprocess_kwargs)
+
+    def test_argv_string_is_split(self):
+        ret = exec_utils.iexec('echo "a b"  c', shell=False, to_console=False, show_log=False)
+        self.assertEqual('a b c\n', ret.out_string)
+
+    def test_argv_dump_file(self):
+        tmp_file = os.path.join(utils.get_tmp_dir(), 'test_argv_dump_file.dump.txt')
+        utils.clean_paths(tmp_file)
+        exec_utils.iexec(['echo', 'dumped'], shell=False, dump_file=tmp_file, to_console=False, show_log=False)
+        self.assertIn('dumped', utils.read_file(tmp_file, as_str=True))
+
+
+class TestMultiProcessiexec(unittest.TestCase):
+
+    def test_mpiexec(self):
+        ret = exec_utils.mpiexec('echo pooled', to_console=False, show_log=False)
+        self.assertEqual('pooled\n', ret.out_string)
+        self.assertEqual(0, ret.rc)
+
+    def test_mpiexec_broken_pool(self):
+        exec_utils.mpiexec('true', to_console=False, show_log=False)
+        pool = exec_utils._get_mpiexec_pool()
+        worker = next(iter(pool._processes.values()))
+        worker.kill()
+        worker.join()
+        self.assertTrue(utils.wait_for_callback(lambda: pool._broken or None, timeout=5))
+        for _ in range(2):
+            ret = exec_utils.mpiexec('echo hi', to_console=False, show_log=False)
+            self.assertEqual(['hi\n'], ret.out)
+        self.assertIsNot(pool, exec_utils._get_mpiexec_pool())
+
+    def test_mpiexec_worker_dies_running(self):
+        tmp_file = os.path.join(utils.get_tmp_dir(), 'test_mpiexec_worker_dies_running.txt')
+        utils.clean_paths(tmp_file)
+        self.assertRaises(exec_utils.BrokenProcessPool, exec_utils.mpiexec,
+                          'echo ran >> {}; kill -9 $PPID'.format(tmp_file), to_console=False, show_log=False)
+        self.assertEqual(['ran'], utils.read_file(tmp_file, strip_newlines=True))  # not retried
+        self.assertEqual(['hi\n'], exec_utils.mpiexec('echo hi', to_console=False, show_log=False).out)
+
+    def test_mpiexec_cwd_env(self):
+        exec_utils.mpiexec('true', to_console=False, show_log=False)  # the pool starts in the current cwd
+        cwd = os.getcwd()
+        tmp_dir = os.path.realpath(utils.check_makedir(os.path.join(utils.get_tmp_dir(), 'test_mpiexec_cwd_env')))
+        os.chdir(tmp_dir)
+        os.environ['KITIR_TEST_MPIEXEC'] = 'exported'
+        try:
+            ret = exec_utils.mpiexec('pwd; echo $KITIR_TEST_MPIEXEC', to_console=False, show_log=False)
+        finally:
+            os.chdir(cwd)
+            del os.environ['KITIR_TEST_MPIEXEC']
+        self.assertEqual([tmp_dir + '\n', 'exported\n'], ret.out)
+
+    def test_detached_iexec_result(self):
+        mp = exec_utils.detached_iexec('echo detached', pickle_result=True, to_console=False, show_log=False)
+        ret = mp.wait_read_result()
+        self.assertEqual('detached\n', ret.out_string)
+        self.assertEqual(0, mp.exitcode)
+
+    def test_detached_iexec_large_result(self):
+        mp = exec_utils.detached_iexec('seq 1 200000', pickle_result=True, to_console=False, show_log=False)
+        ret = mp.wait_read_result()
+        self.assertEqual(200000, len(ret.out))
+
+
+class TestiexecCache(unittest.TestCase):
+
+    def test_cache_hit_and_ttl(self):
+        cache = exec_utils.ExecCache(ttl=1)
+        first = exec_utils.iexec('date +%s%N', cache=cache, to_console=False, show_log=False)
+        second = exec_utils.iexec('date +%s%N', cache=cache, to_console=False, show_log=False)
+        self.assertIs(first, second)
+        self.assertEqual((1, 1), (cache.hits, cache.misses))
+        other_cwd = exec_utils.iexec('date +%s%N', cache=cache, cwd='/', to_console=False, show_log=False)
+        self.assertIsNot(first, other_cwd)
+        time.sleep(1.1)
+        third = exec_utils.iexec('date +%s%N', cache=cache, to_console=False, show_log=False)
+        self.assertIsNot(first, third)
+
+    def test_parse_rows_in_key(self):
+        cache = exec_utils.ExecCache()
+        plain = exec_utils.iexec('echo a,b; echo 1,2', cache=cache, to_console=False, show_log=False)
+        parsed = exec_utils.iexec('echo a,b; echo 1,2', cache=cache, parse_rows='csv', to_console=False,
+                                  show_log=False)
+        self.assertIsNone(plain.rows)
+        self.assertEqual([{'a': '1', 'b': '2'}], parsed.rows)
+        self.assertEqual((0, 2), (cache.hits, cache.misses))
+
+    def test_bad_rc_not_cached(self):
+        cache = exec_utils.ExecCache()
+        exec_utils.iexec('exit 1', cache=cache, to_console=False, show_log=False)
+        exec_utils.iexec('exit 1', cache=cache, to_console=False, show_log=False)
+        self.assertEqual((0, 2), (cache.hits, cache.misses))
+
+    def test_lru_and_disk(self):
+        disk_dir = os.path.join(utils.get_tmp_dir(), 'test_lru_and_disk.cache')
+        utils.clean_paths(disk_dir)
+        cache = exec_utils.ExecCache(max_size=1, disk_dir=disk_dir)
+        exec_utils.iexec('echo a', cache=cache, to_console=False, show_log=False)
+        exec_utils.iexec('echo b', cache=cache, to_console=False, show_log=False)
+        self.assertEqual(1, len(cache._entries))
+        self.assertEqual(2, len(os.listdir(disk_dir)))
+        # a new cache (another process) finds the results on disk
+        other = exec_utils.ExecCache(disk_dir=disk_dir)
+        ret = exec_utils.iexec('echo a', cache=other, to_console=False, show_log=False)
+        self.assertEqual('a\n', ret.out_string)
+        self.assertEqual(1, other.hits)
+
+    def test_concurrent_calls_run_once(self):
+        cache = exec_utils.ExecCache()
+        cmds = ['sleep 0.5; date +%s%N'] * 5
+        results = list(exec_utils.iexec_many(cmds, max_parallel=5, cache=cache, to_console=False, show_log=False))
+        self.assertEqual(1, len(set(id(r) for r in results)))
+        self.assertEqual(1, cache.misses)
+
+
+@unittest.skipIf(running_on_windows, 'rusage is linux only')
+class TestiexecRusage(unittest.TestCase):
+
+    def test_rusage_collected(self):
+        cmd = '{} -c "x = bytearray(50 * 1024 * 1024); sum(range(3000000))"'.format(sys.executable)
+        ret = exec_utils.iexec(cmd, to_console=False, show_log=False)
+        self.assertEqual(0, ret.rc)
+        self.assertEqual(list(exec_utils.RUSAGE_FIELDS), list(ret.rusage))
+        self.assertGreater(ret.cpu_time, 0)
+        self.assertGreater(ret.max_rss, 50 * 1024)
+        self.assertIn('max_rss_kb: ', ret.get_dump_header())
+
+    def test_rusage_with_timeout(self):
+        ret = exec_utils.iexec('true', timeout=5, to_console=False, show_log=False)
+        self.assertEqual(0, ret.rc)
+        self.assertEqual(list(exec_utils.RUSAGE_FIELDS), list(ret.rusage))
+        self.assertIsNotNone(ret.cpu_time)
+        # killed on timeout, the rusage of the command is still collected
+        ret = exec_utils.iexec('sleep 5', timeout=0.2, timeout_kill_grace=0.2, to_console=False, show_log=False)
+        self.assertTrue(ret.timed_out)
+        self.assertEqual(list(exec_utils.RUSAGE_FIELDS), list(ret.rusage))
+        # the pipes close before the process exits
+        ret = exec_utils.iexec('exec >&- 2>&-; sleep 5', timeout=0.2, to_console=False, show_log=False)
+        self.assertTrue(ret.timed_out)
+        self.assertEqual(list(exec_utils.RUSAGE_FIELDS), list(ret.rusage))
+
+    def test_rc_from_wait4(self):
+        self.assertEqual(5, exec_utils.iexec('exit 5', to_console=False, show_log=False).rc)
+        self.assertEqual(-9, exec_utils.iexec('kill -9 $$', to_console=False, show_log=False).rc)
+
+
+class TestExecResultSearch(unittest.TestCase):
+
+    def setUp(self):
+        out = ['starting\n', 'ERROR: disk full\n', 'retrying\n', 'error: timeout after 3s\n', 'done']
+        err = ['warning: slow\n']
+        self.ret = exec_utils.ExecResult(out, err, 0, 1, 'cmd', None, time.time())
+
+    def test_contains_many(self):
+        self.assertTrue(self.ret.contains(['disk full', 'slow']))
+        self.assertFalse(self.ret.contains(['disk full', 'missing']))
+        self.assertTrue(self.ret.contains(['disk full', 'missing'], any))
+        # overlapping patterns are all found
+        self.assertTrue(self.ret.contains(['error', 'err', 'rror']))
+        self.assertTrue(self.ret.out_contains(['retry', 'retrying']))
+
+    def test_contains_empty_and_generator(self):
+        self.assertTrue(self.ret.contains([]))
+        self.assertTrue(self.ret.out_contains([]))
+        self.assertTrue(self.ret.err_contains([]))
+        self.assertTrue(self.ret.contains(p for p in ['disk full', 'slow']))
+        self.assertFalse(self.ret.contains(p for p in ['disk full', 'missing']))
+        self.assertTrue(self.ret.contains((p for p in ['missing', 'slow']), any))
+
+    def test_findall(self):
+        found = self.ret.findall(['error', 'disk'], ignore_case=True)
+        self.assertEqual([(2, 'error', 'ERROR'), (2, 'disk', 'disk'), (4, 'error', 'error')], found)
+
+    def test_first_match_regex(self):
+        self.assertEqual((4, r'after \d+s', 'after 3s'), self.ret.first_match([r'after \d+s'], regex=True))
+        self.assertIsNone(self.ret.first_match('nothing'))
+        self.assertEqual((1, 'slow', 'slow'), self.ret.first_match('slow', source='err'))
+
+    def test_grep(self):
+        lines = self.ret.grep(['error', 'full', 'done'], source='out', ignore_case=True)
+        self.assertEqual([(2, 'ERROR: disk full'), (4, 'error: timeout after 3s'), (5, 'done')], lines)
+
+
+class TestiexecAsyncWriter(unittest.TestCase):
+
+    def test_trace_and_dump(self):
+        tmp_dir = os.path.join(utils.get_tmp_dir(), 'test_async_writer')
+        utils.clean_paths(tmp_dir)
+        trace_file = os.path.join(tmp_dir, 'trace.out')
+        dump_file = os.path.join(tmp_dir, 'dump.txt')
+        writer = utils.AsyncFileWriter()
+        for i in range(3):
+            exec_utils.iexec('echo line{}'.format(i), trace_file=trace_file, dump_file=dump_file, dump_file_rotate=True,
+                             async_writer=writer, to_console=False, show_log=False)
+        writer.flush()
+        trace = utils.read_file(trace_file, as_str=True)
+        self.assertEqual(3, trace.count('ExecResult('))
+        self.assertEqual(3, len(os.listdir(tmp_dir)) - 1)  # three rotated dumps and the trace
+        writer.close()
+
+    def test_close_not_started(self):
+        writer = utils.AsyncFileWriter()
+        closer = threading.Thread(target=writer.close, daemon=True)
+        closer.start()
+        closer.join(5)
+        self.assertFalse(closer.is_alive())
+
+    def test_forked_children(self):
+        tmp_dir = os.path.join(utils.get_tmp_dir(), 'test_async_writer_forked')
+        utils.clean_paths(tmp_dir)
+        trace_file = os.path.join(tmp_dir, 'trace.out')
+        writer = utils.AsyncFileWriter()
+        writer.write(os.path.join(tmp_dir, 'started.txt'), 'the parent thread is running\n')
+        previous = exec_utils.set_async_writer(writer)
+        try:
+            for i in range(2):
+                exec_utils.mpiexec('echo pooled{}'.format(i), trace_file=trace_file, to_console=False, show_log=False)
+            mp = exec_utils.detached_iexec('echo detached', trace_file=trace_file, to_console=False, show_log=False)
+            mp.join()
+        finally:
+            exec_utils.set_async_writer(previous)
+        writer.close()
+        self.assertEqual(3, utils.read_file(trace_file, as_str=True).count('ExecResult('))
+
+    def test_size_cap_and_gzip(self):
+        tmp_dir = os.path.join(utils.get_tmp_dir(), 'test_async_writer_gzip')
+        utils.clean_paths(tmp_dir)
+        file_name = os.path.join(tmp_dir, 'trace.out')
+        writer = utils.AsyncFileWriter(max_size=100, compress=True)
+        for i in range(20):
+            writer.write(file_name, 'line {:02}\n'.format(i))
+        writer.close()
+        self.assertTrue(os.path.exists(file_name + '.gz.1'))
+        with gzip.open(file_name + '.gz.1', 'rt') as f:
+            self.assertIn('line 00', f.read())
+
+
+class TestiexecGovernor(unittest.TestCase):
+
+    def _count_max_concurrent(self, governor, count=6):
+        # every command records its start and end, the most overlapping commands can not pass max_children
+        tmp_file = os.path.join(utils.get_tmp_dir(), 'test_governor.{}.txt'.format(id(governor)))
+        utils.clean_paths(tmp_file)
+        cmd = 'echo start >> {f}; sleep 0.2; echo end >> {f}'.format(f=tmp_file)
+        results = list(exec_utils.iexec_many([cmd] * count, max_parallel=count, governor=governor,
+                                             to_console=False, show_log=False))
+        running = most = 0
+        for line in utils.read_file(tmp_file, strip_newlines=True):
+            running += 1 if line == 'start' else -1
+            most = max(most, running)
+        return most, results
+
+    def test_in_process_limit(self):
+        governor = utils.ExecGovernor(2)
+        most, results = self._count_max_concurrent(governor)
+        self.assertEqual(2, most)
+        stats = governor.stats()
+        self.assertEqual(6, stats['acquired'])
+        self.assertEqual(0, stats['running'])
+        self.assertGreater(stats['wait_max'], 0.1)
+        self.assertGreater(max(r.queue_time for r in results), 0.1)
+
+    @unittest.skipIf(running_on_windows, 'file slots are linux only')
+    def test_file_slots(self):
+        slots_dir = os.path.join(utils.get_tmp_dir(), 'test_governor_slots')
+        utils.clean_paths(slots_dir)
+        # governors sharing a slots dir behave like governors in different processes
+        first = utils.ExecGovernor(1, slots_dir=slots_dir)
+        second = utils.ExecGovernor(1, slots_dir=slots_dir)
+        acquired = []
+
+        def _take_second_slot():
+            with second.slot():
+                acquired.append(time.monotonic())
+
+        with first.slot():
+            waiter = threading.Thread(target=_take_second_slot)
+            waiter.start()
+            time.sleep(0.3)
+            self.assertEqual([], acquired)
+            self.assertEqual(1, second.stats()['waiting'])
+            released = time.monotonic()
+        waiter.join(5)
+        self.assertEqual(1, len(acquired))
+        self.assertGreaterEqual(acquired[0], released)
+
+
+class TestiexecParseRows(unittest.TestCase):
+
+    def test_csv(self):
+        cmd = 'echo name,size; echo a,1; echo \'"b,\'; echo \'c",2\'; echo d'
+        seen = []
+        ret = exec_utils.iexec(cmd, parse_rows='csv', on_row=seen.append, to_console=False, show_log=False)
+        self.assertEqual(['name', 'size'], ret.headers)
+        self.assertEqual([{'name': 'a', 'size': '1'}, {'name': 'b,\nc', 'size': '2'}, {'name': 'd', 'size': None}],
+                         ret.rows)
+        self.assertEqual(ret.rows, seen)
+
+    def test_tsv_lists(self):
+        parser = utils.RowParser('tsv', as_dict=False)
+        ret = exec_utils.iexec('printf "a\\tb\\n1\\t2\\n"', parse_rows=parser, to_console=False, show_log=False)
+        self.assertEqual([['a', 'b'], ['1', '2']], ret.rows)
+
+    def test_jsonl(self):
+        ret = exec_utils.iexec('echo \'{"a": 1}\'; echo; echo \'[2]\'', parse_rows='jsonl', to_console=False,
+                               show_log=False)
+        self.assertEqual([{'a': 1}, [2]], ret.rows)
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, utils.RowParser, 'xml')
+
+    def test_unknown_format_does_not_start_command(self):
+        with mock.patch('subprocess.Popen') as popen:
+            self.assertRaises(ValueError, exec_utils.iexec, 'sleep 7.77', parse_rows='xml', to_console=False,
+                              show_log=False)
+        popen.assert_not_called()
+
+    def test_bad_row_kills_command(self):
+        started = time.monotonic()
+        self.assertRaises(ValueError, exec_utils.iexec, 'echo not json; sleep 30', parse_rows='jsonl',
+                          to_console=False, show_log=False)
+        self.assertLess(time.monotonic() - started, 10)
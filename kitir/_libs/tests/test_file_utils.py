@@ -1,11 +1,15 @@
 #! /usr/bin/env python
 
 # Standard Imports
+import io
+import threading
 import unittest
+import zipfile
+from unittest import mock
 
 # kitir Imports
 from kitir import *
-from kitir._libs import file_utils
+from kitir._libs import file_utils, zip_utils
 
 # Logging
 log = logging.getLogger('kitir.lib_tests.file_utils')
@@ -32,3 +36,192 @@ class TestFileSmartCopy(unittest.TestCase):
         file_utils.smart_copy(src_path, dst_path)
         self.assertTrue(os.path.exists(dst_path))
         self.assertEqual('test_file_to_file_dst_dir_missing', utils.read_file(dst_path, as_str=True))
+
+
+class TestFileRotation(unittest.TestCase):
+
+    def _clean_dir(self, name):
+        tmp_dir = os.path.join(utils.get_tmp_dir(), name)
+        utils.clean_paths(tmp_dir)
+        file_utils.rotation_index.clear()
+        return tmp_dir
+
+    def test_rotation(self):
+        file_name = os.path.join(self._clean_dir('test_rotation'), 'file_name.txt')
+        self.assertEqual(file_name, utils.file_rotation(file_name))
+        written = [utils.write_file(file_name, 'x', rotate=True) for _ in range(3)]
+        self.assertEqual(['file_name.txt', 'file_name_rx_1.txt', 'file_name_rx_2.txt'],
+                         [os.path.basename(f) for f in written])
+        self.assertEqual('file_name_rx_3.txt', os.path.basename(utils.file_rotation(file_name)))
+        # a rotation written by someone else is found, without scanning again
+        utils.write_file(os.path.join(os.path.dirname(file_name), 'file_name_rx_3.txt'), 'x')
+        self.assertEqual('file_name_rx_4.txt', os.path.basename(utils.file_rotation(file_name)))
+
+    def test_rotation_after_delete(self):
+        file_name = os.path.join(self._clean_dir('test_rotation_after_delete'), 'dump.txt')
+        written = [utils.write_file(file_name, 'x', rotate=True) for _ in range(3)]
+        utils.clean_paths(*written)
+        self.assertEqual(file_name, utils.write_file(file_name, 'x', rotate=True))
+        self.assertEqual('dump_rx_1.txt', os.path.basename(utils.write_file(file_name, 'x', rotate=True)))
+        # only the highest rotation deleted, by another process
+        os.unlink(os.path.join(os.path.dirname(file_name), 'dump_rx_1.txt'))
+        self.assertEqual('dump_rx_1.txt', os.path.basename(utils.file_rotation(file_name)))
+
+    def test_rotation_scans_once(self):
+        tmp_dir = self._clean_dir('test_rotation_scans_once')
+        for rotation in (0, 1, 7):
+            utils.write_file(os.path.join(tmp_dir, 'file_name_rx_{}.txt'.format(rotation) if rotation else
+                                          'file_name.txt'), 'x')
+        file_name = os.path.join(tmp_dir, 'file_name.txt')
+        with mock.patch.object(file_utils.RotationIndex, '_scan', wraps=file_utils.RotationIndex._scan) as scan:
+            self.assertEqual('file_name_rx_8.txt', os.path.basename(utils.file_rotation(file_name, claim=True)))
+            self.assertEqual('file_name_rx_9.txt', os.path.basename(utils.file_rotation(file_name, claim=True)))
+        self.assertEqual(1, scan.call_count)
+
+    def test_rotation_claim_concurrent(self):
+        file_name = os.path.join(self._clean_dir('test_rotation_claim_concurrent'), 'file_name.txt')
+        claimed = []
+        other_index = file_utils.RotationIndex()  # as if another process claims too
+
+        def _claim(index):
+            for _ in range(20):
+                claimed.append(index.claim(file_name))
+
+        threads = [threading.Thread(target=_claim, args=(index,))
+                   for index in (file_utils.rotation_index, other_index) * 2]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(80, len(set(claimed)))
+        self.assertEqual(80, len(os.listdir(os.path.dirname(file_name))))
+
+
+class TestZip(unittest.TestCase):
+
+    def _make_tree(self, name):
+        src_dir = os.path.join(utils.get_tmp_dir(), name)
+        utils.clean_paths(src_dir)
+        for idx in range(12):
+            utils.write_file(os.path.join(src_dir, 'sub{}'.format(idx % 3), 'file{}.txt'.format(idx)),
+                             contents='line {}\n'.format(idx) * 1000 * (idx + 1))
+        utils.write_file(os.path.join(src_dir, 'packed.gz'), contents='not really gzip\n' * 100)
+        return src_dir
+
+    def _read_tree(self, directory):
+        contents = {}
+        for dirname, _, files in os.walk(directory):
+            for filename in files:
+                path = os.path.join(dirname, filename)
+                contents[os.path.relpath(path, directory)] = utils.read_file(path, as_str=True)
+        return contents
+
+    def test_zip_dir_parallel(self):
+        src_dir = self._make_tree('test_zip_dir_parallel')
+        serial_zip = os.path.join(utils.get_tmp_dir(), 'test_zip_dir_serial.zip')
+        parallel_zip = os.path.join(utils.get_tmp_dir(), 'test_zip_dir_parallel.zip')
+        self.assertTrue(file_utils.zip_dir(src_dir, serial_zip))
+        self.assertTrue(file_utils.zip_dir(src_dir, parallel_zip, workers=4, compresslevel=9,
+                                           store_extensions=utils.ZIP_STORE_EXTENSIONS))
+        with zipfile.ZipFile(serial_zip) as serial, zipfile.ZipFile(parallel_zip) as parallel:
+            self.assertEqual(serial.namelist(), parallel.namelist())
+            self.assertEqual(zipfile.ZIP_STORED, parallel.getinfo('packed.gz').compress_type)
+            self.assertEqual(zipfile.ZIP_DEFLATED, parallel.getinfo('sub0/file0.txt').compress_type)
+        dst_dir = os.path.join(utils.get_tmp_dir(), 'test_zip_dir_parallel.out')
+        utils.clean_paths(dst_dir)
+        self.assertTrue(file_utils.unzip_dir(parallel_zip, dst_dir))
+        self.assertEqual(self._read_tree(src_dir), self._read_tree(dst_dir))
+
+    def test_zip_files_parallel(self):
+        src_dir = self._make_tree('test_zip_files_parallel')
+        files = sorted(os.path.join(src_dir, 'sub1', name) for name in os.listdir(os.path.join(src_dir, 'sub1')))
+        zip_file = os.path.join(utils.get_tmp_dir(), 'test_zip_files_parallel.zip')
+        self.assertTrue(file_utils.zip_files(files, zip_file, workers=3))
+        with zipfile.ZipFile(zip_file) as zip_ref:
+            self.assertEqual([os.path.basename(f) for f in files], zip_ref.namelist())
+            self.assertIsNone(zip_ref.testzip())
+
+    def test_zip_dir_incremental(self):
+        src_dir = self._make_tree('test_zip_dir_incremental')
+        zip_file = os.path.join(utils.get_tmp_dir(), 'test_zip_dir_incremental.zip')
+        utils.clean_paths(zip_file, zip_utils.zip_manifest_path(zip_file))
+        self.assertTrue(file_utils.zip_dir(src_dir, zip_file, incremental=True))
+        self.assertEqual(13, len(zip_utils.read_zip_manifest(zip_file)))
+
+        utils.write_file(os.path.join(src_dir, 'sub0', 'file0.txt'), contents='changed\n')
+        touched = os.path.join(src_dir, 'sub1', 'file1.txt')
+        utils.write_file(touched, contents=utils.read_file(touched, as_str=True))  # new mtime, same content
+        utils.write_file(os.path.join(src_dir, 'sub2', 'new.txt'), contents='new\n')
+        with mock.patch.object(zip_utils, '_copy_raw_member', wraps=zip_utils._copy_raw_member) as copy_raw:
+            self.assertTrue(file_utils.zip_dir(src_dir, zip_file, incremental=True, workers=2))
+        self.assertEqual(12, copy_raw.call_count)
+        self.assertEqual(14, len(zip_utils.read_zip_manifest(zip_file)))
+        dst_dir = os.path.join(utils.get_tmp_dir(), 'test_zip_dir_incremental.out')
+        utils.clean_paths(dst_dir)
+        self.assertTrue(file_utils.unzip_dir(zip_file, dst_dir))
+        self.assertEqual(self._read_tree(src_dir), self._read_tree(dst_dir))
+
+    def test_validate_levels(self):
+        src_dir = self._make_tree('test_validate_levels')
+        zip_file = os.path.join(utils.get_tmp_dir(), 'test_validate_levels.zip')
+        self.assertTrue(file_utils.zip_dir(src_dir, zip_file, validate='structure'))
+        for level in utils.ZIP_VALIDATE_LEVELS:
+            self.assertTrue(file_utils.validate_zip(zip_file, level=level))
+
+        # corrupt the compressed data of a member, the headers are intact
+        with zipfile.ZipFile(zip_file) as zip_ref:
+            zinfo = zip_ref.getinfo('sub2/file11.txt')
+        with open(zip_file, 'r+b') as f:
+            f.seek(zinfo.header_offset + 30 + len(zinfo.filename) + 10)
+            f.write(b'\xff' * 8)
+        self.assertTrue(file_utils.validate_zip(zip_file, level='structure'))
+        self.assertFalse(file_utils.validate_zip(zip_file, raise_on_fail=False, level='full', workers=4))
+        self.assertRaises(zipfile.BadZipfile, file_utils.validate_zip, zip_file, level='full')
+
+        # a truncated zip file fails the structure check
+        with open(zip_file, 'rb') as f:
+            data = f.read()
+        with open(zip_file, 'wb') as f:
+            f.write(data[:zinfo.header_offset] + data[zinfo.header_offset + 10:])
+        self.assertFalse(file_utils.validate_zip(zip_file, raise_on_fail=False, level='structure'))
+
+    def test_unzip_dir_parallel(self):
+        src_dir = self._make_tree('test_unzip_dir_parallel')
+        zip_file = os.path.join(utils.get_tmp_dir(), 'test_unzip_dir_parallel.zip')
+        self.assertTrue(file_utils.zip_dir(src_dir, zip_file))
+        dst_dir = os.path.join(utils.get_tmp_dir(), 'test_unzip_dir_parallel.out')
+        utils.clean_paths(dst_dir)
+        self.assertTrue(file_utils.unzip_dir(zip_file, dst_dir, validate='structure', workers=4))
+        self.assertEqual(self._read_tree(src_dir), self._read_tree(dst_dir))
+
+        utils.write_file(os.path.join(dst_dir, 'sub0', 'file3.txt'), contents='changed\n')
+        self.assertEqual((1, 12), zip_utils.extract_zip_members(zip_file, dst_dir, workers=4, skip_existing=True))
+        self.assertEqual(self._read_tree(src_dir), self._read_tree(dst_dir))
+
+    def test_zip_to_stream(self):
+        src_dir = self._make_tree('test_zip_to_stream')
+        # an unseekable stream, like a socket or a pipe
+        data = b''.join(file_utils.iter_zip_dir(src_dir, workers=2))
+        buffer = io.BytesIO()
+        self.assertTrue(file_utils.zip_dir(src_dir, buffer))
+        for zip_data in (data, buffer.getvalue()):
+            with zipfile.ZipFile(io.BytesIO(zip_data)) as zip_ref:
+                self.assertIsNone(zip_ref.testzip())
+                self.assertEqual(13, len([name for name in zip_ref.namelist() if not name.endswith('/')]))
+                self.assertEqual('line 0\n' * 1000, zip_ref.read('sub0/file0.txt').decode())
+
+        files = [os.path.join(src_dir, 'sub0', 'file0.txt'), os.path.join(src_dir, 'packed.gz')]
+        read_fd, write_fd = os.pipe()
+
+        def _zip_to_pipe():
+            with os.fdopen(write_fd, 'wb') as pipe:
+                file_utils.zip_files(files, pipe, workers=2)
+
+        writer = threading.Thread(target=_zip_to_pipe)
+        writer.start()
+        with os.fdopen(read_fd, 'rb') as reader:
+            zip_data = reader.read()
+        writer.join()
+        with zipfile.ZipFile(io.BytesIO(zip_data)) as zip_ref:
+            self.assertEqual(['file0.txt', 'packed.gz'], zip_ref.namelist())
+            self.assertIsNone(zip_ref.testzip())
@@ -0,0 +1,50 @@
+#! /usr/bin/env python
+
+# Standard Imports
+import unittest
+
+# kitir Imports
+from kitir import *
+from kitir._libs import find_utils
+
+# Logging
+log = logging.getLogger('kitir.lib_tests.find_utils')
+utils.logging_setup(level=0, log_file=ir_log_dir + '/test_lib_find_utils.log')
+
+
+class TestIterFiles(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tree = os.path.join(utils.get_tmp_dir(), 'test_find_utils')
+        utils.clean_paths(cls.tree)
+        for top in ('a', 'b', '.git'):
+            for sub in ('x', 'y'):
+                for name in ('keep.py', 'keep.txt', 'skip.pyc', 'data.log'):
+                    utils.write_file(os.path.join(cls.tree, top, sub, name), contents=name)
+
+    def _rel(self, paths):
+        return sorted(os.path.relpath(path, self.tree) for path in paths)
+
+    def test_single_pattern_like_os_walk(self):
+        expected = []
+        for root, _, files in os.walk(self.tree):
+            expected.extend(os.path.join(root, f) for f in files if f.endswith('.py'))
+        self.assertEqual(expected, utils.find_files_recursively(self.tree, '*.py'))
+
+    def test_include_exclude(self):
+        found = utils.find_files_recursively(self.tree, ['keep.*', '*.log'], exclude=['*.txt'], exclude_dirs=['.git'])
+        self.assertEqual(self._rel(os.path.join(self.tree, top, sub, name)
+                                   for top in ('a', 'b') for sub in ('x', 'y') for name in ('keep.py', 'data.log')),
+                         self._rel(found))
+
+    def test_parallel(self):
+        serial = list(find_utils.iter_files(self.tree, '*.py*'))
+        parallel = list(find_utils.iter_files(self.tree, '*.py*', workers=4))
+        self.assertEqual(12, len(parallel))
+        self.assertEqual(self._rel(e.path for e in serial), self._rel(e.path for e in parallel))
+        self.assertTrue(all(entry.stat().st_size == len(entry.name) for entry in parallel))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+#! /usr/bin/env python
+
+# Standard Imports
+import unittest
+
+# kitir Imports
+from kitir import *
+from kitir._libs import metrics_utils
+
+# Logging
+log = logging.getLogger('kitir.lib_tests.metrics_utils')
+utils.logging_setup(level=0, log_file=ir_log_dir + '/test_lib_metrics_utils.log')
+
+
+class RecordingHook(utils.ExecHook):
+
+    def __init__(self):
+        self.events = []
+
+    def on_start(self, exec_id, cmd, start, pid):
+        self.events.append(('start', exec_id))
+
+    def on_output_chunk(self, exec_id, cmd, stream, size, elapsed):
+        self.events.append((stream, exec_id))
+
+    def on_exit(self, exec_id, cmd, result):
+        self.events.append(('exit', exec_id))
+
+
+class BrokenHook(utils.ExecHook):
+
+    def on_start(self, exec_id, cmd, start, pid):
+        raise ValueError('broken')
+
+
+@unittest.skipIf(running_on_windows, 'uses linux commands')
+class TestExecMetrics(unittest.TestCase):
+
+    def test_hook_events(self):
+        hook = utils.add_exec_hook(RecordingHook())
+        broken = utils.add_exec_hook(BrokenHook())
+        try:
+            ret = utils.iexec('echo a; echo b >&2', to_console=False, show_log=False)
+        finally:
+            utils.remove_exec_hook(hook)
+            utils.remove_exec_hook(broken)
+        # a failing hook does not fail the command
+        self.assertEqual(0, ret.rc)
+        exec_id = hook.events[0][1]
+        self.assertEqual('start', hook.events[0][0])
+        self.assertEqual(('exit', exec_id), hook.events[-1])
+        self.assertEqual({('out', exec_id), ('err', exec_id)}, set(hook.events[1:-1]))
+
+    def test_report(self):
+        metrics = metrics_utils.ExecMetrics().install()
+        try:
+            for _ in range(3):
+                utils.iexec('/bin/echo hello world', to_console=False, show_log=False)
+            utils.iexec('sleep 0.2', to_console=False, show_log=False)
+            utils.iexec('false', to_console=False, show_log=False)
+        finally:
+            metrics.uninstall()
+        utils.iexec('echo not counted', to_console=False, show_log=False)
+        report = {row['prefix']: row for row in metrics.report()}
+        self.assertEqual({'echo hello', 'sleep 0.2', 'false'}, set(report))
+        self.assertEqual(3, report['echo hello']['count'])
+        self.assertEqual(3 * len('hello world\n'), report['echo hello']['out_bytes'])
+        self.assertEqual(1, report['false']['failed'])
+        self.assertEqual('sleep 0.2', metrics.report()[0]['prefix'])
+        self.assertGreaterEqual(report['sleep 0.2']['p99'], 0.2)
+        self.assertIn('echo hello', metrics.report(as_str=True))
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(50, metrics_utils._percentile(values, 50))
+        self.assertEqual(99, metrics_utils._percentile(values, 99))
+        self.assertEqual(0.0, metrics_utils._percentile([], 90))
+
+
+if __name__ == '__main__':
+    unittest.main()
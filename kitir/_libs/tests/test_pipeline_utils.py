@@ -0,0 +1,53 @@
+#! /usr/bin/env python
+
+# Standard Imports
+import unittest
+
+# kitir Imports
+from kitir import *
+from kitir._libs import pipeline_utils
+
+# Logging
+log = logging.getLogger('kitir.lib_tests.pipeline_utils')
+utils.logging_setup(level=0, log_file=ir_log_dir + '/test_lib_pipeline_utils.log')
+
+
+def upper(lines):
+    for line in lines:
+        yield line.upper()
+
+
+@unittest.skipIf(running_on_windows, 'pipelines use linux commands')
+class TestPipeline(unittest.TestCase):
+
+    def test_commands(self):
+        pipeline = pipeline_utils.Pipeline(['printf', 'b\\na\\nb\\nc\\n'], 'sort', ['uniq', '-c'], 'grep -v c')
+        ret = pipeline.run(to_console=False, show_log=False)
+        self.assertEqual(0, ret.rc)
+        self.assertEqual(['a', 'b'], [line.split()[1] for line in ret.out])
+        self.assertEqual(4, len(ret.stages))
+        self.assertTrue(all(stage['rc'] == 0 for stage in ret.stages))
+        self.assertEqual("printf 'b\\na\\nb\\nc\\n' | sort | uniq -c | grep -v c", ret.cmd)
+
+    def test_filter_stages(self):
+        pipeline = pipeline_utils.Pipeline('seq 1 5').filter(upper).filter(lambda lines: (l for l in lines if l != '3\n'))
+        pipeline.pipe('tac')
+        ret = pipeline.run(to_console=False, show_log=False)
+        self.assertEqual(['5\n', '4\n', '2\n', '1\n'], ret.out)
+
+    def test_stage_rc_and_pipefail(self):
+        ret = pipeline_utils.Pipeline('sh -c "echo oops >&2; exit 3"', 'cat').run(to_console=False, show_log=False)
+        self.assertEqual(0, ret.rc)
+        self.assertEqual([3, 0], [stage['rc'] for stage in ret.stages])
+        self.assertEqual(['oops\n'], ret.err)
+        ret = pipeline_utils.Pipeline('sh -c "exit 3"', 'cat').run(pipefail=True, to_console=False, show_log=False)
+        self.assertEqual(3, ret.rc)
+
+    def test_early_exit_downstream(self):
+        ret = pipeline_utils.Pipeline('seq 1 1000000', upper, 'head -n 2').run(to_console=False, show_log=False)
+        self.assertEqual(['1\n', '2\n'], ret.out)
+        self.assertEqual(0, ret.rc)
+
+    def test_timeout(self):
+        ret = pipeline_utils.Pipeline('sleep 30', 'cat').run(timeout=1, to_console=False, show_log=False)
+        self.assertTrue(ret.timed_out)
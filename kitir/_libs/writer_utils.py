@@ -0,0 +1,202 @@
+#! /usr/bin/env python
+
+# Standard Imports
+import atexit
+import gzip
+import itertools
+import weakref
+from collections import OrderedDict
+from queue import Queue, Empty
+from threading import Thread, Lock
+
+# Lib Imports
+from .file_utils import check_makedir, file_rotation
+
+# kitir Imports
+from kitir import *
+
+# logging
+log = logging.getLogger('kitir.utils.writer')
+
+
+class AsyncFileWriter(object):
+    """
+    Writes files in a background thread so the caller does not wait on disk I/O.
+    appends are batched and go to file handles that are kept open (up to max_open_files, least recently used closed),
+    contents may be a callable, so formatting the contents happens in the background thread as well.
+    with max_size an appended file that grows past it is rolled over to file_name.1 (replacing an older one),
+    with compress the files are written with gzip (a .gz suffix is added to the file names).
+    in a forked child (mpiexec, detached_iexec) the writes are synchronous: the writer thread is not forked,
+    and the child may exit with os._exit, without atexit, which would lose whatever is still queued.
+    """
+
+    writer_counter = itertools.count()
+    # the most queued writes handled before flushing the open files
+    batch_size = 256
+
+    def __init__(self, max_size=None, compress=False, max_open_files=64, **kwargs):
+        self.max_size = max_size
+        self.compress = compress
+        self.max_open_files = max_open_files
+        self.name = kwargs.pop('name', next(self.writer_counter))
+        self._queue = Queue()
+        self._handles = OrderedDict()  # file_name: open file, in least recently used order
+        self._thread = None
+        self._start_lock = Lock()
+        self._forked = False
+        _writers.add(self)
+
+    @property
+    def identification(self):
+        return '{}({})'.format(self.__class__.__name__, self.name)
+
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = Thread(target=self._run, name=self.identification)
+                self._thread.daemon = True
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _after_fork_in_child(self):
+        """the thread, queue and locks of the parent are not usable in a forked child"""
+        self._forked = True
+        self._thread = None
+        self._queue = Queue()
+        self._handles = OrderedDict()  # the parent flushes (and closes) its own handles
+        self._start_lock = Lock()
+
+    def write(self, file_name, contents=None, filemode='a', rotate=False, rotate_rx='_rx_'):
+        """
+        queue a write, same as write_file but returns immediately
+        :param file_name: the file to write (with compress, .gz is added)
+        :param contents: string, list of strings, or a callable returning one of them
+        :param filemode: 'a' to append, 'w' to write the file from scratch
+        :param rotate: write to the next available rotation of file_name (see file_rotation)
+        :param rotate_rx: rotation delimiter
+        """
+        if self._forked:
+            with self._start_lock:
+                self._write_item((file_name, contents, filemode, rotate, rotate_rx))
+                self._close_handles()
+            return
+        self._start()
+        self._queue.put((file_name, contents, filemode, rotate, rotate_rx))
+
+    def flush(self):
+        """wait until everything that was queued is written and flushed"""
+        if self._thread is not None:
+            self._queue.join()
+
+    def close(self):
+        """flush and close all the open files, the writer can still be used after"""
+        if self._thread is None:
+            return  # never started, nothing was queued
+        self.flush()
+        self._queue.put(None)
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            try:
+                while len(items) < self.batch_size:
+                    items.append(self._queue.get_nowait())
+            except Empty:
+                pass
+            for item in items:
+                if item is None:
+                    self._close_handles()
+                    continue
+                self._write_item(item)
+            self._flush_handles()
+            for _ in items:
+                self._queue.task_done()
+
+    def _write_item(self, item):
+        try:
+            self._write(*item)
+        except Exception as exc:
+            log.error('{} exception writing file, ignoring: file={} exc={}'.format(self.identification, item[0], exc))
+
+    def _open(self, file_name, filemode):
+        check_makedir(os.path.dirname(file_name))
+        if self.compress:
+            return gzip.open(file_name, filemode + 't')
+        return open(file_name, filemode)
+
+    def _write(self, file_name, contents, filemode, rotate, rotate_rx):
+        if callable(contents):
+            contents = contents()
+        if self.compress:
+            file_name += '.gz'
+        if rotate:
+            file_name = file_rotation(file_name, rotate_rx=rotate_rx, claim=True)
+        if not contents:
+            contents = ''
+        elif not isinstance(contents, str):
+            if isinstance(contents, list) and isinstance(contents[0], str):
+                contents = ''.join(contents)
+            else:
+                contents = str(contents)
+
+        if filemode != 'a' or rotate:
+            # a whole file, written once, no need to keep it open
+            self._close_handle(file_name)
+            with self._open(file_name, filemode) as f:
+                f.write(contents)
+            return
+
+        handle = self._handles.pop(file_name, None)
+        if handle is None:
+            handle = self._open(file_name, 'a')
+            while len(self._handles) >= self.max_open_files:
+                self._handles.popitem(last=False)[1].close()
+        self._handles[file_name] = handle
+        handle.write(contents)
+        if self.max_size and handle.tell() >= self.max_size:
+            self._close_handle(file_name)
+            os.replace(file_name, '{}.1'.format(file_name))
+
+    def _close_handle(self, file_name):
+        handle = self._handles.pop(file_name, None)
+        if handle is not None:
+            handle.close()
+
+    def _close_handles(self):
+        while self._handles:
+            self._handles.popitem()[1].close()
+
+    def _flush_handles(self):
+        for handle in self._handles.values():
+            handle.flush()
+
+
+# all the writers, so they can be reset in forked children
+_writers = weakref.WeakSet()
+
+
+def _after_fork_in_child():
+    for writer in list(_writers):
+        writer._after_fork_in_child()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
+# the writer used by iexec(cmd, async_writer=True), started on first use
+_default_async_writer = None
+_default_async_writer_lock = Lock()
+
+
+def get_async_writer():
+    """gets the shared AsyncFileWriter"""
+    global _default_async_writer
+    with _default_async_writer_lock:
+        if _default_async_writer is None:
+            _default_async_writer = AsyncFileWriter(name='default')
+        return _default_async_writer
+
+
+__all__ = ['AsyncFileWriter', 'get_async_writer']
@@ -0,0 +1,386 @@
+#! /usr/bin/env python
+
+# Standard Imports
+import copy
+import json
+import shutil
+import struct
+import tempfile
+import threading
+import zipfile
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# kitir Imports
+from kitir import *
+
+# logging
+log = logging.getLogger('kitir.utils.zip')
+
+# files with these extensions are already compressed, deflating them again costs cpu and saves nothing
+ZIP_STORE_EXTENSIONS = frozenset([
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.txz', '.7z', '.zst', '.lz4', '.rar',
+    '.jar', '.whl', '.egg', '.apk', '.jpg', '.jpeg', '.png', '.gif', '.webp', '.mp3', '.mp4', '.mkv', '.avi',
+])
+# validate_zip levels: structure checks the headers only, sample also checks the CRC of ZIP_VALIDATE_SAMPLE
+# random members, full checks the CRC of all the members (in parallel threads)
+ZIP_VALIDATE_LEVELS = ('structure', 'sample', 'full')
+ZIP_VALIDATE_SAMPLE = 16
+# extracted files at least this big are preallocated (where posix_fallocate is available)
+ZIP_PREALLOCATE_SIZE = 8 * 1024 * 1024
+# bytes read (and compressed) at once
+ZIP_CHUNK_SIZE = 1024 * 1024
+# compressed members up to this size are kept in memory until they are written, bigger ones spill to a temp file
+ZIP_SPOOL_SIZE = 16 * 1024 * 1024
+
+
+def _member_compress_type(path, store_extensions):
+    return zipfile.ZIP_STORED if os.path.splitext(path)[1].lower() in store_extensions else zipfile.ZIP_DEFLATED
+
+
+def _compress_member(path, arcname, compress_type, compresslevel):
+    """
+    compress a file the way zipfile would, runs in a worker thread (zlib releases the GIL)
+    :return: (ZipInfo with CRC and sizes set, file object holding the compressed bytes)
+    """
+    zinfo = zipfile.ZipInfo.from_file(path, arcname)
+    zinfo.compress_type = compress_type
+    data = tempfile.SpooledTemporaryFile(max_size=ZIP_SPOOL_SIZE)
+    if compress_type == zipfile.ZIP_DEFLATED:
+        level = zlib.Z_DEFAULT_COMPRESSION if compresslevel is None else compresslevel
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    else:
+        compressor = None
+    crc = 0
+    size = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(ZIP_CHUNK_SIZE)
+            if not chunk:
+                break
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            data.write(compressor.compress(chunk) if compressor else chunk)
+    if compressor:
+        data.write(compressor.flush())
+    zinfo.CRC = crc
+    zinfo.file_size = size
+    zinfo.compress_size = data.tell()
+    data.seek(0)
+    return zinfo, data
+
+
+def _write_raw_member(zip_ref, zinfo, data):
+    """
+    append a member whose compressed bytes are ready (CRC and sizes set on zinfo) to a ZipFile open for writing,
+    the bytes are copied as is. the sizes are known so the local header is complete, also on unseekable streams.
+    """
+    zip64 = zinfo.file_size > zipfile.ZIP64_LIMIT or zinfo.compress_size > zipfile.ZIP64_LIMIT
+    zinfo.flag_bits &= ~0x08  # no data descriptor, the header has the sizes
+    with zip_ref._lock:
+        zinfo.header_offset = zip_ref.fp.tell()
+        zip_ref._writecheck(zinfo)
+        zip_ref._didModify = True
+        zip_ref.fp.write(zinfo.FileHeader(zip64))
+        shutil.copyfileobj(data, zip_ref.fp, ZIP_CHUNK_SIZE)
+        zip_ref.filelist.append(zinfo)
+        zip_ref.NameToInfo[zinfo.filename] = zinfo
+        zip_ref.start_dir = zip_ref.fp.tell()
+
+
+def _zip_name(arcname):
+    """the name zipfile gives a file member written with arcname"""
+    return os.path.normpath(os.path.splitdrive(arcname)[1]).replace(os.sep, '/').lstrip('/')
+
+
+def _file_crc(path):
+    crc = 0
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(ZIP_CHUNK_SIZE)
+            if not chunk:
+                return crc
+            crc = zlib.crc32(chunk, crc)
+
+
+class _RawMemberReader(object):
+    """reads the compressed bytes of a member of an open ZipFile, as they are in the archive"""
+
+    def __init__(self, zip_ref, zinfo):
+        zip_ref.fp.seek(zinfo.header_offset)
+        header = zip_ref.fp.read(zipfile.sizeFileHeader)
+        if len(header) != zipfile.sizeFileHeader or header[:4] != zipfile.stringFileHeader:
+            raise zipfile.BadZipfile('bad local file header: member={}'.format(zinfo.filename))
+        name_length, extra_length = struct.unpack('<HH', header[26:30])
+        zip_ref.fp.seek(name_length + extra_length, os.SEEK_CUR)
+        self.fp = zip_ref.fp
+        self.remaining = zinfo.compress_size
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.fp.read(size)
+        self.remaining -= len(data)
+        return data
+
+
+def _copy_raw_member(zip_ref, previous_zip, old_zinfo):
+    """copy a member from previous_zip into zip_ref without decompressing it"""
+    zinfo = copy.copy(old_zinfo)
+    if hasattr(zipfile, '_strip_extra'):
+        # a zip64 extra of the old archive would be written twice, FileHeader adds it when needed
+        zinfo.extra = zipfile._strip_extra(zinfo.extra, (1,))
+    _write_raw_member(zip_ref, zinfo, _RawMemberReader(previous_zip, old_zinfo))
+
+
+def _is_unchanged(path, stat, entry, previous_zip, arcname):
+    """is the file the same as the member recorded in the manifest entry (size, mtime_ns, crc)"""
+    if not entry or previous_zip is None or stat.st_size != entry[0]:
+        return False
+    old_zinfo = previous_zip.NameToInfo.get(arcname)
+    if old_zinfo is None or old_zinfo.flag_bits & 0x01 or old_zinfo.CRC != entry[2]:
+        return False  # missing, encrypted, or the manifest is not of this archive
+    # same size and mtime: unchanged without reading it, else it is unchanged if the content (crc) is the same
+    return stat.st_mtime_ns == entry[1] or _file_crc(path) == entry[2]
+
+
+def write_zip_members(zip_ref, members, workers=1, compresslevel=None, store_extensions=(), **kwargs):
+    """
+    write files into a ZipFile open for writing, in order
+    with workers > 1 the files are compressed in parallel threads and written in order as they are ready
+    (up to 2 * workers compressed members are held at once, see ZIP_SPOOL_SIZE)
+    with previous_zip and manifest (see read_zip_manifest) a file that did not change since previous_zip was made
+    is copied from it as is, only new and changed files are compressed
+    :param zip_ref: zipfile.ZipFile
+    :param members: list of (path, arcname), directories are written as directory entries
+    :param workers: compression threads
+    :param compresslevel: zlib level (0-9), None for the default
+    :param store_extensions: extensions (like ZIP_STORE_EXTENSIONS) that are stored without compression
+    :param kwargs: previous_zip (zipfile.ZipFile open for reading), manifest
+    :return: the manifest of the new archive, dict of arcname: [size, mtime_ns, crc]
+    """
+    previous_zip = kwargs.pop('previous_zip', None)
+    manifest = kwargs.pop('manifest', None) or {}
+    store_extensions = frozenset(ext.lower() for ext in store_extensions)
+    new_manifest = {}
+    copied = 0
+    pool = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+    pending = deque()  # (kind, arcname, stat, item) in member order
+    members = iter(members)
+
+    def _queue_next():
+        """queue members up to (and including) the next one that is compressed"""
+        for path, arcname in members:
+            if os.path.isdir(path):
+                pending.append(('dir', arcname, None, path))
+                continue
+            stat = os.stat(path)
+            name = _zip_name(arcname)
+            if _is_unchanged(path, stat, manifest.get(name), previous_zip, name):
+                pending.append(('copy', name, stat, previous_zip.NameToInfo[name]))
+                continue
+            compress_type = _member_compress_type(path, store_extensions)
+            if pool is None:
+                pending.append(('write', name, stat, (path, arcname, compress_type)))
+            else:
+                pending.append(('compressed', name, stat,
+                                pool.submit(_compress_member, path, arcname, compress_type, compresslevel)))
+            return
+
+    try:
+        for _ in range(2 * workers):
+            _queue_next()
+        while pending:
+            kind, name, stat, item = pending.popleft()
+            if kind == 'dir':
+                zip_ref.write(item, name)
+                continue
+            if kind == 'copy':
+                _copy_raw_member(zip_ref, previous_zip, item)
+                copied += 1
+            elif kind == 'write':
+                path, arcname, compress_type = item
+                if compresslevel is None:
+                    zip_ref.write(path, arcname, compress_type=compress_type)
+                else:
+                    zip_ref.write(path, arcname, compress_type=compress_type, compresslevel=compresslevel)
+            else:
+                zinfo, data = item.result()
+                with data:
+                    _write_raw_member(zip_ref, zinfo, data)
+            new_manifest[name] = [stat.st_size, stat.st_mtime_ns, zip_ref.NameToInfo[name].CRC]
+            _queue_next()
+    finally:
+        if pool is not None:
+            for _, _, _, item in pending:
+                if hasattr(item, 'cancel'):
+                    item.cancel()
+            pool.shutdown()
+    if previous_zip is not None:
+        log.debug('zip members: copied={} compressed={}'.format(copied, len(new_manifest) - copied))
+    return new_manifest
+
+
+def zip_manifest_path(zip_file):
+    """the manifest of an incremental archive is kept next to it"""
+    return zip_file + '.manifest.json'
+
+
+def read_zip_manifest(zip_file):
+    """
+    the manifest of an archive made with zip_dir(incremental=True)
+    :return: dict of arcname: [size, mtime_ns, crc], empty when there is no (valid) manifest or archive
+    """
+    manifest_file = zip_manifest_path(zip_file)
+    if not os.path.isfile(zip_file) or not os.path.isfile(manifest_file):
+        return {}
+    try:
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as exc:
+        log.warning('ignoring invalid zip manifest: manifest={} exc={}'.format(manifest_file, exc))
+        return {}
+    if os.path.getsize(zip_file) != manifest.get('zip_size'):
+        log.debug('ignoring zip manifest of another archive: manifest={}'.format(manifest_file))
+        return {}
+    return manifest.get('members', {})
+
+
+def write_zip_manifest(zip_file, members):
+    """write the manifest (of write_zip_members) of an archive"""
+    with open(zip_manifest_path(zip_file), 'w') as f:
+        json.dump({'zip_size': os.path.getsize(zip_file), 'members': members}, f)
+
+
+def check_zip_structure(zip_ref):
+    """
+    check the local header of every member against the central directory, without reading the data
+    :param zip_ref: zipfile.ZipFile open for reading (opening it parsed the central directory)
+    :return: the name of the first bad member, None if all are good
+    """
+    zip_ref.fp.seek(0, os.SEEK_END)
+    end = zip_ref.fp.tell()
+    for zinfo in zip_ref.infolist():
+        zip_ref.fp.seek(zinfo.header_offset)
+        header = zip_ref.fp.read(zipfile.sizeFileHeader)
+        if len(header) != zipfile.sizeFileHeader or header[:4] != zipfile.stringFileHeader:
+            return zinfo.filename
+        name_length, extra_length = struct.unpack('<HH', header[26:30])
+        name = zip_ref.fp.read(name_length)
+        data_end = zinfo.header_offset + zipfile.sizeFileHeader + name_length + extra_length + zinfo.compress_size
+        if name.decode('utf-8' if zinfo.flag_bits & 0x800 else 'cp437', 'replace') != zinfo.orig_filename or \
+                data_end > end:
+            return zinfo.filename
+    return None
+
+
+def _check_member_crc(zip_ref, name):
+    """read a member to its end, zipfile checks the CRC, returns the name when it is bad"""
+    try:
+        with zip_ref.open(name) as f:
+            while f.read(ZIP_CHUNK_SIZE):
+                pass
+    except (zipfile.BadZipfile, zlib.error, EOFError):
+        return name
+    return None
+
+
+def check_zip_crc(path_to_zip, names=None, workers=None):
+    """
+    decompress members and check their CRC, like ZipFile.testzip but in parallel threads
+    (every thread opens the zip file by itself, ZipFile objects are not shared between threads)
+    :param path_to_zip: the zip file
+    :param names: the members to check, all of them by default
+    :param workers: threads (default: cpu count)
+    :return: the name of the first bad member (in archive order), None if all are good
+    """
+    zip_refs = []
+    local = threading.local()
+
+    def _check(name):
+        if not hasattr(local, 'zip_ref'):
+            local.zip_ref = zipfile.ZipFile(path_to_zip, 'r')
+            zip_refs.append(local.zip_ref)
+        return _check_member_crc(local.zip_ref, name)
+
+    try:
+        if names is None:
+            with zipfile.ZipFile(path_to_zip, 'r') as zip_ref:
+                names = zip_ref.namelist()
+        workers = min(workers or os.cpu_count() or 1, len(names) or 1)
+        if workers <= 1:
+            return next((name for name in names if _check(name)), None)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return next((name for name in pool.map(_check, names) if name), None)
+    finally:
+        for zip_ref in zip_refs:
+            zip_ref.close()
+
+
+def _extract_path(zinfo, directory):
+    """the path a member is extracted to, sanitized the way ZipFile.extract does it"""
+    arcname = os.path.splitdrive(zinfo.filename.replace('/', os.path.sep))[1]
+    invalid_path_parts = ('', os.path.curdir, os.path.pardir)
+    arcname = os.path.sep.join(part for part in arcname.split(os.path.sep) if part not in invalid_path_parts)
+    return os.path.join(directory, arcname)
+
+
+def _extract_member(zip_ref, zinfo, path, skip_existing):
+    """extract one file member, returns False when it was skipped"""
+    if skip_existing and os.path.isfile(path) and os.path.getsize(path) == zinfo.file_size and \
+            _file_crc(path) == zinfo.CRC:
+        return False
+    with zip_ref.open(zinfo) as src, open(path, 'wb') as dst:
+        if zinfo.file_size >= ZIP_PREALLOCATE_SIZE and hasattr(os, 'posix_fallocate'):
+            try:
+                os.posix_fallocate(dst.fileno(), 0, zinfo.file_size)
+            except OSError:
+                pass  # not supported by the file system, it is only an optimization
+        shutil.copyfileobj(src, dst, ZIP_CHUNK_SIZE)
+    return True
+
+
+def extract_zip_members(path_to_zip, directory, workers=None, skip_existing=False):
+    """
+    extract all the members of a zip file, the files in parallel threads
+    all the directories are created first, so the threads only write files
+    :param path_to_zip: the zip file
+    :param directory: directory to extract into
+    :param workers: threads (default: cpu count)
+    :param skip_existing: files that exist with the size and CRC of the member are not written again
+    :return: (extracted, skipped) file counts
+    """
+    with zipfile.ZipFile(path_to_zip, 'r') as zip_ref:
+        members = [(zinfo, _extract_path(zinfo, directory)) for zinfo in zip_ref.infolist()]
+    dirs = set()
+    for zinfo, path in members:
+        dirs.add(path if zinfo.is_dir() else os.path.dirname(path))
+    for path in sorted(dirs):
+        os.makedirs(path, exist_ok=True)
+    files = [(zinfo, path) for zinfo, path in members if not zinfo.is_dir()]
+
+    zip_refs = []
+    local = threading.local()
+
+    def _extract(member):
+        if not hasattr(local, 'zip_ref'):
+            local.zip_ref = zipfile.ZipFile(path_to_zip, 'r')
+            zip_refs.append(local.zip_ref)
+        return _extract_member(local.zip_ref, member[0], member[1], skip_existing)
+
+    try:
+        workers = min(workers or os.cpu_count() or 1, len(files) or 1)
+        if workers <= 1:
+            extracted = sum(1 for member in files if _extract(member))
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                extracted = sum(1 for written in pool.map(_extract, files) if written)
+    finally:
+        for zip_ref in zip_refs:
+            zip_ref.close()
+    return extracted, len(files) - extracted
+
+
+__all__ = ['ZIP_STORE_EXTENSIONS', 'ZIP_VALIDATE_LEVELS', 'write_zip_members', 'check_zip_structure', 'check_zip_crc',
+           'extract_zip_members', 'read_zip_manifest', 'write_zip_manifest', 'zip_manifest_path']
@@ -0,0 +1,278 @@
+#! /usr/bin/env python
+
+# Standard Imports
+import errno
+import hashlib
+import json
+import shutil
+import stat
+import threading
+import time
+
+# kitir Imports
+from kitir import *
+
+if running_on_linux:
+    import fcntl
+
+# Logging
+log = logging.getLogger('kitir.kits.content_store')
+
+# ioctl that makes a file share the blocks of another file (a reflink), on file systems that support it
+FICLONE = 0x40049409
+# how destinations are made from the stored objects, in order of preference
+LINK_MODES = ('hardlink', 'reflink', 'copy')
+
+
+class ContentStoreError(Exception):
+    pass
+
+
+class ContentStore(object):
+    """
+    A content-addressed store of files: every distinct content is kept once, under its sha256 digest,
+    and destinations are hardlinks (or reflinks, or copies) of the stored object.
+    manifests record a tree as relative path: digest, so it can be restored anywhere, and gc removes the
+    objects no manifest references. stored objects are read-only: a hardlinked destination is the object itself,
+    replace it (write a new file and rename it) instead of writing into it.
+    usage:
+        store = ContentStore()
+        store.put(build_output, os.path.join(ir_artifact_dir, 'run1', 'app.bin'))
+        store.store_tree(fixtures_dir, 'fixtures-v3')
+        store.restore('fixtures-v3', work_dir)
+    """
+
+    digest_name = 'sha256'
+    read_chunk_size = 1024 * 1024
+    # gc leaves the temporary files of adds in progress alone, unless they are this old (seconds, left by a crash)
+    tmp_max_age = 3600
+
+    def __init__(self, root=None, link_mode='hardlink', **kwargs):
+        """
+        :param root: the store directory, should be on the file system of the destinations for hardlinks
+        :param link_mode: the preferred LINK_MODES, falls back to the next ones when it is not possible
+        """
+        assert link_mode in LINK_MODES
+        self.root = root or os.path.join(ir_artifact_dir, 'content_store')
+        self.link_mode = link_mode
+        self.name = kwargs.pop('name', os.path.basename(self.root))
+        self.objects_dir = os.path.join(self.root, 'objects')
+        self.manifests_dir = os.path.join(self.root, 'manifests')
+        self.tmp_dir = os.path.join(self.root, 'tmp')  # objects being added, until their digest is known
+        utils.check_makedir(self.objects_dir)
+        utils.check_makedir(self.manifests_dir)
+        # (path, device, inode, size, mtime_ns): digest, files are hashed once while they do not change
+        self._digests = {}
+        self._lock = threading.Lock()
+
+    @property
+    def identification(self):
+        return '{}({})'.format(self.__class__.__name__, self.name)
+
+    def object_path(self, digest):
+        return os.path.join(self.objects_dir, digest[:2], digest)
+
+    def has(self, digest):
+        return os.path.exists(self.object_path(digest))
+
+    def digest(self, path):
+        """the digest of a file, cached by its stat so an unchanged file is not read again"""
+        st = os.stat(path)
+        key = (os.path.abspath(path), st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        digest = self._digests.get(key)
+        if digest is None:
+            hasher = hashlib.new(self.digest_name)
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(self.read_chunk_size), b''):
+                    hasher.update(chunk)
+            digest = hasher.hexdigest()
+            with self._lock:
+                self._digests[key] = digest
+        return digest
+
+    def add(self, path):
+        """
+        store a file (if its content is not stored already)
+        :param path: the file
+        :return: the digest of its content
+        """
+        digest = self.digest(path)
+        if not os.path.exists(self.object_path(digest)):
+            # the digest of the object is taken from the bytes copied, the file may have changed since digest()
+            digest = self._store_copy(path)
+            log.trace('{} stored: digest={} path={}'.format(self.identification, digest, path))
+        return digest
+
+    def _store_copy(self, path):
+        """copy a file into the store, hashing what is copied, returns the digest"""
+        utils.check_makedir(self.tmp_dir)
+        tmp_path = os.path.join(self.tmp_dir, '{}.{}.tmp'.format(os.getpid(), threading.get_ident()))
+        try:
+            # a hardlink of the source would change when the source does, so the object is a copy
+            hasher = hashlib.new(self.digest_name)
+            with open(path, 'rb') as src_file, open(tmp_path, 'wb') as tmp_file:
+                for chunk in iter(lambda: src_file.read(self.read_chunk_size), b''):
+                    hasher.update(chunk)
+                    tmp_file.write(chunk)
+            shutil.copystat(path, tmp_path)
+            os.chmod(tmp_path, stat.S_IMODE(os.stat(tmp_path).st_mode) & ~0o222)
+            digest = hasher.hexdigest()
+            object_path = self.object_path(digest)
+            utils.check_makedir(os.path.dirname(object_path))
+            os.replace(tmp_path, object_path)  # atomic, concurrent adds of the same content are fine
+        finally:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+        return digest
+
+    def link(self, digest, dst):
+        """
+        make dst a link (or copy) of a stored object, replacing dst if it exists
+        :param digest: the content
+        :param dst: the destination file
+        :return: the link mode used
+        """
+        object_path = self.object_path(digest)
+        if not os.path.exists(object_path):
+            raise ContentStoreError('{} has no object: digest={}'.format(self.identification, digest))
+        utils.check_makedir(os.path.dirname(os.path.abspath(dst)))
+        tmp_dst = '{}.tmp{}.{}'.format(dst, os.getpid(), threading.get_ident())
+        for mode in LINK_MODES[LINK_MODES.index(self.link_mode):]:
+            try:
+                self._link(mode, object_path, tmp_dst)
+            except OSError as exc:
+                if exc.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.EOPNOTSUPP, errno.ENOTTY,
+                                     errno.EINVAL, errno.EBADF):
+                    raise
+                log.trace('{} {} not possible, falling back: dst={} exc={}'.format(self.identification, mode, dst, exc))
+                if os.path.lexists(tmp_dst):
+                    os.unlink(tmp_dst)
+                continue
+            os.replace(tmp_dst, dst)
+            return mode
+        raise ContentStoreError('{} could not link: digest={} dst={}'.format(self.identification, digest, dst))
+
+    @staticmethod
+    def _link(mode, object_path, dst):
+        if mode == 'hardlink':
+            os.link(object_path, dst)
+        elif mode == 'reflink':
+            if not running_on_linux:
+                raise OSError(errno.EOPNOTSUPP, 'reflinks are linux only')
+            with open(object_path, 'rb') as src_file, open(dst, 'wb') as dst_file:
+                fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        else:
+            utils.copy_file(object_path, dst)
+            os.chmod(dst, stat.S_IMODE(os.stat(dst).st_mode) | stat.S_IWUSR)  # a copy is not the object
+
+    def put(self, src, dst):
+        """
+        store src and make dst a link of it, a deduplicating copy
+        :return: the digest
+        """
+        digest = self.add(src)
+        self.link(digest, dst)
+        return digest
+
+    # manifests
+    def _manifest_path(self, name):
+        return os.path.join(self.manifests_dir, '{}.json'.format(name))
+
+    def write_manifest(self, name, entries):
+        """
+        save a manifest
+        :param name: the manifest name
+        :param entries: dict of relative path: digest
+        """
+        missing = [path for path, digest in entries.items() if not self.has(digest)]
+        if missing:
+            raise ContentStoreError('{} manifest has files that are not stored: name={} paths={}'.format(
+                self.identification, name, missing[:10]))
+        tmp_path = '{}.tmp{}'.format(self._manifest_path(name), os.getpid())
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f, indent=0, sort_keys=True)
+        os.replace(tmp_path, self._manifest_path(name))
+
+    def read_manifest(self, name):
+        """:return: dict of relative path: digest"""
+        try:
+            with open(self._manifest_path(name)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise ContentStoreError('{} has no manifest: name={}'.format(self.identification, name))
+
+    def list_manifests(self):
+        return sorted(f[:-len('.json')] for f in os.listdir(self.manifests_dir) if f.endswith('.json'))
+
+    def remove_manifest(self, name):
+        """remove a manifest, its objects are removed by the next gc unless other manifests reference them"""
+        utils.clean_paths(self._manifest_path(name), log_as_trace=True)
+
+    def store_tree(self, src_dir, name=None):
+        """
+        store all the files of a directory
+        :param src_dir: the directory
+        :param name: save the manifest under this name
+        :return: the manifest, dict of relative path: digest
+        """
+        entries = {}
+        for dirname, _, files in os.walk(src_dir):
+            for filename in files:
+                path = os.path.join(dirname, filename)
+                entries[os.path.relpath(path, src_dir).replace(os.sep, '/')] = self.add(path)
+        if name:
+            self.write_manifest(name, entries)
+        log.debug('{} stored tree: src={} name={} files={}'.format(self.identification, src_dir, name, len(entries)))
+        return entries
+
+    def restore(self, name_or_entries, dst_dir):
+        """
+        make a tree of links of a manifest
+        :param name_or_entries: manifest name, or a manifest (dict of relative path: digest)
+        :param dst_dir: the directory to restore into
+        :return: the number of files linked
+        """
+        entries = name_or_entries if isinstance(name_or_entries, dict) else self.read_manifest(name_or_entries)
+        for rel_path, digest in entries.items():
+            self.link(digest, os.path.join(dst_dir, *rel_path.split('/')))
+        return len(entries)
+
+    def gc(self, dry_run=False):
+        """
+        remove the objects that no manifest references and that are not linked anywhere (hardlink count of 1),
+        and the temporary files of adds older than tmp_max_age
+        :param dry_run: only count what would be removed
+        :return: (objects removed, bytes freed)
+        """
+        referenced = set()
+        for name in self.list_manifests():
+            referenced.update(self.read_manifest(name).values())
+        removed = freed = 0
+        now = time.time()
+        for prefix in os.listdir(self.objects_dir):
+            prefix_dir = os.path.join(self.objects_dir, prefix)
+            for digest in os.listdir(prefix_dir):
+                if digest in referenced:
+                    continue
+                path = os.path.join(prefix_dir, digest)
+                st = os.stat(path)
+                if st.st_nlink > 1:
+                    continue  # a destination still links to it
+                if not dry_run:
+                    os.unlink(path)
+                removed += 1
+                freed += st.st_size
+        for name in os.listdir(self.tmp_dir) if os.path.isdir(self.tmp_dir) else ():
+            path = os.path.join(self.tmp_dir, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue  # the add finished meanwhile
+            if now - st.st_ctime < self.tmp_max_age:
+                continue  # an add in progress (another thread or process), ctime as its mtime is the source's
+            if not dry_run:
+                utils.clean_paths(path, log_as_trace=True)
+            removed += 1
+            freed += st.st_size
+        log.info('{} gc: removed={} freed={} dry_run={}'.format(self.identification, removed, freed, dry_run))
+        return removed, freed
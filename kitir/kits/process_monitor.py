@@ -0,0 +1,276 @@
+#! /usr/bin/env python
+
+# Standard Imports
+import itertools
+import signal
+import threading
+import time
+from collections import OrderedDict
+
+# kitir Imports
+from kitir import *
+
+# Logging
+log = logging.getLogger('kitir.kits.process_monitor')
+
+# the fields of every sample, in the order they are written to the time series file
+SAMPLE_FIELDS = ('time', 'procs', 'cpu_percent', 'rss_kb', 'read_bytes', 'write_bytes', 'fds')
+
+
+def _read_proc_stat(pid):
+    """(ppid, cpu ticks (user+sys), rss pages) of a process from /proc/<pid>/stat, None if it is gone"""
+    try:
+        with open('/proc/{}/stat'.format(pid), 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    # the command name is in parentheses and may contain spaces, the fields after it are fixed
+    fields = data[data.rfind(b')') + 2:].split()
+    return int(fields[1]), int(fields[11]) + int(fields[12]), int(fields[21])
+
+
+def _read_proc_io(pid):
+    """(read_bytes, write_bytes) of a process from /proc/<pid>/io, zeros when it can not be read"""
+    read_bytes = write_bytes = 0
+    try:
+        with open('/proc/{}/io'.format(pid)) as f:
+            for line in f:
+                if line.startswith('read_bytes:'):
+                    read_bytes = int(line.split()[1])
+                elif line.startswith('write_bytes:'):
+                    write_bytes = int(line.split()[1])
+    except OSError:
+        pass
+    return read_bytes, write_bytes
+
+
+def _count_fds(pid):
+    try:
+        return len(os.listdir('/proc/{}/fd'.format(pid)))
+    except OSError:
+        return 0
+
+
+def process_tree(pid):
+    """
+    the pid and all its descendants
+    :param pid: the root of the tree
+    :return: dict of pid: (ppid, cpu ticks, rss pages) for the processes in the tree that are alive
+    """
+    stats = {}
+    children = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            stat = _read_proc_stat(int(entry))
+            if stat is not None:
+                stats[int(entry)] = stat
+                children.setdefault(stat[0], []).append(int(entry))
+    tree = {}
+    pending = [pid] if pid in stats else []
+    while pending:
+        current = pending.pop()
+        tree[current] = stats[current]
+        pending.extend(children.get(current, ()))
+    return tree
+
+
+class ProcessMonitor(object):
+    """
+    Samples the resources of a running process and its descendants from /proc, in a background thread.
+    every interval seconds: number of processes, cpu% (100 is one full core), rss, read/write bytes and open fds,
+    the samples are kept (see samples, peak) and appended to a compact time series file in ir_log_dir.
+    thresholds call a callback once a metric crosses a limit, e.g. kill the process when rss is too high:
+        monitor = ProcessMonitor(pid).add_threshold('rss_kb', 2 * 1024 * 1024, ProcessMonitor.kill_tree).start()
+    to monitor every iexec use MonitorHook, for detached_iexec monitor the pid of its MultiProcess.
+    """
+
+    monitor_counter = itertools.count()
+    _cls_log_dir = os.path.join(ir_log_dir, 'process_monitor')
+    clock_ticks = os.sysconf('SC_CLK_TCK') if running_on_linux else 100
+    page_kb = os.sysconf('SC_PAGE_SIZE') // 1024 if running_on_linux else 4
+
+    def __init__(self, pid, interval=1.0, **kwargs):
+        assert running_on_linux, 'process monitor reads /proc'
+        self.pid = pid
+        self.interval = interval
+        self.name = kwargs.pop('name', next(self.monitor_counter))
+        self.log_file = kwargs.pop('log_file', os.path.join(
+            self._cls_log_dir, 'monitor.{}.{}.tsv'.format(self.name, pid)))
+        self.max_samples = kwargs.pop('max_samples', 3600)
+        self.samples = []
+        self.thresholds = []  # [field, limit, callback, fired]
+        self._stop = threading.Event()
+        self._thread = None
+        self._last_ticks = None
+        self._last_time = None
+
+    @property
+    def identification(self):
+        return '{}({}, pid={})'.format(self.__class__.__name__, self.name, self.pid)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def add_threshold(self, field, limit, callback):
+        """
+        call callback(monitor, sample) once, the first time sample[field] >= limit
+        :param field: one of SAMPLE_FIELDS
+        :param limit: the limit
+        :param callback: callable, e.g. ProcessMonitor.kill_tree
+        :return: self
+        """
+        assert field in SAMPLE_FIELDS
+        self.thresholds.append([field, limit, callback, False])
+        return self
+
+    def start(self):
+        """starts sampling in a background thread, it ends by itself once the process is gone"""
+        if self.running:
+            return self
+        log.debug('{} starting: interval={} log_file={}'.format(self.identification, self.interval, self.log_file))
+        self._stop.clear()
+        if self.log_file:
+            utils.check_makedir(os.path.dirname(self.log_file))
+            utils.write_file(self.log_file, contents='\t'.join(SAMPLE_FIELDS) + '\n', filemode='w')
+        self._thread = threading.Thread(target=self._run, name=self.identification)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """stops sampling (takes a last sample first) and waits for the thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _run(self):
+        while True:
+            sample = self.sample()
+            if sample is None or self._stop.wait(self.interval):
+                break
+        if not self._stop.is_set():
+            log.debug('{} process exited, stopped monitoring'.format(self.identification))
+        else:
+            self.sample()
+
+    def sample(self):
+        """
+        take a sample now, record it, write it and check the thresholds
+        :return: the sample (OrderedDict of SAMPLE_FIELDS), None if the process is gone
+        """
+        tree = process_tree(self.pid)
+        if not tree:
+            return None
+        now = time.monotonic()
+        ticks = sum(stat[1] for stat in tree.values())
+        cpu_percent = 0.0
+        if self._last_time is not None and now > self._last_time:
+            # ticks of processes that exited are lost, never report a negative cpu
+            cpu_percent = max(0.0, 100.0 * (ticks - self._last_ticks) / self.clock_ticks / (now - self._last_time))
+        self._last_ticks, self._last_time = ticks, now
+        read_bytes = write_bytes = fds = 0
+        for pid in tree:
+            proc_read, proc_write = _read_proc_io(pid)
+            read_bytes += proc_read
+            write_bytes += proc_write
+            fds += _count_fds(pid)
+        sample = OrderedDict([
+            ('time', time.time()),
+            ('procs', len(tree)),
+            ('cpu_percent', round(cpu_percent, 1)),
+            ('rss_kb', sum(stat[2] for stat in tree.values()) * self.page_kb),
+            ('read_bytes', read_bytes),
+            ('write_bytes', write_bytes),
+            ('fds', fds),
+        ])
+        self.samples.append(sample)
+        if len(self.samples) > self.max_samples:
+            del self.samples[0]
+        if self.log_file:
+            utils.write_file(self.log_file, contents='\t'.join(str(v) for v in sample.values()) + '\n', filemode='a')
+        self._check_thresholds(sample)
+        return sample
+
+    def _check_thresholds(self, sample):
+        for threshold in self.thresholds:
+            field, limit, callback, fired = threshold
+            if fired or sample[field] < limit:
+                continue
+            threshold[3] = True
+            log.warning('{} threshold crossed: {}={} limit={}'.format(self.identification, field, sample[field], limit))
+            try:
+                callback(self, sample)
+            except Exception as exc:
+                log.error('{} exception in threshold callback, ignoring: exc={}'.format(self.identification, exc))
+
+    def peak(self, field):
+        """the highest value of field in the samples taken"""
+        return max([sample[field] for sample in self.samples] or [0])
+
+    def kill_tree(self, sample=None, sig=signal.SIGKILL):
+        """kill the process and all its descendants, can be used as a threshold callback"""
+        log.warning('{} killing process tree: sig={}'.format(self.identification, sig))
+        # stop the whole tree first, so no process can react to another one dying (exit, spawn new children),
+        # list it again until no new process shows up (one may have forked before it was stopped)
+        stopped = []
+        while True:
+            pids = [pid for pid in process_tree(self.pid) if pid not in stopped]
+            if not pids:
+                break
+            for pid in pids:
+                self._signal(pid, signal.SIGSTOP)
+                stopped.append(pid)
+        for pid in stopped:
+            self._signal(pid, sig)
+        if sig != signal.SIGKILL:
+            for pid in stopped:
+                self._signal(pid, signal.SIGCONT)  # so the stopped processes get sig
+
+    @staticmethod
+    def _signal(pid, sig):
+        try:
+            os.kill(pid, sig)
+        except ProcessLookupError:
+            pass
+
+
+class MonitorHook(utils.ExecHook):
+    """
+    Monitors every iexec while it runs (utils.add_exec_hook(MonitorHook())), thresholds apply to every command.
+    the monitor of the last command is kept on the hook (last_monitor) after it exits, for its samples and peaks
+    """
+
+    def __init__(self, interval=1.0, thresholds=(), **kwargs):
+        """
+        :param interval: seconds between samples
+        :param thresholds: list of (field, limit, callback), see ProcessMonitor.add_threshold
+        :param kwargs: ProcessMonitor kwargs
+        """
+        self.interval = interval
+        self.thresholds = list(thresholds)
+        self.monitor_kwargs = kwargs
+        self.last_monitor = None
+        self._monitors = {}  # exec_id: ProcessMonitor
+        self._lock = threading.Lock()
+
+    def on_start(self, exec_id, cmd, start, pid):
+        monitor = ProcessMonitor(pid, self.interval, name='exec{}'.format(exec_id), **self.monitor_kwargs)
+        for field, limit, callback in self.thresholds:
+            monitor.add_threshold(field, limit, callback)
+        with self._lock:
+            self._monitors[exec_id] = monitor
+        monitor.start()
+
+    def on_exit(self, exec_id, cmd, result):
+        with self._lock:
+            monitor = self._monitors.pop(exec_id, None)
+        if monitor is not None:
+            monitor.stop()
+            self.last_monitor = monitor
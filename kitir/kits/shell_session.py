@@ -0,0 +1,230 @@
+#! /usr/bin/env python
+
+# Standard Imports
+import itertools
+import re
+import select
+import shlex
+import signal
+import subprocess
+import threading
+import time
+import uuid
+
+# kitir Imports
+from kitir import *
+
+# Logging
+log = logging.getLogger('kitir.kits.shell_session')
+
+
+class ShellSessionError(Exception):
+    pass
+
+
+class ShellSession(object):
+    """
+    A long-lived bash process that runs many commands, one after the other, each returning an ExecResult.
+    every command costs a round-trip over pipes instead of starting a new shell (fork/exec) like iexec does.
+    commands run with eval in the same shell, so state (cd, export, functions) is kept between them.
+    a command that exits the shell ends the session, it will be started again on the next command.
+    """
+
+    # class constants
+    session_counter = itertools.count()
+    # bytes to read from a pipe at once
+    read_chunk_size = 65536
+    # seconds to wait between SIGTERM and SIGKILL when closing the session or on a timeout
+    kill_grace = 3
+    # the wrapper sent to the shell for every command, rc and sentinels are printed after the command completes
+    _command_template = (
+        "eval {cmd} </dev/null; "
+        "printf '\\n%s %d\\n' '{sentinel}' $?; "
+        "printf '\\n%s\\n' '{sentinel}' >&2\n"
+    )
+
+    def __init__(self, shell='/bin/bash', cwd=None, env=None, **kwargs):
+        self.shell = shell
+        self.cwd = cwd
+        self.env = env
+        self.name = kwargs.pop('name', next(self.session_counter))
+        self.encoding = kwargs.pop('encoding', 'utf-8')
+        self.proc = None
+        self.command_count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def identification(self):
+        return '{}({})'.format(self.__class__.__name__, self.name)
+
+    @property
+    def alive(self):
+        """is the shell process running"""
+        return self.proc is not None and self.proc.poll() is None
+
+    def start(self):
+        """starts the shell process (does nothing if already running)"""
+        if self.alive:
+            return self
+        log.debug('{} starting: shell={} cwd={}'.format(self.identification, self.shell, self.cwd))
+        self.proc = subprocess.Popen(
+            [self.shell, '--noprofile', '--norc'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            cwd=self.cwd, env=self.env, start_new_session=True, bufsize=0,
+        )
+        return self
+
+    def close(self):
+        """closes the shell process, killing it if it does not exit by itself"""
+        if self.proc is None:
+            return
+        if self.alive:
+            log.debug('{} closing: commands={}'.format(self.identification, self.command_count))
+            try:
+                self.proc.stdin.write(b'exit\n')
+                self.proc.stdin.flush()
+            except OSError:
+                pass
+            try:
+                self.proc.wait(self.kill_grace)
+            except subprocess.TimeoutExpired:
+                self._kill()
+        for pipe in (self.proc.stdin, self.proc.stdout, self.proc.stderr):
+            pipe.close()
+        self.proc.wait()
+        self.proc = None
+
+    def restart(self):
+        """closes and starts the shell process"""
+        self.close()
+        return self.start()
+
+    def _kill(self):
+        """kill the process group of the shell, including any command that is still running"""
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            try:
+                os.killpg(self.proc.pid, sig)
+            except ProcessLookupError:
+                break
+            try:
+                self.proc.wait(self.kill_grace)
+            except subprocess.TimeoutExpired:
+                continue
+            break
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def run(self, cmd, **kwargs):
+        """
+        run a command in the session
+        :param cmd: the command (string, or a list which will be quoted)
+        :param kwargs: show_log, log_as_debug, log_as_trace, timeout, dump_file, dump_file_rotate, trace_file
+        :return: ExecResult Object
+        """
+        show_log = kwargs.pop('show_log', True)
+        log_as_debug = kwargs.pop('log_as_debug', False)
+        log_as_trace = kwargs.pop('log_as_trace', False)
+        timeout = kwargs.pop('timeout', 0)
+        dump_file = kwargs.pop('dump_file', None)
+        dump_file_rotate = kwargs.pop('dump_file_rotate', False)
+        trace_file = kwargs.pop('trace_file', None)
+
+        if not isinstance(cmd, str):
+            cmd = ' '.join(shlex.quote(arg) for arg in cmd)
+
+        if show_log:
+            msg = '{} exec: {}'.format(self.identification, cmd)
+            if log_as_trace:
+                log.trace(msg)
+            elif log_as_debug:
+                log.debug(msg)
+            else:
+                log.info(msg)
+
+        with self._lock:
+            result = self._run(cmd, timeout)
+
+        if dump_file:
+            result.to_dump_file(dump_file, dump_file_rotate)
+
+        if trace_file:
+            utils.write_file(trace_file, contents=result.append_output(), filemode='a')
+
+        return result
+
+    def _run(self, cmd, timeout):
+        """send the command and read until both sentinels (or EOF / timeout), must hold the lock"""
+        self.start()
+        self.command_count += 1
+        sentinel = '__kitir_{}_{}__'.format(uuid.uuid4().hex, self.command_count)
+        out_end = re.compile(r'\n{} (-?\d+)\n$'.format(sentinel).encode())
+        err_end = '\n{}\n'.format(sentinel).encode()
+        # the sentinels end the output, so only the tail of a buffer is searched: out_end is at most this long
+        tail_size = len(sentinel) + 24
+
+        start_time = time.time()
+        start_monotonic = time.monotonic()
+        deadline = start_monotonic + timeout if timeout else None
+        try:
+            self.proc.stdin.write(self._command_template.format(cmd=shlex.quote(cmd), sentinel=sentinel).encode())
+            self.proc.stdin.flush()
+        except OSError as exc:
+            raise ShellSessionError('{} failed sending command: exc={}'.format(self.identification, exc))
+
+        out_fd, err_fd = self.proc.stdout.fileno(), self.proc.stderr.fileno()
+        buffers = {out_fd: bytearray(), err_fd: bytearray()}
+        pending = set(buffers)
+        rc = None
+        timed_out = False
+        while pending:
+            select_timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            ready, _, _ = select.select(list(pending), [], [], select_timeout)
+            for fd in ready:
+                chunk = os.read(fd, self.read_chunk_size)
+                if not chunk:
+                    # the shell exited (the command exited it) so there will be no sentinel on this pipe
+                    pending.discard(fd)
+                    continue
+                buffer = buffers[fd]
+                buffer += chunk
+                if fd == out_fd:
+                    tail_start = max(0, len(buffer) - tail_size)
+                    mo = out_end.search(bytes(buffer[tail_start:]))
+                    if mo:
+                        rc = int(mo.group(1))
+                        del buffer[tail_start + mo.start():]
+                        pending.discard(fd)
+                elif buffer.endswith(err_end):
+                    del buffer[-len(err_end):]
+                    pending.discard(fd)
+            if pending and deadline is not None and time.monotonic() >= deadline:
+                log.warning('{} timeout executing cmd, killing session: timeout={} cmd={}'.format(
+                    self.identification, timeout, cmd))
+                timed_out = True
+                break
+
+        if rc is None:
+            # timeout or the shell has exited, either way this session is done
+            if timed_out:
+                self._kill()
+            rc = self.proc.wait()
+            self.close()
+
+        time_taken = time.monotonic() - start_monotonic
+        out = self._split_lines(buffers[out_fd].decode(self.encoding, errors='replace'))
+        err = self._split_lines(buffers[err_fd].decode(self.encoding, errors='replace'))
+        return utils.ExecResult(out, err, rc, time_taken, cmd, None, start_time, timeout, None, timed_out)
+
+    @staticmethod
+    def _split_lines(text):
+        """split text into lines keeping the newlines, like iexec does"""
+        lines = text.split('\n')
+        last = lines.pop()
+        lines = [line + '\n' for line in lines]
+        if last:
+            lines.append(last)
+        return lines
@@ -0,0 +1,250 @@
+#! /usr/bin/env python
+
+# Standard Imports
+import array
+import itertools
+import pickle
+import signal
+import socket
+import subprocess
+import threading
+from queue import Queue
+
+# kitir Imports
+from kitir import *
+
+# Logging
+log = logging.getLogger('kitir.kits.spawn_server')
+
+# the largest message (request or reply) that can pass over the socket, requests include the env
+MAX_MESSAGE_SIZE = 262144
+# the subprocess kwargs that can be forwarded to the helper, the rest can not be pickled or make no sense remotely
+FORWARDED_KWARGS = ('shell', 'cwd', 'env', 'executable', 'close_fds', 'start_new_session')
+# the subprocess kwargs that are handled by the caller (the pipes are passed back to it)
+IGNORED_KWARGS = ('stdout', 'stderr', 'text', 'universal_newlines', 'bufsize')
+
+
+class SpawnServerError(Exception):
+    pass
+
+
+def _send(sock, message, fds=()):
+    """send one message (and optionally file descriptors) over a SOCK_SEQPACKET socket"""
+    data = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    if len(data) > MAX_MESSAGE_SIZE:
+        raise SpawnServerError('spawn server message too large: size={}'.format(len(data)))
+    ancdata = [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds))] if fds else []
+    sock.sendmsg([data], ancdata)
+
+
+def _recv(sock):
+    """receive one message and any file descriptors passed with it, returns (None, []) when the socket closed"""
+    fds = array.array('i')
+    data, ancdata, _, _ = sock.recvmsg(MAX_MESSAGE_SIZE, socket.CMSG_SPACE(2 * fds.itemsize))
+    for level, kind, cmsg_data in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(cmsg_data[:len(cmsg_data) - (len(cmsg_data) % fds.itemsize)])
+    if not data:
+        return None, list(fds)
+    return pickle.loads(data), list(fds)
+
+
+def serve(sock):
+    """
+    the helper process loop: start a child for every request and pass its stdout/stderr pipes back,
+    then report its rc once it exits. ends when the socket is closed by the caller.
+    """
+    send_lock = threading.Lock()
+
+    def _reply(message, fds=()):
+        with send_lock:
+            _send(sock, message, fds)
+
+    def _report_exit(request_id, proc):
+        _reply(('exit', request_id, proc.wait()))
+
+    while True:
+        request, _ = _recv(sock)
+        if request is None:
+            break
+        request_id, args, popen_kwargs = request
+        try:
+            proc = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                    **popen_kwargs)
+        except Exception as exc:
+            _reply(('error', request_id, exc))
+            continue
+        _reply(('started', request_id, proc.pid), [proc.stdout.fileno(), proc.stderr.fileno()])
+        # the caller holds its own copies of the pipes now
+        proc.stdout.close()
+        proc.stderr.close()
+        waiter = threading.Thread(target=_report_exit, args=(request_id, proc))
+        waiter.daemon = True
+        waiter.start()
+
+
+class SpawnedProcess(object):
+    """
+    A child started by the spawn server, it has the parts of subprocess.Popen that iexec uses;
+    the stdout and stderr pipes are local file objects, the rc arrives from the server when the child exits
+    """
+
+    def __init__(self, args, pid, stdout_fd, stderr_fd):
+        self.args = args
+        self.pid = pid
+        self.stdout = os.fdopen(stdout_fd, 'rb', buffering=0)
+        self.stderr = os.fdopen(stderr_fd, 'rb', buffering=0)
+        self.returncode = None
+        self._exited = threading.Event()
+
+    def _set_returncode(self, rc):
+        self.returncode = rc
+        self._exited.set()
+
+    def poll(self):
+        return self.returncode
+
+    def wait(self, timeout=None):
+        if not self._exited.wait(timeout):
+            raise subprocess.TimeoutExpired(self.args, timeout)
+        return self.returncode
+
+    def send_signal(self, sig):
+        if self.returncode is None:
+            os.kill(self.pid, sig)
+
+    def terminate(self):
+        self.send_signal(signal.SIGTERM)
+
+    def kill(self):
+        self.send_signal(signal.SIGKILL)
+
+
+class SpawnServer(object):
+    """
+    A small helper process that starts children on behalf of this process.
+    forking a process that holds a lot of memory is slow (page tables are copied), so start the server early,
+    while this process is still small, and iexec will ask it to start commands instead of forking itself.
+    usage: utils.set_spawn_server(SpawnServer().start()) or iexec(cmd, spawn_server=server)
+    """
+
+    server_counter = itertools.count()
+
+    def __init__(self, **kwargs):
+        self.name = kwargs.pop('name', next(self.server_counter))
+        self.proc = None
+        self._sock = None
+        self._send_lock = threading.Lock()
+        self._request_counter = itertools.count()
+        self._waiting = {}  # request_id: (args, Queue), for the reply to a spawn request
+        self._processes = {}  # request_id: SpawnedProcess, for the exit report
+        self._reader = None
+
+    @property
+    def identification(self):
+        return '{}({})'.format(self.__class__.__name__, self.name)
+
+    @property
+    def alive(self):
+        return self.proc is not None and self.proc.poll() is None
+
+    def start(self):
+        """starts the helper process, does nothing if it is already running"""
+        assert running_on_linux
+        if self.alive:
+            return self
+        self._sock, helper_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        env = os.environ.copy()
+        package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.path.dirname(package_dir), env.get('PYTHONPATH')]))
+        self.proc = subprocess.Popen(
+            [sys.executable, '-m', 'kitir.kits.spawn_server', str(helper_sock.fileno())],
+            pass_fds=[helper_sock.fileno()], stdin=subprocess.DEVNULL, env=env,
+        )
+        helper_sock.close()
+        self._reader = threading.Thread(target=self._read_replies, name='{}.reader'.format(self.identification))
+        self._reader.daemon = True
+        self._reader.start()
+        log.debug('{} started: pid={}'.format(self.identification, self.proc.pid))
+        return self
+
+    def stop(self):
+        """stops the helper process, children that are still running are not affected"""
+        if self.proc is None:
+            return
+        log.debug('{} stopping'.format(self.identification))
+        self._sock.shutdown(socket.SHUT_RDWR)
+        self._sock.close()
+        try:
+            self.proc.wait(5)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+        self.proc = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def _read_replies(self):
+        """reader thread: hands spawn replies to the waiting caller, and rc's to their SpawnedProcess"""
+        while True:
+            try:
+                reply, fds = _recv(self._sock)
+            except OSError:
+                reply, fds = None, []
+            if reply is None:
+                break
+            kind, request_id, value = reply
+            if kind == 'started':
+                args, queue = self._waiting.pop(request_id)
+                spawned = SpawnedProcess(args, value, *fds)
+                self._processes[request_id] = spawned
+                queue.put(spawned)
+            elif kind == 'error':
+                _, queue = self._waiting.pop(request_id)
+                queue.put(value)
+            elif kind == 'exit':
+                self._processes.pop(request_id)._set_returncode(value)
+        # the server is gone, nobody will report on the children anymore
+        for _, queue in list(self._waiting.values()):
+            queue.put(SpawnServerError('spawn server exited'))
+        for spawned in list(self._processes.values()):
+            spawned._set_returncode(-1)
+
+    def popen(self, args, **kwargs):
+        """
+        start a child in the helper process, a replacement for subprocess.Popen(args, stdout=PIPE, stderr=PIPE)
+        the child runs in the current cwd and os.environ of the caller, unless cwd and env are given
+        :param args: the command (string with shell=True, or an argv)
+        :param kwargs: subprocess kwargs, only FORWARDED_KWARGS are supported
+        :return: SpawnedProcess Object
+        """
+        if not self.alive:
+            raise SpawnServerError('{} is not running'.format(self.identification))
+        unsupported = set(kwargs) - set(FORWARDED_KWARGS) - set(IGNORED_KWARGS)
+        if unsupported:
+            raise ValueError('subprocess kwargs not supported by spawn server: {}'.format(sorted(unsupported)))
+        if kwargs.get('stdout', subprocess.PIPE) != subprocess.PIPE or \
+                kwargs.get('stderr', subprocess.PIPE) != subprocess.PIPE:
+            raise ValueError('spawn server only supports piped stdout and stderr')
+        popen_kwargs = {k: v for k, v in kwargs.items() if k in FORWARDED_KWARGS}
+        # like subprocess.Popen the child gets the current cwd and environment of the caller, not of the helper
+        popen_kwargs['cwd'] = os.path.abspath(popen_kwargs.get('cwd') or os.getcwd())
+        if popen_kwargs.get('env') is None:
+            popen_kwargs['env'] = dict(os.environ)
+        request_id = next(self._request_counter)
+        queue = Queue()
+        self._waiting[request_id] = (args, queue)
+        with self._send_lock:
+            _send(self._sock, (request_id, args, popen_kwargs))
+        reply = queue.get()
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+
+if __name__ == "__main__":
+    serve(socket.socket(fileno=int(sys.argv[1])))
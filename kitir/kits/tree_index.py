@@ -0,0 +1,260 @@
+#! /usr/bin/env python
+
+# Standard Imports
+import bisect
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import defaultdict
+
+# kitir Imports
+from kitir import *
+
+# Logging
+log = logging.getLogger('kitir.kits.tree_index')
+
+
+def glob_to_regex(pattern):
+    """
+    compile a glob over relative paths: * and ? do not cross '/', ** matches any number of directories
+    :param pattern: e.g. 'logs/**/*.txt'
+    :return: compiled regex
+    """
+    parts = []
+    idx = 0
+    while idx < len(pattern):
+        char = pattern[idx]
+        if pattern.startswith('**/', idx):
+            parts.append('(?:.*/)?')
+            idx += 3
+            continue
+        if pattern.startswith('**', idx):
+            parts.append('.*')
+            idx += 2
+            continue
+        if char == '*':
+            parts.append('[^/]*')
+        elif char == '?':
+            parts.append('[^/]')
+        elif char == '[':
+            end = pattern.find(']', idx + 2)
+            if end == -1:
+                parts.append(re.escape(char))
+            else:
+                body = pattern[idx + 1:end]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                parts.append('[{}]'.format(body.replace('\\', '\\\\')))
+                idx = end
+        else:
+            parts.append(re.escape(char))
+        idx += 1
+    return re.compile('(?s:{})\\Z'.format(''.join(parts)))
+
+
+class TreeIndex(object):
+    """
+    An index of the files of a directory tree (path, size, mtime), kept in a file so later runs start from it.
+    refresh() only lists the directories whose mtime changed (a file was added, removed or renamed in them),
+    the other directories are only stat'ed, so a refresh of a large tree that did not change is fast.
+    a file whose content changed (without being replaced) keeps its old size and mtime, unless refresh(stat_files=True).
+    lookups answer from the index: glob, prefix, extension, stat.
+    usage:
+        index = TreeIndex(ir_artifact_dir).refresh()
+        index.glob('**/*.log'), index.prefix('run1/'), index.extension('.zip')
+    """
+
+    _cls_index_dir = os.path.join(ir_artifact_dir, 'tree_index')
+    # a directory modified this recently (ns) may change again within the same mtime, it is listed again next time
+    racy_window = 2 * 10 ** 9
+
+    def __init__(self, root, index_file=None, **kwargs):
+        """
+        :param root: the directory tree
+        :param index_file: where the index is kept (default: in ir_artifact_dir, by root), False to not keep it
+        """
+        self.root = os.path.abspath(root)
+        if index_file is None:
+            index_file = os.path.join(self._cls_index_dir, '{}.json'.format(
+                hashlib.sha1(self.root.encode()).hexdigest()[:16]))
+        self.index_file = index_file
+        self.name = kwargs.pop('name', os.path.basename(self.root))
+        self._dirs = {}  # rel dir: [mtime_ns, [file names], [sub dir names]]
+        self._files = {}  # rel path: [size, mtime_ns]
+        self._sorted = None  # sorted rel paths, for prefix lookups
+        self._extensions = None  # extension: [rel paths]
+        self._lock = threading.RLock()
+        self.load()
+
+    @property
+    def identification(self):
+        return '{}({})'.format(self.__class__.__name__, self.name)
+
+    def __len__(self):
+        return len(self._files)
+
+    def __contains__(self, rel_path):
+        return rel_path in self._files
+
+    # persistence
+    def load(self):
+        """load the kept index, if there is one for this root"""
+        if not self.index_file or not os.path.isfile(self.index_file):
+            return False
+        try:
+            with open(self.index_file) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as exc:
+            log.warning('{} ignoring invalid index file: file={} exc={}'.format(
+                self.identification, self.index_file, exc))
+            return False
+        if data.get('root') != self.root:
+            return False
+        with self._lock:
+            self._dirs = data['dirs']
+            self._files = data['files']
+            self._changed()
+        return True
+
+    def save(self):
+        """keep the index in index_file"""
+        if not self.index_file:
+            return
+        utils.check_makedir(os.path.dirname(self.index_file))
+        tmp_file = '{}.tmp{}'.format(self.index_file, os.getpid())
+        with self._lock:
+            with open(tmp_file, 'w') as f:
+                json.dump({'root': self.root, 'dirs': self._dirs, 'files': self._files}, f, separators=(',', ':'))
+        os.replace(tmp_file, self.index_file)
+
+    # scanning
+    def _abs(self, rel_path):
+        return os.path.join(self.root, *rel_path.split('/')) if rel_path else self.root
+
+    @staticmethod
+    def _join(rel_dir, name):
+        return '{}/{}'.format(rel_dir, name) if rel_dir else name
+
+    def _drop_dir(self, rel_dir):
+        """remove a directory and everything under it from the index"""
+        entry = self._dirs.pop(rel_dir, None)
+        if entry is None:
+            return
+        for name in entry[1]:
+            self._files.pop(self._join(rel_dir, name), None)
+        for name in entry[2]:
+            self._drop_dir(self._join(rel_dir, name))
+
+    def _scan_dir(self, rel_dir, mtime_ns):
+        """list a directory, returns its sub directory names"""
+        old = self._dirs.get(rel_dir)
+        files = []
+        subdirs = []
+        try:
+            with os.scandir(self._abs(rel_dir)) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.name)
+                            continue
+                        st = entry.stat()
+                    except OSError:
+                        continue
+                    files.append(entry.name)
+                    self._files[self._join(rel_dir, entry.name)] = [st.st_size, st.st_mtime_ns]
+        except OSError as exc:
+            log.trace('{} cannot scan directory: dir={} exc={}'.format(self.identification, rel_dir, exc))
+        if old is not None:
+            for name in set(old[1]) - set(files):
+                self._files.pop(self._join(rel_dir, name), None)
+            for name in set(old[2]) - set(subdirs):
+                self._drop_dir(self._join(rel_dir, name))
+        if time.time_ns() - mtime_ns < self.racy_window:
+            mtime_ns = -1
+        self._dirs[rel_dir] = [mtime_ns, files, subdirs]
+        return subdirs
+
+    def refresh(self, stat_files=False, save=True):
+        """
+        bring the index up to date, listing only the directories that changed since the last refresh
+        :param stat_files: also stat the files of unchanged directories, to catch files modified in place
+        :param save: keep the index in index_file
+        :return: self
+        """
+        scanned = 0
+        with self._lock:
+            pending = ['']
+            while pending:
+                rel_dir = pending.pop()
+                try:
+                    mtime_ns = os.stat(self._abs(rel_dir)).st_mtime_ns
+                except OSError:
+                    self._drop_dir(rel_dir)
+                    continue
+                entry = self._dirs.get(rel_dir)
+                if entry is None or entry[0] != mtime_ns:
+                    subdirs = self._scan_dir(rel_dir, mtime_ns)
+                    scanned += 1
+                else:
+                    subdirs = entry[2]
+                    if stat_files:
+                        self._stat_files(rel_dir, entry[1])
+                pending.extend(self._join(rel_dir, name) for name in subdirs)
+            self._changed()
+        log.debug('{} refreshed: dirs={} scanned={} files={}'.format(
+            self.identification, len(self._dirs), scanned, len(self._files)))
+        if save:
+            self.save()
+        return self
+
+    def _stat_files(self, rel_dir, names):
+        for name in names:
+            rel_path = self._join(rel_dir, name)
+            try:
+                st = os.stat(self._abs(rel_path))
+            except OSError:
+                continue
+            self._files[rel_path] = [st.st_size, st.st_mtime_ns]
+
+    def _changed(self):
+        self._sorted = None
+        self._extensions = None
+
+    # lookups, paths are relative to the root with '/' separators, full=True for full paths
+    def _result(self, rel_paths, full):
+        rel_paths = sorted(rel_paths)
+        return [self._abs(rel_path) for rel_path in rel_paths] if full else rel_paths
+
+    def files(self, full=False):
+        return self._result(self._files, full)
+
+    def stat(self, rel_path):
+        """:return: (size, mtime_ns) of a file, None if it is not in the index"""
+        entry = self._files.get(rel_path)
+        return tuple(entry) if entry else None
+
+    def glob(self, pattern, full=False):
+        """files matching a glob over relative paths, ** matches any number of directories"""
+        rx = glob_to_regex(pattern)
+        with self._lock:
+            return self._result((rel_path for rel_path in self._files if rx.match(rel_path)), full)
+
+    def prefix(self, prefix, full=False):
+        """files whose relative path starts with prefix (e.g. a directory 'logs/')"""
+        with self._lock:
+            if self._sorted is None:
+                self._sorted = sorted(self._files)
+            start = bisect.bisect_left(self._sorted, prefix)
+            end = bisect.bisect_left(self._sorted, prefix + '\U0010ffff')
+            return self._result(self._sorted[start:end], full)
+
+    def extension(self, extension, full=False):
+        """files with an extension (e.g. '.log', case insensitive)"""
+        with self._lock:
+            if self._extensions is None:
+                self._extensions = defaultdict(list)
+                for rel_path in self._files:
+                    self._extensions[os.path.splitext(rel_path)[1].lower()].append(rel_path)
+            return self._result(self._extensions.get(extension.lower(), ()), full)
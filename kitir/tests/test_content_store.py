@@ -0,0 +1,87 @@
+#! /usr/bin/env python
+
+# Standard Imports
+import unittest
+from unittest import mock
+
+# kitir Imports
+from kitir import *
+from kitir.kits import content_store
+
+# Logging
+log = logging.getLogger('kitir.tests.content_store')
+utils.logging_setup(level=0, log_file=ir_log_dir + '/test_content_store.log')
+
+
+class TestContentStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = os.path.join(utils.get_tmp_dir(), 'test_content_store')
+        utils.clean_paths(self.tmp_dir)
+        self.store = content_store.ContentStore(os.path.join(self.tmp_dir, 'store'))
+
+    def test_put_dedup(self):
+        src = os.path.join(self.tmp_dir, 'src.bin')
+        utils.write_file(src, contents='payload\n' * 1000)
+        first = os.path.join(self.tmp_dir, 'run1', 'app.bin')
+        second = os.path.join(self.tmp_dir, 'run2', 'app.bin')
+        digest = self.store.put(src, first)
+        self.assertEqual(digest, self.store.put(src, second))
+        self.assertEqual(os.stat(first).st_ino, os.stat(second).st_ino)
+        self.assertEqual(3, os.stat(self.store.object_path(digest)).st_nlink)
+        self.assertEqual('payload\n' * 1000, utils.read_file(second, as_str=True))
+
+    def test_copy_mode(self):
+        store = content_store.ContentStore(self.store.root, link_mode='copy')
+        src = os.path.join(self.tmp_dir, 'src.txt')
+        utils.write_file(src, contents='copy me')
+        dst = os.path.join(self.tmp_dir, 'copied.txt')
+        store.put(src, dst)
+        self.assertNotEqual(os.stat(src).st_ino, os.stat(dst).st_ino)
+        utils.write_file(dst, contents='changed')  # a copy is writable, the object is not touched
+        self.assertEqual('copy me', utils.read_file(store.object_path(store.digest(src)), as_str=True))
+
+    def test_manifest_restore_gc(self):
+        src_dir = os.path.join(self.tmp_dir, 'tree')
+        for idx in range(6):
+            utils.write_file(os.path.join(src_dir, 'd{}'.format(idx % 2), 'f{}.txt'.format(idx)),
+                             contents='same' if idx % 3 else 'file {}'.format(idx))
+        entries = self.store.store_tree(src_dir, 'tree-v1')
+        self.assertEqual(6, len(entries))
+        self.assertEqual(3, len(set(entries.values())))
+        self.assertEqual(['tree-v1'], self.store.list_manifests())
+
+        restored = os.path.join(self.tmp_dir, 'restored')
+        self.assertEqual(6, self.store.restore('tree-v1', restored))
+        self.assertEqual('file 3', utils.read_file(os.path.join(restored, 'd1', 'f3.txt'), as_str=True))
+
+        # referenced objects and linked objects are kept
+        self.assertEqual((0, 0), self.store.gc())
+        self.store.remove_manifest('tree-v1')
+        self.assertEqual((0, 0), self.store.gc())
+        utils.clean_paths(restored)
+        self.assertEqual(3, self.store.gc(dry_run=True)[0])
+        self.assertEqual(3, self.store.gc()[0])
+        self.assertRaises(content_store.ContentStoreError, self.store.restore, 'tree-v1', restored)
+
+    def test_gc_keeps_adds_in_progress(self):
+        tmp_path = os.path.join(self.store.tmp_dir, '1.2.tmp')
+        utils.write_file(tmp_path, contents='in progress')
+        self.assertEqual((0, 0), self.store.gc())
+        self.assertTrue(os.path.exists(tmp_path))
+        self.store.tmp_max_age = 0  # left by a crash
+        self.assertEqual(1, self.store.gc()[0])
+        self.assertFalse(os.path.exists(tmp_path))
+
+    def test_add_digest_of_copied_content(self):
+        src = utils.write_file(os.path.join(self.tmp_dir, 'src.txt'), contents='before')
+        stale = self.store.digest(src)
+        with mock.patch.object(self.store, 'digest', return_value=stale):
+            utils.write_file(src, contents='after')  # changed between digest() and the copy
+            digest = self.store.add(src)
+        self.assertNotEqual(stale, digest)
+        self.assertEqual('after', utils.read_file(self.store.object_path(digest), as_str=True))
+        self.assertFalse(self.store.has(stale))
+
+if __name__ == '__main__':
+    unittest.main()
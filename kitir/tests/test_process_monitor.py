@@ -0,0 +1,56 @@
+#! /usr/bin/env python
+
+# Standard Imports
+import subprocess
+import unittest
+
+# kitir Imports
+from kitir import *
+from kitir.kits import process_monitor
+
+# Logging
+log = logging.getLogger('kitir.tests.process_monitor')
+utils.logging_setup(level=0, log_file=ir_log_dir + '/test_process_monitor.log')
+
+
+@unittest.skipIf(not running_on_linux, 'the process monitor reads /proc')
+class TestProcessMonitor(unittest.TestCase):
+
+    def test_tree_samples(self):
+        proc = subprocess.Popen(['bash', '-c', 'sleep 5 & sleep 5 & wait'])
+        try:
+            with process_monitor.ProcessMonitor(proc.pid, interval=0.1, name='test_tree') as monitor:
+                utils.wait_for_callback(lambda: monitor.peak('procs') >= 3 or None, timeout=5)
+            self.assertEqual(3, monitor.peak('procs'))
+            self.assertGreater(monitor.peak('rss_kb'), 0)
+            self.assertGreater(monitor.peak('fds'), 0)
+            lines = utils.read_file(monitor.log_file, strip_newlines=True)
+            self.assertEqual(list(process_monitor.SAMPLE_FIELDS), lines[0].split('\t'))
+            self.assertEqual(len(monitor.samples), len(lines) - 1)
+        finally:
+            proc.kill()
+            proc.wait()
+
+    def test_threshold_kill(self):
+        proc = subprocess.Popen(['bash', '-c', 'sleep 30 & wait'])
+        crossed = []
+        monitor = process_monitor.ProcessMonitor(proc.pid, interval=0.1, name='test_kill', log_file=None)
+        monitor.add_threshold('procs', 2, lambda m, sample: crossed.append(sample))
+        monitor.add_threshold('procs', 2, process_monitor.ProcessMonitor.kill_tree)
+        monitor.start()
+        self.assertEqual(-9, proc.wait(10))
+        monitor.stop()
+        self.assertEqual(1, len(crossed))
+
+    def test_exec_hook(self):
+        hook = utils.add_exec_hook(process_monitor.MonitorHook(interval=0.05, log_file=None))
+        try:
+            utils.iexec('sleep 0.3', to_console=False, show_log=False)
+        finally:
+            utils.remove_exec_hook(hook)
+        self.assertFalse(hook.last_monitor.running)
+        self.assertGreater(len(hook.last_monitor.samples), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+#! /usr/bin/env python
+
+# Standard Imports
+import unittest
+
+# kitir Imports
+from kitir import *
+from kitir.kits import shell_session
+
+# Logging
+log = logging.getLogger('kitir.tests.shell_session')
+utils.logging_setup(level=0, log_file=ir_log_dir + '/test_shell_session.log')
+
+
+@unittest.skipIf(running_on_windows, 'bash sessions are linux only')
+class TestShellSession(unittest.TestCase):
+
+    def test_out_err_rc(self):
+        with shell_session.ShellSession() as session:
+            ret = session.run('echo out; echo err >&2; exit_code() { return 4; }; exit_code', show_log=False)
+            self.assertEqual(['out\n'], ret.out)
+            self.assertEqual(['err\n'], ret.err)
+            self.assertEqual(4, ret.rc)
+            ret = session.run('printf no-newline', show_log=False)
+            self.assertEqual(['no-newline'], ret.out)
+            self.assertEqual(0, ret.rc)
+
+    def test_state_is_kept(self):
+        with shell_session.ShellSession() as session:
+            session.run('cd / && export KITIR_TEST=value', show_log=False)
+            ret = session.run('echo $PWD $KITIR_TEST', show_log=False)
+            self.assertEqual('/ value\n', ret.out_string)
+
+    def test_exit_restarts(self):
+        with shell_session.ShellSession() as session:
+            ret = session.run('echo bye; exit 7', show_log=False)
+            self.assertEqual(7, ret.rc)
+            self.assertEqual(['bye\n'], ret.out)
+            self.assertFalse(session.alive)
+            ret = session.run('echo back', show_log=False)
+            self.assertEqual(['back\n'], ret.out)
+
+    def test_timeout(self):
+        with shell_session.ShellSession() as session:
+            ret = session.run('echo partial; sleep 30', timeout=1, show_log=False)
+            self.assertTrue(ret.timed_out)
+            self.assertEqual(['partial\n'], ret.out)
+            self.assertEqual(0, session.run('true', show_log=False).rc)
@@ -0,0 +1,52 @@
+#! /usr/bin/env python
+
+# Standard Imports
+import unittest
+
+# kitir Imports
+from kitir import *
+from kitir.kits import spawn_server
+
+# Logging
+log = logging.getLogger('kitir.tests.spawn_server')
+utils.logging_setup(level=0, log_file=ir_log_dir + '/test_spawn_server.log')
+
+
+@unittest.skipIf(running_on_windows, 'spawn server is linux only')
+class TestSpawnServer(unittest.TestCase):
+
+    def test_iexec_through_server(self):
+        with spawn_server.SpawnServer() as server:
+            ret = utils.iexec('echo out; echo err >&2; exit 3', spawn_server=server, to_console=False, show_log=False)
+            self.assertEqual(['out\n'], ret.out)
+            self.assertEqual(['err\n'], ret.err)
+            self.assertEqual(3, ret.rc)
+
+    def test_caller_cwd_and_env(self):
+        tmp_dir = os.path.realpath(utils.check_makedir(os.path.join(utils.get_tmp_dir(), 'test_spawn_server_cwd')))
+        cwd = os.getcwd()
+        with spawn_server.SpawnServer() as server:
+            os.chdir(tmp_dir)
+            os.environ['KITIR_TEST_SPAWN'] = 'exported'
+            try:
+                ret = utils.iexec('pwd; echo $KITIR_TEST_SPAWN', spawn_server=server, to_console=False, show_log=False)
+            finally:
+                os.chdir(cwd)
+                del os.environ['KITIR_TEST_SPAWN']
+        self.assertEqual([tmp_dir + '\n', 'exported\n'], ret.out)
+
+    def test_default_server_and_timeout(self):
+        with spawn_server.SpawnServer() as server:
+            previous = utils.set_spawn_server(server)
+            try:
+                ret = utils.iexec('echo partial; sleep 30', timeout=1, to_console=False, show_log=False)
+            finally:
+                utils.set_spawn_server(previous)
+            self.assertTrue(ret.timed_out)
+            self.assertEqual(['partial\n'], ret.out)
+
+    def test_spawn_error(self):
+        with spawn_server.SpawnServer() as server:
+            with self.assertRaises(FileNotFoundError):
+                utils.iexec(['no-such-command-kitir'], shell=False, spawn_server=server,
+                            to_console=False, show_log=False)
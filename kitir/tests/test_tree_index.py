@@ -0,0 +1,73 @@
+#! /usr/bin/env python
+
+# Standard Imports
+import unittest
+from unittest import mock
+
+# kitir Imports
+from kitir import *
+from kitir.kits import tree_index
+
+# Logging
+log = logging.getLogger('kitir.tests.tree_index')
+utils.logging_setup(level=0, log_file=ir_log_dir + '/test_tree_index.log')
+
+
+class TestTreeIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = os.path.join(utils.get_tmp_dir(), 'test_tree_index')
+        utils.clean_paths(self.tmp_dir)
+        self.tree = os.path.join(self.tmp_dir, 'tree')
+        self.index_file = os.path.join(self.tmp_dir, 'index.json')
+        for top in ('logs', 'bin'):
+            for sub in ('a', 'b'):
+                for name in ('x.log', 'y.LOG', 'z.zip'):
+                    utils.write_file(os.path.join(self.tree, top, sub, name), contents=name)
+
+    def _index(self):
+        # no racy window, the test changes the tree right after scanning it
+        index = tree_index.TreeIndex(self.tree, self.index_file)
+        index.racy_window = 0
+        return index
+
+    def test_lookups(self):
+        index = self._index().refresh()
+        self.assertEqual(12, len(index))
+        self.assertEqual(['logs/a/x.log', 'logs/b/x.log'], index.glob('logs/*/*.log'))
+        self.assertEqual(['bin/a/x.log', 'bin/b/x.log', 'logs/a/x.log', 'logs/b/x.log'], index.glob('**/x.log'))
+        self.assertEqual(['logs/b/x.log', 'logs/b/y.LOG', 'logs/b/z.zip'], index.prefix('logs/b/'))
+        self.assertEqual(8, len(index.extension('.log')))
+        self.assertEqual([os.path.join(self.tree, 'bin', 'a', 'z.zip')], index.extension('.zip', full=True)[:1])
+        self.assertEqual(len('x.log'), index.stat('bin/a/x.log')[0])
+
+    def test_incremental_refresh(self):
+        self._index().refresh()
+        utils.write_file(os.path.join(self.tree, 'logs', 'a', 'new.log'), contents='new')
+        utils.clean_paths(os.path.join(self.tree, 'bin', 'b'), log_as_trace=True)
+        os.utime(os.path.join(self.tree, 'bin'), ns=(0, 0))
+        os.utime(os.path.join(self.tree, 'logs', 'a'), ns=(0, 0))
+
+        index = self._index()
+        self.assertEqual(12, len(index))  # loaded from the index file
+        with mock.patch.object(index, '_scan_dir', wraps=index._scan_dir) as scan_dir:
+            index.refresh()
+        self.assertEqual(['bin', 'logs/a'], sorted(call[0][0] for call in scan_dir.call_args_list))
+        self.assertEqual(10, len(index))
+        self.assertIn('logs/a/new.log', index)
+        self.assertEqual([], index.prefix('bin/b/'))
+
+
+class TestGlobToRegex(unittest.TestCase):
+
+    def test_patterns(self):
+        self.assertTrue(tree_index.glob_to_regex('a/*.txt').match('a/b.txt'))
+        self.assertFalse(tree_index.glob_to_regex('a/*.txt').match('a/b/c.txt'))
+        self.assertTrue(tree_index.glob_to_regex('a/**/c.txt').match('a/c.txt'))
+        self.assertTrue(tree_index.glob_to_regex('a/**/c.txt').match('a/b/d/c.txt'))
+        self.assertTrue(tree_index.glob_to_regex('f[!0-4]?.log').match('f5a.log'))
+        self.assertFalse(tree_index.glob_to_regex('f[!0-4]?.log').match('f3a.log'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -26,6 +26,13 @@ from ._libs.datetime_utils import *
 from ._libs.linux_utils import *
 from ._libs.wait_utils import *
 from ._libs.func_utils import *
+from ._libs.writer_utils import *
+from ._libs.governor_utils import *
+from ._libs.pipeline_utils import *
+from ._libs.metrics_utils import *
+from ._libs.zip_utils import *
+from ._libs.copy_utils import *
+from ._libs.find_utils import *
 
 # logging
 log = logging.getLogger('kitir.utils')